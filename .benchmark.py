@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# requires an activated venv
+# times the core pipeline of loading project files, building contexts, rendering
+# CloudFormation and Terraform templates and calculating template deltas,
+# for every project and alt-config in the test fixtures and in `projects/elife.yaml`.
+#
+# usage:
+#   ./.benchmark.py --output build/benchmark-before.json
+#   ./.benchmark.py --output build/benchmark-after.json
+#   ./.benchmark.py --compare build/benchmark-before.json build/benchmark-after.json
+#
+# comparing two runs exits with a non-zero status if any timing regressed.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# hide any unimportant logging
+logging.disable(logging.CRITICAL)
+
+# import buildercore
+src_dir = os.path.abspath('src')
+sys.path.insert(0, src_dir)
+from buildercore import (  # noqa: E402
+    cfngen,
+    cloudformation,
+    config,
+    project,
+    terraform,
+    utils,
+)
+from buildercore.project import files  # noqa: E402
+
+SUITES = {
+    'fixtures': ['src/tests/fixtures/projects/'],
+    'elife': ['projects/elife.yaml'],
+}
+
+STAGES = [
+    'parse-project-files',
+    'read-project-cache',
+    'expand-all-projects',
+    'build-context',
+    'render-cloudformation',
+    'render-terraform',
+    'template-delta',
+]
+
+def timeit(fn, repeat):
+    "calls `fn` `repeat` times, returning a pair of (the fastest time in seconds, the last result)"
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def switch_suite(path_list):
+    config.PROJECTS_PATH_LIST = path_list
+    files.all_projects.cache_clear()
+    project._project_map.cache_clear()
+
+def bench_project_loading(repeat):
+    "times parsing the project files, reading them from the project cache and expanding every project."
+    results = {}
+    project_cache = config.PROJECT_CACHE
+
+    def parse():
+        files.all_projects.cache_clear()
+        project._project_map.cache_clear()
+        return project._project_map()
+
+    try:
+        config.PROJECT_CACHE = False
+        results['parse-project-files'], _ = timeit(parse, repeat)
+
+        # ensure the cache exists before reading it.
+        config.PROJECT_CACHE = True
+        parse()
+        results['read-project-cache'], _ = timeit(parse, repeat)
+    finally:
+        config.PROJECT_CACHE = project_cache
+
+    def expand():
+        pmap = parse()
+        return [pmap[pname] for pname in pmap]
+    results['expand-all-projects'], _ = timeit(expand, repeat)
+
+    return results
+
+def bench_combination(pname, alt_config, base_template, repeat):
+    "times each stage of the pipeline for a single project and alt-config."
+    results = {}
+    stackname = core_stackname(pname, alt_config)
+
+    def build_context():
+        more_context = {'stackname': stackname}
+        if alt_config:
+            more_context['alt-config'] = alt_config
+        return cfngen.build_context(pname, **more_context)
+    results['build-context'], context = timeit(build_context, repeat)
+
+    results['render-cloudformation'], template = timeit(lambda: cloudformation.render_template(context), repeat)
+    results['render-terraform'], _ = timeit(lambda: terraform.render(context), repeat)
+
+    # the delta between the project's default template and this template.
+    # for the default template this is the common case of 'no changes'.
+    old_template = base_template or json.loads(template)
+    results['template-delta'], _ = timeit(lambda: cfngen.cloudformation_delta(old_template, json.loads(template)), repeat)
+
+    return results, template
+
+def core_stackname(pname, alt_config):
+    return "%s--%s" % (pname, alt_config or 'benchmark')
+
+def bench_suite(suite, pname_list, repeat):
+    results = {}
+    switch_suite(SUITES[suite])
+    results[suite] = bench_project_loading(repeat)
+
+    for pname, pdata in project.aws_projects().items():
+        if pname_list and pname not in pname_list:
+            continue
+        key = "%s/%s" % (suite, pname)
+        results[key], template = bench_combination(pname, None, None, repeat)
+        base_template = json.loads(template)
+        for alt_config in pdata.get('aws-alt', {}):
+            alt_key = "%s/%s" % (key, alt_config)
+            results[alt_key], _ = bench_combination(pname, alt_config, base_template, repeat)
+        utils.errcho("%s (%s alt-configs)" % (key, len(pdata.get('aws-alt', {}))))
+    return results
+
+def totals(results):
+    "returns a map of each stage to the sum of it's timings across all results."
+    stage_totals = dict.fromkeys(STAGES, 0)
+    for timings in results.values():
+        for stage, elapsed in timings.items():
+            stage_totals[stage] += elapsed
+    return stage_totals
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def redirect_output(temp_dir):
+    "points the directories builder writes generated files to at `temp_dir`, leaving the working tree untouched."
+    config.TERRAFORM_DIR = os.path.join(temp_dir, 'terraform')
+    config.CONTEXT_DIR = os.path.join(temp_dir, 'contexts')
+    config.STACK_DIR = os.path.join(temp_dir, 'stacks')
+    config.PROJECT_CACHE_PATH = os.path.join(temp_dir, 'project-cache')
+
+def run(args):
+    results = {}
+    temp_dir, rm_temp_dir = utils.tempdir()
+    try:
+        redirect_output(temp_dir)
+        for suite in args.suite:
+            results.update(bench_suite(suite, args.pname, args.repeat))
+    finally:
+        rm_temp_dir()
+    report = {
+        'meta': {
+            'date': utils.utcnow().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'totals': totals(results),
+    }
+    for stage, elapsed in report['totals'].items():
+        utils.errcho("%-24s %10.2fms" % (stage, elapsed * 1000))
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output)
+        utils.errcho("wrote %s" % args.output)
+    else:
+        print(output)
+    return 0
+
+def compare(old_path, new_path, threshold, min_delta):
+    """compares the timings in two benchmark results, printing a table of any regressions.
+    a regression is a timing that is slower by more than `threshold` (a ratio) *and* by more than `min_delta` seconds.
+    returns a non-zero value if any regressions are found."""
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+
+    def is_regression(old_elapsed, new_elapsed):
+        return new_elapsed > old_elapsed * (1 + threshold) and (new_elapsed - old_elapsed) > min_delta
+
+    row = "%-60s %-24s %10s %10s %8s"
+    print(row % ('name', 'stage', 'old (ms)', 'new (ms)', 'change'))
+
+    def print_row(name, stage, old_elapsed, new_elapsed):
+        change = "%+.0f%%" % ((new_elapsed / old_elapsed - 1) * 100) if old_elapsed else "n/a"
+        print(row % (name, stage, "%.2f" % (old_elapsed * 1000), "%.2f" % (new_elapsed * 1000), change))
+
+    regressions = 0
+    for name, timings in sorted(new['results'].items()):
+        for stage, new_elapsed in timings.items():
+            old_elapsed = old['results'].get(name, {}).get(stage)
+            if old_elapsed is not None and is_regression(old_elapsed, new_elapsed):
+                regressions += 1
+                print_row(name, stage, old_elapsed, new_elapsed)
+
+    print()
+    for stage in STAGES:
+        print_row('(total)', stage, old['totals'].get(stage, 0), new['totals'].get(stage, 0))
+
+    print()
+    print("%s regressions (threshold %.0f%%, minimum %.2fms)" % (regressions, threshold * 100, min_delta * 1000))
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suite', action='append', choices=list(SUITES.keys()),
+                        help="project files to benchmark, may be given multiple times. default is all suites.")
+    parser.add_argument('--pname', action='append', help="only benchmark the given project, may be given multiple times.")
+    parser.add_argument('--repeat', type=int, default=3, help="each timing is the fastest of this many calls.")
+    parser.add_argument('--output', help="path to write JSON results to. default is stdout.")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two JSON results and report regressions.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="a timing this much slower (a ratio) is a regression.")
+    parser.add_argument('--min-delta', type=float, default=0.0005, help="a timing must also be this much slower (seconds) to be a regression.")
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold, args.min_delta)
+
+    args.suite = args.suite or list(SUITES.keys())
+    return run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+if (${test}) {
+    set obj.http.Content-Type = "text/html; charset=us-ascii";
+    synthetic {"${synthetic_response}"};
+    return(deliver);
+}
@@ -20,6 +20,7 @@ def stop_node(stackname, node):
     node_obj = _find_node(node, node_obj_list)
     node_ids = [node_obj.id]
     lifecycle._ec2_connection(stackname).instances.filter(InstanceIds=node_ids).stop()
+    core.invalidate_ec2_inventory(stackname)
 
     def poll_fn():
         return lifecycle._ec2_nodes_states(stackname, node_ids)
@@ -36,6 +37,7 @@ def start_node(stackname, node):
     node_obj = _find_node(node, node_obj_list)
     node_ids = [node_obj.id]
     lifecycle._ec2_connection(stackname).instances.filter(InstanceIds=node_ids).start()
+    core.invalidate_ec2_inventory(stackname)
 
     def poll_fn():
         return lifecycle._ec2_nodes_states(stackname, node_ids)
@@ -64,6 +66,7 @@ def reboot_node(stackname, node):
     node_obj = _find_node(node, node_obj_list)
     node_ids = [node_obj.id]
     lifecycle._ec2_connection(stackname).instances.filter(InstanceIds=node_ids).reboot()
+    core.invalidate_ec2_inventory(stackname)
 
     # unlike stop and start, the state of the instance after a reboot doesn't change from 'running'
     # so we can't do any polling. We just have to hope it goes down and comes back up :(
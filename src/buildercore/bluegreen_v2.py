@@ -1,19 +1,36 @@
 """Performs blue-green actions over a load-balanced stack (ElasticLoadBalancer v2).
 
-The nodes inside a stack are divided into two groups: blue and green.
-Actions are performed separately on the two groups while they are detached from the load balancer."""
+The nodes inside a stack are divided into two groups: blue and green (or more, see `divide`).
+Actions are performed separately on each group while it is detached from the load balancer."""
 
 import logging
+from functools import partial
+
+from kids.cache import cache as cached
 
 from . import cloudformation, core, trop, utils
 
 LOG = logging.getLogger(__name__)
 
+# polling intervals are derived from the health check interval and deregistration delay of the TargetGroups,
+# within these bounds.
+MIN_POLLING_INTERVAL = 1 # seconds
+MAX_POLLING_INTERVAL = 5 # seconds
+
+# waiting never times out sooner than this.
+DEFAULT_TIMEOUT = 600 # seconds
+
+# AWS defaults for TargetGroups, used when a TargetGroup can't be described.
+DEFAULT_HEALTH_CHECK_INTERVAL = 30 # seconds
+DEFAULT_HEALTHY_THRESHOLD = 5
+DEFAULT_DEREGISTRATION_DELAY = 300 # seconds
+
 class SomeOutOfServiceInstancesError(RuntimeError):
     pass
 
+@cached
 def conn(stackname):
-    "returns an ELBv2 connection"
+    "returns an ELBv2 connection, shared by all calls for `stackname`."
     return core.boto_conn(stackname, 'elbv2', client=True)
 
 def find_load_balancer(stackname):
@@ -25,20 +42,19 @@ def info(msg, stackname, node_params):
               'iid_list': ", ".join(node_params['nodes'].keys())}
     LOG.info(msg.format(**kwargs))
 
-def divide_by_colour(node_params):
-    def is_blue(node):
-        return node % 2 == 1
-
-    def is_green(node):
-        return node % 2 == 0
-
-    def subset(is_subset):
+def divide(node_params, num_groups):
+    """divides the nodes in `node_params` into `num_groups` groups by node number.
+    for two groups, the first (blue) has the odd numbered nodes and the second (green) has the even numbered nodes."""
+    def subset(group):
         subset = node_params.copy()
-        subset['nodes'] = {node_id: node for (node_id, node) in node_params['nodes'].items() if is_subset(node)}
+        subset['nodes'] = {node_id: node for (node_id, node) in node_params['nodes'].items() if (node - 1) % num_groups == group}
         subset['public_ips'] = {node_id: ip for (node_id, ip) in node_params['public_ips'].items() if node_id in subset['nodes']}
         return subset
 
-    return subset(is_blue), subset(is_green)
+    return tuple(subset(group) for group in range(num_groups))
+
+def divide_by_colour(node_params):
+    return divide(node_params, 2)
 
 def _target_group_arn_list(stackname):
     "returns a list of `TargetGroup` ARNs for given `stackname`."
@@ -62,11 +78,15 @@ def _target_group_nodes(stackname, node_params=None):
         target_groups[target_group_arn] = [{'Id': ec2_arn} for ec2_arn in ec2_arns]
     return target_groups
 
-def _target_groups(stackname):
-    "returns a map of `{target-group-arn: [{target}, ...], ...}` for all TargetGroups attached to `stackname`"
+def _target_groups(stackname, node_params=None):
+    """returns a map of `{target-group-arn: [{target}, ...], ...}` for all TargetGroups attached to `stackname`.
+    the health of each TargetGroup is fetched concurrently.
+    if `node_params` is `None` then *all* nodes are considered."""
     results = {}
-    for target_group_arn, target_list in _target_group_nodes(stackname).items():
-        target_health = _target_group_health(stackname, target_group_arn)
+    target_group_nodes = _target_group_nodes(stackname, node_params)
+    target_group_health = dict(zip(target_group_nodes, utils.concurrently(partial(_target_group_health, stackname), list(target_group_nodes))))
+    for target_group_arn, target_list in target_group_nodes.items():
+        target_health = target_group_health[target_group_arn]
         target_results = []
         for target in target_list:
             ec2_arn = target['Id']
@@ -93,7 +113,7 @@ def _registered(stackname, node_params):
     "returns a map of {target-arn: healthy?}"
     ec2_arns = node_params['nodes'].keys()
     result = {}
-    for target_group_arn, target_list in _target_groups(stackname).items():
+    for target_group_arn, target_list in _target_groups(stackname, node_params).items():
         for target in target_list:
             if target['Target']['Id'] not in ec2_arns:
                 continue
@@ -103,6 +123,45 @@ def _registered(stackname, node_params):
             result[key] = 'Reason' not in target['TargetHealth']
     return result
 
+def _target_group_timings(stackname):
+    """returns a map of timings for the TargetGroups attached to `stackname`:
+    the time in seconds for a registered target to become healthy and for a deregistered target to finish draining.
+    the slowest TargetGroup is used for each."""
+    target_group_arn_list = _target_group_arn_list(stackname)
+    timings = {
+        'health-check-interval': DEFAULT_HEALTH_CHECK_INTERVAL,
+        'time-to-healthy': DEFAULT_HEALTH_CHECK_INTERVAL * DEFAULT_HEALTHY_THRESHOLD,
+        'deregistration-delay': DEFAULT_DEREGISTRATION_DELAY,
+    }
+    if not target_group_arn_list:
+        return timings
+    c = conn(stackname)
+
+    def deregistration_delay(target_group_arn):
+        attributes = c.describe_target_group_attributes(TargetGroupArn=target_group_arn)['Attributes']
+        attributes = {attribute['Key']: attribute['Value'] for attribute in attributes}
+        return int(attributes.get('deregistration_delay.timeout_seconds', DEFAULT_DEREGISTRATION_DELAY))
+
+    target_group_list = c.describe_target_groups(TargetGroupArns=target_group_arn_list)['TargetGroups']
+    if target_group_list:
+        timings['health-check-interval'] = min(tg['HealthCheckIntervalSeconds'] for tg in target_group_list)
+        timings['time-to-healthy'] = max(tg['HealthCheckIntervalSeconds'] * tg['HealthyThresholdCount'] for tg in target_group_list)
+    timings['deregistration-delay'] = max(utils.concurrently(deregistration_delay, target_group_arn_list))
+    return timings
+
+def _polling(stackname, registering):
+    """returns a pair of `(interval, timeout)` in seconds for polling the TargetGroups of `stackname`.
+    when `registering` the interval follows the health check interval, otherwise it follows the deregistration delay."""
+    timings = _target_group_timings(stackname)
+    if registering:
+        interval = timings['health-check-interval'] / 5
+        timeout = timings['time-to-healthy'] * 2
+    else:
+        interval = timings['deregistration-delay'] / 10
+        timeout = timings['deregistration-delay'] * 2
+    interval = min(max(interval, MIN_POLLING_INTERVAL), MAX_POLLING_INTERVAL)
+    return interval, max(timeout, DEFAULT_TIMEOUT)
+
 # ---
 
 def register(stackname, node_params):
@@ -131,7 +190,8 @@ def wait_registered_any(stackname, node_params):
 
     # needs to be as responsive as possible,
     # to start deregistering the green group as soon as a blue server becomes available
-    utils.call_while(condition, interval=1, timeout=600)
+    interval, timeout = _polling(stackname, registering=True)
+    utils.call_while(condition, interval=interval, timeout=timeout)
 
 def wait_registered_all(stackname, node_params):
     info("Waiting for registration of all on {elb_name}: {iid_list}", stackname, node_params)
@@ -141,7 +201,8 @@ def wait_registered_all(stackname, node_params):
         LOG.info("InService: %s", registered)
         return not all(registered.values())
 
-    utils.call_while(condition, interval=5, timeout=600)
+    interval, timeout = _polling(stackname, registering=True)
+    utils.call_while(condition, interval=interval, timeout=timeout)
 
 def wait_deregistered_all(stackname, node_params):
     info("Waiting for deregistration of all on {elb_name}: {iid_list}", stackname, node_params)
@@ -153,7 +214,8 @@ def wait_deregistered_all(stackname, node_params):
         # return True in registered.values() # bluegreen v1 implementation. typo?
         return all(registered.values())
 
-    utils.call_while(condition, interval=5, timeout=600)
+    interval, timeout = _polling(stackname, registering=False)
+    utils.call_while(condition, interval=interval, timeout=timeout)
 
 def wait_all_in_service(stackname):
     "behaves similarly to `wait_registered_all`, but doesn't filter nodes, has a shorter timeout and more output."
@@ -174,7 +236,7 @@ def wait_all_in_service(stackname):
         exception_class=SomeOutOfServiceInstancesError
     )
 
-def do(single_node_work_fn, node_params):
+def do(single_node_work_fn, node_params, num_groups=2):
     """`node_params` is a dictionary:
         {'stackname': ...,
          'nodes': {
@@ -187,25 +249,22 @@ def do(single_node_work_fn, node_params):
             node-id: ip,
             ...
         }
+    the nodes are divided into `num_groups` groups that are worked on one after the other, see `divide`.
     """
     stackname = node_params['stackname']
 
     wait_all_in_service(stackname)
-    blue, green = divide_by_colour(node_params)
-
-    info("Blue phase on {elb_name}: {iid_list}", stackname, blue)
-    deregister(stackname, blue)
-    wait_deregistered_all(stackname, blue)
-    core.parallel_work(single_node_work_fn, blue)
-
-    # this is the window of time in which old and new servers overlap
-    register(stackname, blue)
-    wait_registered_any(stackname, blue)
-
-    info("Green phase on {elb_name}: {iid_list}", stackname, green)
-    deregister(stackname, green)
-    wait_deregistered_all(stackname, green)
-    core.parallel_work(single_node_work_fn, green)
-    register(stackname, green)
+    group_list = [group for group in divide(node_params, num_groups) if group['nodes']]
+
+    for i, group in enumerate(group_list):
+        info("Phase %s of %s on {elb_name}: {iid_list}" % (i + 1, len(group_list)), stackname, group)
+        deregister(stackname, group)
+        wait_deregistered_all(stackname, group)
+        core.parallel_work(single_node_work_fn, group)
+        register(stackname, group)
+
+        if i + 1 < len(group_list):
+            # this is the window of time in which old and new servers overlap
+            wait_registered_any(stackname, group)
 
     wait_registered_all(stackname, node_params)
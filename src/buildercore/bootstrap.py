@@ -4,11 +4,16 @@ created Cloudformation template.
 The "stackname" parameter these functions take is the name of the cfn template
 without the extension."""
 
+import copy
+import hashlib
 import json
 import logging
 import os
 import re
+import time
+import uuid
 from collections.abc import Iterable
+from functools import partial
 from os.path import join
 
 import backoff
@@ -36,6 +41,9 @@ from .utils import ensure, first, lmap, subdict, yaml_dumps
 
 LOG = logging.getLogger(__name__)
 
+# number of stacks `destroy_many` destroys at once.
+DESTROY_MANY_CONCURRENCY = 4
+
 #
 # utils
 #
@@ -46,31 +54,170 @@ def _put_temporary_script(script_filename):
     remote_script = join('/tmp', os.path.basename(script_filename) + '-' + timestamp_marker)
     return command.put(local_script, remote_script)
 
+#
+# remote script cache
+# scripts are uploaded once to a path named after their contents and re-used until their contents change.
+#
+
+REMOTE_SCRIPT_DIR = '/opt/builder/scripts'
+
+# {(host, remote-script-path), ...}
+# scripts known to be present on a remote host, so they aren't checked for again.
+_REMOTE_SCRIPTS = set()
+
+# printed by `run_scripts` after each script has run and parsed from it's output.
+SCRIPT_TIMING_MARKER = 'builder-script-timing'
+
+# the timing lines of a `run_scripts` run are also recorded on the remote host in a file
+# so that a run interrupted by a network error can be resumed.
+SCRIPT_STATUS_DIR = '/tmp'
+
+def _remote_script_path(script_filename):
+    "returns the path on the remote host to the current version of `script_filename`."
+    with open(join(config.SCRIPTS_PATH, script_filename), 'rb') as fh:
+        checksum = hashlib.sha256(fh.read()).hexdigest()
+    return join(REMOTE_SCRIPT_DIR, "%s-%s" % (os.path.basename(script_filename), checksum[:16]))
+
+@backoff.on_exception(backoff.expo, command.NetworkError, max_time=60)
+def put_cached_scripts(script_filename_list):
+    """ensures the scripts in `script_filename_list` from `config.SCRIPTS_PATH` are present on the remote host.
+    only scripts missing from the remote host are uploaded, replacing any previous versions of that script.
+    returns a map of script filenames to their paths on the remote host.
+    WARN: assumes you are connected to a stack"""
+    host = command.env('host_string')
+    remote_scripts = {script_filename: _remote_script_path(script_filename) for script_filename in script_filename_list}
+    unknown = sorted({remote_script for remote_script in remote_scripts.values() if (host, remote_script) not in _REMOTE_SCRIPTS})
+    if not unknown:
+        return remote_scripts
+
+    result = remote_sudo("mkdir -p %s && for script in %s; do test -f $script || echo $script; done" % (REMOTE_SCRIPT_DIR, " ".join(unknown)))
+    missing = set(result['stdout'])
+
+    replace_cmds = []
+    for script_filename, remote_script in remote_scripts.items():
+        if remote_script in missing:
+            temporary_script = _put_temporary_script(script_filename)
+            basename = os.path.basename(script_filename)
+            replace_cmds.append("rm -f %s/%s-* && mv %s %s && chmod 755 %s" % (REMOTE_SCRIPT_DIR, basename, temporary_script, remote_script, remote_script))
+    if replace_cmds:
+        remote_sudo(" && ".join(replace_cmds))
+
+    _REMOTE_SCRIPTS.update((host, remote_script) for remote_script in unknown)
+    return remote_scripts
+
 def put_script(script_filename, remote_script):
     """uploads a script for `config.SCRIPTS_PATH` in remote_script location, making it executable
     WARN: assumes you are connected to a stack"""
-    temporary_script = _put_temporary_script(script_filename)
-    remote_sudo("mv %s %s && chmod +x %s" % (temporary_script, remote_script, remote_script))
-
-@backoff.on_exception(backoff.expo, command.NetworkError, max_time=60)
-def run_script(script_filename, *script_params, **environment_variables):
-    """uploads a script for `config.SCRIPTS_PATH` and executes it in the /tmp dir with given params.
-    script is run as the root user via sudo.
+    cached_script = put_cached_scripts([script_filename])[script_filename]
+    remote_sudo("cp %s %s && chmod +x %s" % (cached_script, remote_script, remote_script))
+
+def _script_timings(line_list):
+    "returns a map of script index to a pair of `(return-code, elapsed-ms)` for each script timing line in `line_list`."
+    timing_map = {}
+    for line in line_list:
+        bits = line.split()
+        if len(bits) == 4 and bits[0] == SCRIPT_TIMING_MARKER: # noqa: PLR2004
+            _, idx, retval, elapsed_ms = bits
+            timing_map[int(idx)] = (int(retval), int(elapsed_ms))
+    return timing_map
+
+def run_scripts(script_list):
+    """executes a list of scripts for `config.SCRIPTS_PATH` in order with a single remote command, stopping at the first failure.
+    each script in `script_list` is a triple of `(script_filename, script_params, environment_variables)`,
+    the environment variables are optional.
+    a list of scripts within `script_list` are run concurrently, their output prefixed with their first parameter,
+    and the scripts after them are run once they have all finished.
+    scripts are run as the root user via sudo.
+    if the connection is lost, the run is resumed and only scripts without a recorded return code are run again.
+    returns a list of return codes of the scripts that were run.
     WARN: assumes you are connected to a stack"""
     start = utils.utcnow()
-    remote_script = _put_temporary_script(script_filename)
+    group_list = [entry if isinstance(entry, list) else [entry] for entry in script_list]
+    flat_script_list = [script for group in group_list for script in group]
+    remote_scripts = put_cached_scripts([script[0] for script in flat_script_list])
+    status_file = join(SCRIPT_STATUS_DIR, 'builder-scripts-%s' % uuid.uuid4().hex)
 
     def escape_string_parameter(parameter):
         return "'%s'" % parameter
 
-    env_string = ['%s=%s' % (k, v) for k, v in environment_variables.items()]
-    cmd = ["/bin/bash", remote_script] + lmap(escape_string_parameter, list(script_params))
-    result = remote_sudo(" ".join(env_string + cmd))
-    retval = result['return_code']
-    remote_sudo("rm " + remote_script) # remove the script after executing it
+    def script_label(script):
+        script_filename, script_params, *_ = script
+        return " ".join([script_filename] + [str(param) for param in script_params])
+
+    def timed_cmd(idx, script, prefix_output):
+        "runs the script and prints and records it's index, return code and how long it took."
+        script_filename, script_params, *rest = script
+        environment_variables = rest[0] if rest else {}
+        env_string = ['%s=%s' % (k, v) for k, v in environment_variables.items()]
+        cmd = " ".join(env_string + ["/bin/bash", remote_scripts[script_filename]] + lmap(escape_string_parameter, list(script_params)))
+        if prefix_output:
+            prefix = re.sub(r'[^\w.-]', '', str(first(script_params) or script_filename))
+            cmd = "{ %s; } 2>&1 | sed -u 's/^/[%s] /'; rc=${PIPESTATUS[0]}" % (cmd, prefix)
+        else:
+            cmd = "%s; rc=$?" % cmd
+        return "start=$(date +%%s%%N); %s; echo \"%s %s $rc $(( ($(date +%%s%%N) - start) / 1000000 ))\" | tee -a %s" % (cmd, SCRIPT_TIMING_MARKER, idx, status_file)
+
+    def remaining_cmd(timing_map):
+        "returns a command that runs the scripts without a recorded return code in `timing_map`."
+        cmd_list = []
+        idx = 0
+        for group in group_list:
+            remaining = [(idx + offset, script) for offset, script in enumerate(group) if idx + offset not in timing_map]
+            idx += len(group)
+            if not remaining:
+                continue
+            if len(group) == 1:
+                # stops if the script failed.
+                cmd_list.append("%s; [ $rc -eq 0 ] || exit $rc" % timed_cmd(remaining[0][0], remaining[0][1], prefix_output=False))
+                continue
+            # each script is run in the background and then waited on, stopping if any failed.
+            cmd_list.append("pids=''")
+            for script_idx, script in remaining:
+                cmd_list.append("(%s; exit $rc) & pids=\"$pids $!\"" % timed_cmd(script_idx, script, prefix_output=True))
+            cmd_list.append("failed=0; for pid in $pids; do wait $pid || failed=$?; done; [ $failed -eq 0 ] || exit $failed")
+        # the recorded return codes are only needed until the run finishes.
+        return "(%s); rc=$?; rm -f %s; exit $rc" % ("; ".join(cmd_list), status_file)
+
+    timing_map = {}
+    attempts = []
+
+    @backoff.on_exception(backoff.expo, command.NetworkError, max_time=60)
+    def run_remaining():
+        if attempts:
+            # the connection was lost, some scripts may have finished.
+            recorded = remote_sudo("cat %s 2>/dev/null || true" % status_file)
+            timing_map.update(_script_timings(recorded['stdout']))
+            LOG.warning("resuming scripts, %s of %s scripts have already run", len(timing_map), len(flat_script_list))
+            failed = [retval for retval, _ in timing_map.values() if retval != 0]
+            if failed:
+                return {'stdout': [], 'return_code': first(failed)}
+            if len(timing_map) == len(flat_script_list):
+                return {'stdout': [], 'return_code': 0}
+        attempts.append(True)
+        return remote_sudo(remaining_cmd(timing_map), warn_only=True)
+
+    result = run_remaining()
+    timing_map.update(_script_timings(result['stdout']))
+
+    for idx, (_, elapsed_ms) in sorted(timing_map.items()):
+        LOG.info("Executed script %s in %2.4f seconds", script_label(flat_script_list[idx]), elapsed_ms / 1000)
+    retval_list = [retval for _, (retval, _) in sorted(timing_map.items())]
+
     end = utils.utcnow()
-    LOG.info("Executed script %s in %2.4f seconds", script_filename, (end - start).total_seconds())
-    return retval
+    LOG.info("Executed %s scripts in %2.4f seconds", len(retval_list), (end - start).total_seconds())
+
+    if result['return_code'] != 0:
+        failed_scripts = [flat_script_list[idx][0] for idx, (retval, _) in sorted(timing_map.items()) if retval != 0]
+        msg = "script %s failed with return code %s" % (first(failed_scripts) or "execution", result['return_code'])
+        raise command.CommandError(msg)
+
+    return retval_list
+
+def run_script(script_filename, *script_params, **environment_variables):
+    """uploads a script for `config.SCRIPTS_PATH` and executes it with given params.
+    script is run as the root user via sudo.
+    WARN: assumes you are connected to a stack"""
+    return first(run_scripts([(script_filename, script_params, environment_variables)]))
 
 def clean_stack_for_ami():
     return run_script("clean-stack-for-ami.sh")
@@ -88,6 +235,8 @@ def create_stack(stackname):
         context = context_handler.load_context(stackname)
         cloudformation.bootstrap(stackname, context)
         terraform.bootstrap(stackname, context)
+        # new ec2 instances won't be in any inventory fetched before they existed.
+        core.invalidate_ec2_inventory(stackname)
         # setup various resources after creation, where necessary
         setup_ec2(stackname, context)
         return True
@@ -120,7 +269,7 @@ def setup_ec2(stackname, context):
 
 def remove_topics_from_sqs_policy(policy, topic_arns):
     """Removes statements from an SQS policy.
-    These statements are created by boto's subscribe_sqs_queue()"""
+    These statements are created by `sns.add_topics_to_sqs_policy`"""
 
     def for_unsubbed_topic(statement):
         # `statement` looks like:
@@ -138,111 +287,172 @@ def remove_topics_from_sqs_policy(policy, topic_arns):
         return policy
     return None
 
-def unsub_sqs(stackname, context_sqs, region, dry_run=False):
-    all_subscriptions = core.all_sns_subscriptions(region, stackname)
-
-    # lsh@2022-08-30, issue#6016: detect multiple subscriptions and prune them.
-    # don't know how it happened but we have cases where a project has multiple subscriptions to the same topic.
-    # this would mean multiple duplicate notifications.
-    # lsh@2023-08-08, issue#8426, duplicate subs not being detected and removed.
-    # the `stackname` was used to filter the list of subs as a suffix to 'Endpoint'.
-    # the subs are now filtered by exactly matching any SQS names to 'Endpoint'.
-
-    # group subscriptions by Topic so we detect duplicates below.
-    sub_groups = utils.mkidx(lambda sub: sub['Topic'], all_subscriptions)
-
-    unsub_map = {}
-    for queue_name, ctx_subscription_list in context_sqs.items():
-        # compare project subscriptions to those actively subscribed to (`all_subscriptions`)
-        unsub_map[queue_name] = [sub for sub in all_subscriptions if sub['Topic'] not in ctx_subscription_list]
+def sqs_subscription_index(subscription_list):
+    "returns a map of SQS queue names to a map of SNS topic names to the list of subscriptions between them."
+    index = {}
+    for sub in subscription_list:
+        queue_name = sub['Endpoint'].split(':')[-1]
+        index.setdefault(queue_name, {}).setdefault(sub['Topic'], []).append(sub)
+    return index
+
+def _sqs_subscription_plan(queue_name, ctx_subscription_list, index):
+    "returns the changes needed to the SNS subscriptions of the SQS queue `queue_name`, see `sqs_plan`."
+    ensure(isinstance(ctx_subscription_list, list), "Not a list of topics: %s" % ctx_subscription_list)
+    unsubscribe, keep = [], []
+    for topic, sub_list in index.get(queue_name, {}).items():
+        # compare project subscriptions to those actively subscribed to
+        if topic not in ctx_subscription_list:
+            unsubscribe.extend(sub_list)
+            continue
 
         # lsh@2022-08-30, issue#6016: detect multiple subscriptions and prune them.
-        # look for subscription in sub groups with >1 subs and ensure it gets removed.
-        for sub in all_subscriptions:
-            topic = sub['Topic']
-            if topic in sub_groups and len(sub_groups[topic]) > 1:
-                msg_list = [t['SubscriptionArn'].split(':')[-1] for t in sub_groups[topic]]
-                LOG.warning("multiple SQS subscriptions to the SNS topic %r found: %s", topic, msg_list)
-                unsub_map[queue_name].append(sub_groups[topic].pop())
-
-    # 'permissions' here is more like 'policy': what to do (send a message) when receiving a message from a source (SNS)
-    # we strip these and re-add them on each update.
-    permission_map = {queue_name: [sub['TopicArn'] for sub in sub_list] for queue_name, sub_list in unsub_map.items()}
-
-    if dry_run:
-        return unsub_map, permission_map
-
-    sns = core.boto_client('sns', region)
-    for sub in utils.shallow_flatten(unsub_map.values()):
-        LOG.info("Unsubscribing %s from %s", sub['Topic'], stackname)
-        sns.unsubscribe(SubscriptionArn=sub['SubscriptionArn'])
-
-    sqs = core.boto_resource('sqs', region)
-    for queue_name, topic_arns in permission_map.items():
-        # not an atomic update, but there's no other way to do it
-        queue = sqs.get_queue_by_name(QueueName=queue_name)
-        policy = json.loads(queue.attributes.get('Policy', '{}'))
-        LOG.info("Saving new Policy for %s removing %s (%s)", queue_name, topic_arns, policy)
-        new_policy = remove_topics_from_sqs_policy(policy, topic_arns)
-        new_policy_json = json.dumps(new_policy) if new_policy else ''
+        # don't know how it happened but we have cases where a project has multiple subscriptions to the same topic.
+        # this would mean multiple duplicate notifications.
+        # the first subscription is kept, the rest are removed.
+        if len(sub_list) > 1:
+            msg_list = [sub['SubscriptionArn'].split(':')[-1] for sub in sub_list]
+            LOG.warning("multiple SQS subscriptions to the SNS topic %r found: %s", topic, msg_list)
+        keep.append(sub_list[0])
+        unsubscribe.extend(sub_list[1:])
+
+    subscribed = {sub['Topic'] for sub in keep}
+    return {
+        'unsubscribe': unsubscribe,
+        # 'permissions' here is more like 'policy': what to do (send a message) when receiving a message from a source (SNS)
+        # statements for removed subscriptions are stripped and those for wanted topics re-added.
+        'permissions': utils.unique([sub['TopicArn'] for sub in unsubscribe]),
+        'subscribe': [topic for topic in utils.unique(ctx_subscription_list) if topic not in subscribed],
+        'keep': keep,
+    }
+
+def _sqs_queue_plan(sns_client, sqs_client, queue_name, queue_plan):
+    """adds the state of the SQS queue `queue_name` and it's kept subscriptions to `queue_plan`, see `sqs_plan`.
+    a queue replaced under the same name or a subscription created outside of builder may be missing
+    the policy statements or the RawMessageDelivery attribute that builder would have given it."""
+    queue_url = sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+    attributes = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn', 'Policy'])['Attributes']
+    queue_arn = attributes['QueueArn']
+    policy = json.loads(attributes.get('Policy') or '{}')
+
+    sid_set = {statement.get('Sid') for statement in policy.get('Statement', [])}
+    missing_permissions = [sub['TopicArn'] for sub in queue_plan['keep'] if snsmod.sqs_policy_sid(queue_arn, sub['TopicArn']) not in sid_set]
+
+    def raw_delivery(sub):
+        attributes = sns_client.get_subscription_attributes(SubscriptionArn=sub['SubscriptionArn'])['Attributes']
+        return attributes.get('RawMessageDelivery') == 'true'
+
+    return dict(queue_plan, **{
+        'queue_url': queue_url,
+        'queue_arn': queue_arn,
+        'policy': policy,
+        # the policy is re-written when statements must be removed or added.
+        'update_policy': bool(queue_plan['permissions'] or queue_plan['subscribe'] or missing_permissions),
+        # kept subscriptions that don't deliver the raw message.
+        'raw_delivery': [sub for sub in queue_plan['keep'] if not raw_delivery(sub)],
+    })
+
+def sqs_plan(stackname, context_sqs, region):
+    """returns a map of each SQS queue in `context_sqs` to the changes needed to it's SNS subscriptions:
+    * 'unsubscribe', a list of subscriptions to remove,
+    * 'permissions', a list of topic ARNs to remove from the queue's policy,
+    * 'subscribe', a list of topic names to subscribe to,
+    * 'keep', a list of subscriptions to keep,
+    * 'update_policy', `True` if the queue's policy doesn't grant exactly the wanted topics permission to send messages,
+    * 'raw_delivery', a list of kept subscriptions to set RawMessageDelivery on.
+    the SNS subscriptions of the region are listed once and indexed by queue and topic.
+    the queue's current policy is read once and kept in the plan along with it's URL and ARN."""
+    ensure(isinstance(context_sqs, dict), "Not a dictionary of queues pointing to their subscriptions: %s" % context_sqs)
+    index = sqs_subscription_index(core.all_sns_subscriptions(region, stackname))
+    sns_client = core.boto_client('sns', region)
+    sqs_client = core.boto_client('sqs', region)
+
+    def queue_plan(queue_name):
+        subscription_plan = _sqs_subscription_plan(queue_name, context_sqs[queue_name], index)
+        return _sqs_queue_plan(sns_client, sqs_client, queue_name, subscription_plan)
+
+    queue_name_list = list(context_sqs)
+    return dict(zip(queue_name_list, utils.concurrently(queue_plan, queue_name_list, max_workers=config.AWS_MAX_CONCURRENT_REQUESTS)))
+
+def _sqs_queue_changed(queue_plan):
+    return bool(queue_plan['unsubscribe'] or queue_plan['subscribe'] or queue_plan['update_policy'] or queue_plan['raw_delivery'])
+
+def _apply_sqs_queue_plan(stackname, sns_client, sqs_client, queue_name, queue_plan):
+    """applies the changes in `queue_plan` to the SQS queue `queue_name`.
+    the queue's policy is written once, with statements for every wanted topic."""
+    for sub in queue_plan['unsubscribe']:
+        LOG.info("Unsubscribing %s from %s", queue_name, sub['Topic'], extra={'stackname': stackname})
+        sns_client.unsubscribe(SubscriptionArn=sub['SubscriptionArn'])
+
+    # idempotent, works as lookup
+    # risky, may subscribe to a typo-filled topic name like 'aarticles'
+    # lsh@2021-11-02: there is now a boto method to lookup topics:
+    # - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sns.html#SNS.Client.list_topics
+    new_topic_arns = [sns_client.create_topic(Name=topic_name)['TopicArn'] for topic_name in queue_plan['subscribe']]
+
+    queue_arn = queue_plan['queue_arn']
+    if queue_plan['update_policy']:
+        policy = copy.deepcopy(queue_plan['policy'])
+        policy = remove_topics_from_sqs_policy(policy, queue_plan['permissions']) or {}
+        wanted_topic_arns = [sub['TopicArn'] for sub in queue_plan['keep']] + new_topic_arns
+        policy = snsmod.add_topics_to_sqs_policy(policy, queue_arn, wanted_topic_arns)
+        new_policy_json = json.dumps(policy) if policy['Statement'] else ''
 
         try:
-            LOG.info("Existing policy: %s", queue.attributes.get('Policy'))
-            queue.set_attributes(Attributes={'Policy': new_policy_json})
+            # not an atomic update, but there's no other way to do it
+            LOG.info("Saving new Policy for %s removing %s (%s)", queue_name, queue_plan['permissions'], new_policy_json)
+            sqs_client.set_queue_attributes(QueueUrl=queue_plan['queue_url'], Attributes={'Policy': new_policy_json})
         except botocore.exceptions.ClientError as ex:
             msg = "uncaught boto exception updating policy for queue %r: %s" % (queue_name, new_policy_json)
             # TODO: `extra` is logged but not rendered so are effectively lost
-            LOG.exception(msg, extra={'response': ex.response, 'permission_map': permission_map.items()})
+            LOG.exception(msg, extra={'response': ex.response, 'queue_plan': queue_plan})
             raise
 
-    return unsub_map, permission_map
+    for sub in queue_plan['raw_delivery']:
+        LOG.info('Setting RawMessageDelivery of subscription %s', sub['SubscriptionArn'], extra={'stackname': stackname})
+        sns_client.set_subscription_attributes(SubscriptionArn=sub['SubscriptionArn'], AttributeName='RawMessageDelivery', AttributeValue='true')
 
-def sub_sqs(stackname, context_sqs, region):
-    """
-    Connects SQS queues created by Cloud Formation to SNS topics where
-    necessary, adding both the subscription and the IAM policy to let the SNS
-    topic write to the queue
-    """
-    ensure(isinstance(context_sqs, dict), "Not a dictionary of queues pointing to their subscriptions: %s" % context_sqs)
+    for topic_name, topic_arn in zip(queue_plan['subscribe'], new_topic_arns):
+        LOG.info('Subscribing %s to SNS topic %s', queue_name, topic_name, extra={'stackname': stackname})
+        sns_client.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=queue_arn,
+                             Attributes={'RawMessageDelivery': 'true'})
 
-    sqs = core.boto_resource('sqs', region)
+def apply_sqs_plan(stackname, plan, region):
+    """applies a plan from `sqs_plan`, updating the queues that need changing concurrently.
+    each queue is updated by a single thread as it's policy is read, modified and then written."""
     sns_client = core.boto_client('sns', region)
+    sqs_client = core.boto_client('sqs', region)
+
+    def apply_queue_plan(queue_name):
+        _apply_sqs_queue_plan(stackname, sns_client, sqs_client, queue_name, plan[queue_name])
+
+    changed_queue_list = [queue_name for queue_name, queue_plan in plan.items() if _sqs_queue_changed(queue_plan)]
+    utils.concurrently(apply_queue_plan, changed_queue_list, max_workers=config.AWS_MAX_CONCURRENT_REQUESTS)
 
-    for queue_name, subscription_list in context_sqs.items():
-        LOG.info('Setup of SQS queue %s', queue_name, extra={'stackname': stackname})
-        ensure(isinstance(subscription_list, list), "Not a list of topics: %s" % subscription_list)
-
-        queue = sqs.get_queue_by_name(QueueName=queue_name)
-        for topic_name in subscription_list:
-            LOG.info('Subscribing %s to SNS topic %s', queue_name, topic_name, extra={'stackname': stackname})
-
-            # idempotent, works as lookup
-            # risky, may subscribe to a typo-filled topic name like 'aarticles'
-            # there is no boto method to lookup a topic
-            # lsh@2021-11-02: there is now a boto method to lookup topics:
-            # - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sns.html#SNS.Client.list_topics
-            topic_lookup = sns_client.create_topic(Name=topic_name) # idempotent
-            topic_arn = topic_lookup['TopicArn']
-
-            # deals with both subscription and IAM policy
-            # - http://boto.cloudhackers.com/en/latest/ref/sns.html#boto.sns.SNSConnection.subscribe_sqs_queue
-            # - https://github.com/boto/boto/blob/develop/boto/sns/connection.py#L322
-            #response = sns.subscribe_sqs_queue(topic_arn, queue)
-            # WARN: doesn't do all of the above in boto3
-            #response = sns.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=queue.attributes['QueueArn'])
-            response = snsmod.subscribe_sqs_queue(sns_client, topic_arn, queue)
-
-            ensure('SubscriptionArn' in response, "failed to find ARN of new subscription")
-            subscription_arn = response['SubscriptionArn']
-            LOG.info('Setting RawMessageDelivery of subscription %s', subscription_arn, extra={'stackname': stackname})
-            sns_client.set_subscription_attributes(SubscriptionArn=subscription_arn, AttributeName='RawMessageDelivery', AttributeValue='true')
+def sqs_plan_summary(plan):
+    "returns a list of human readable lines describing the changes in a plan from `sqs_plan`."
+    lines = []
+    for queue_name, queue_plan in plan.items():
+        lines.extend("%s: unsubscribe from %s (%s)" % (queue_name, sub['Topic'], sub['SubscriptionArn'].split(':')[-1]) for sub in queue_plan['unsubscribe'])
+        lines.extend("%s: subscribe to %s" % (queue_name, topic_name) for topic_name in queue_plan['subscribe'])
+        if queue_plan['update_policy']:
+            lines.append("%s: update policy" % queue_name)
+        lines.extend("%s: set RawMessageDelivery on subscription to %s" % (queue_name, sub['Topic']) for sub in queue_plan['raw_delivery'])
+    return lines or ["no changes to SQS subscriptions"]
 
 @only_if('sqs')
 @core.requires_active_stack
-def update_sqs_stack(stackname, context, **kwargs):
+def update_sqs_stack(stackname, context, dry_run=False, **kwargs):
+    """Connects SQS queues created by Cloud Formation to SNS topics where
+    necessary, adding both the subscription and the IAM policy to let the SNS
+    topic write to the queue. Subscriptions to topics no longer in the context are removed.
+    When `dry_run` is `True` the changes are logged but not made."""
     region = context['aws']['region']
-    unsub_sqs(stackname, context['sqs'], region)
-    sub_sqs(stackname, context['sqs'], region)
+    plan = sqs_plan(stackname, context['sqs'], region)
+    for line in sqs_plan_summary(plan):
+        LOG.info(line, extra={'stackname': stackname})
+    if not dry_run:
+        apply_sqs_plan(stackname, plan, region)
+    return plan
 
 @only_if('s3')
 @core.requires_active_stack
@@ -383,7 +593,7 @@ def update_stack(stackname, service_list=None, **kwargs):
     service_update_fns = {
         'ec2': (update_ec2_stack, ['concurrency', 'formula_revisions', 'dry_run']),
         's3': (update_s3_stack, []),
-        'sqs': (update_sqs_stack, []),
+        'sqs': (update_sqs_stack, ['dry_run']),
     }
     service_list = service_list or service_update_fns.keys()
     ensure(isinstance(service_list, Iterable), "cannot iterate over given service list %r" % service_list)
@@ -498,8 +708,20 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
             'project': context['project_name'],
         }
         environment_vars = {('grain_%s' % k): v for k, v in grains.items()}
+
+        # upload every script this node needs up front.
+        script_list = ['bootstrap.sh', 'highstate.sh']
+        if is_masterless:
+            script_list += ['init-masterless-formulas.sh', 'update-masterless-formula.sh']
+        if is_master:
+            script_list += ['init-master.sh', 'update-master.sh']
+        put_cached_scripts(script_list)
+
         run_script('bootstrap.sh', salt_version, minion_id, install_master_flag, master_ip, **environment_vars)
 
+        # scripts that can run one after the other are run together.
+        pending_scripts = []
+
         if is_masterless:
             # order is important.
             formula_list = ' '.join(fdata.get('formula-dependencies', []) + [fdata['formula-repo']])
@@ -511,19 +733,19 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
             }
 
             # Vagrant's equivalent is 'init-vagrant-formulas.sh'
-            run_script(
-                'init-masterless-formulas.sh',
-                formula_list,
-                fdata['private-repo'],
-                fdata['configuration-repo'],
-                **envvars
+            pending_scripts.append(
+                ('init-masterless-formulas.sh', [formula_list, fdata['private-repo'], fdata['configuration-repo']], envvars)
             )
 
             # second pass to optionally update formulas to specific revisions
-            for repo, formula, revision in formula_revisions or []:
-                run_script('update-masterless-formula.sh', repo, formula, revision)
+            # formulas are updated concurrently, each is a separate repository.
+            if formula_revisions:
+                pending_scripts.append([('update-masterless-formula.sh', [repo, formula, revision]) for repo, formula, revision in formula_revisions])
 
         if is_master:
+            if pending_scripts:
+                run_scripts(pending_scripts)
+                pending_scripts = []
             # master-server is not masterless (!),
             # but it is possible to have a masterless master-server.
             builder_private_repo = fdata['private-repo']
@@ -540,7 +762,8 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
         # anything other than '--dry-run' and '--no-color' essentially
         highstate_dry_run = "--dry-run" if dry_run else "--no-dry-run"
         coloured_output = "--no-color" if WHOAMI == CI_USER else "--yes-color"
-        run_script('highstate.sh', highstate_dry_run, coloured_output)
+        pending_scripts.append(('highstate.sh', [highstate_dry_run, coloured_output]))
+        run_scripts(pending_scripts)
 
     stack_all_ec2_nodes(stackname, _update_ec2_node, username=BOOTSTRAP_USER, concurrency=concurrency)
 
@@ -581,17 +804,42 @@ def remove_all_orphaned_keys(master_stackname):
 # it can't be moved to ./buildercore/core.py because of the `cloudformation` module dependency.
 # we need something in ./buildercore/ that ties these disparate things together.
 def destroy(stackname):
+    """destroys the resources of `stackname` and then it's context.
+    the Terraform and CloudFormation resources of a stack don't depend on each other and are destroyed
+    concurrently, along with the stack's DNS records. the context is only deleted if all of these succeed."""
     # TODO: if context does not exist anymore on S3,
     # we could exit idempotently
 
     context = context_handler.load_context(stackname)
-    terraform.destroy(stackname, context)
-    cloudformation.destroy(stackname, context)
 
     # don't do this. requires master server access and would prevent regular users deleting stacks
     #core.remove_minion_key(stackname)
 
-    delete_dns(stackname)
+    step_list = [
+        partial(terraform.destroy, stackname, context),
+        partial(cloudformation.destroy, stackname, context),
+        partial(delete_dns, stackname),
+    ]
+    try:
+        utils.concurrently(lambda step: step(), step_list)
+    finally:
+        core.invalidate_ec2_inventory(stackname)
 
     context_handler.delete_context(stackname)
     LOG.info("stack %r deleted", stackname)
+
+def destroy_many(stackname_list, concurrency=DESTROY_MANY_CONCURRENCY):
+    """destroys each stack in `stackname_list`, `concurrency` stacks at a time.
+    a stack that fails to be destroyed doesn't stop the others.
+    returns a map of each stackname to a pair of `(seconds-taken, exception-or-None)`."""
+    def timed_destroy(stackname):
+        start = time.monotonic()
+        error = None
+        try:
+            destroy(stackname)
+        except Exception as exc:
+            LOG.exception("failed to destroy stack %r", stackname)
+            error = exc
+        return time.monotonic() - start, error
+
+    return dict(zip(stackname_list, utils.concurrently(timed_destroy, stackname_list, max_workers=concurrency)))
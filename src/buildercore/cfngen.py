@@ -17,12 +17,18 @@ We want to add an external volume to an EC2 instance to increase available space
 """
 import json
 import logging
+import multiprocessing
+import os
 import re
+import time
+import traceback
 from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
 import botocore
 import netaddr
+from kids.cache import cache as cached
 from slugify import slugify
 
 from . import cloudformation, config, context_handler, core, project, terraform, utils
@@ -156,6 +162,17 @@ def hostname_struct(stackname):
     struct.update(updates)
     return struct
 
+def context_project_data(pname, alt_config=None):
+    """returns the project data for `pname` used to build a context, with any `alt_config` merged in.
+    the alt-configs themselves are removed."""
+    project_data = project.project_data(pname)
+    if alt_config and project_data.get('aws-alt', {}).get(alt_config):
+        project_data = project.set_project_alt(project_data, 'aws', alt_config)
+    if alt_config and project_data.get('gcp-alt', {}).get(alt_config):
+        project_data = project.set_project_alt(project_data, 'gcp', alt_config)
+    # project data is frozen and shared, create a new version without the alt-configs.
+    return project_data.dissoc('aws-alt', 'gcp-alt')
+
 def build_context(pname, **more_context):
     """builds a dictionary called the `context` that is used when rendering the final cloudformation/terraform template.
     `more_context` is used to provide additional runtime data that can tweak the final dictionary.
@@ -172,15 +189,7 @@ def build_context(pname, **more_context):
     # order is important. always use `alt-config` in `more_context` (explicit) when regenerating
     alt_config = more_context.get('alt-config')
 
-    project_data = project.project_data(pname)
-    if alt_config and project_data.get('aws-alt', {}).get(alt_config):
-        project_data = project.set_project_alt(project_data, 'aws', alt_config)
-    if alt_config and project_data.get('gcp-alt', {}).get(alt_config):
-        project_data = project.set_project_alt(project_data, 'gcp', alt_config)
-    if project_data.get('aws-alt'):
-        del project_data['aws-alt']
-    if project_data.get('gcp-alt'):
-        del project_data['gcp-alt']
+    project_data = context_project_data(pname, alt_config)
 
     defaults = {
         'project_name': pname,
@@ -257,18 +266,21 @@ def build_context(pname, **more_context):
     wrangler_list = [project_wrangler] + wrangler_list
 
     for wrangler in wrangler_list:
-        # `deepcopy` here so functions can't modify the `context` in-place or
-        # reference a bit of project_data and then change it
-        context = wrangler(deepcopy(project_data), deepcopy(context))
+        # `project_data` is frozen so wranglers can't reference a bit of it and then change it.
+        # wranglers must `utils.thaw` any part of the project data they intend to modify.
+        context = wrangler(project_data, context)
 
-    return context
+    # the context may still reference bits of the frozen project data.
+    # the caller receives a context it is free to modify.
+    return utils.thaw(context)
 
 #
 # wranglers.
 # these should accept the project data `pdata` and the `context` and
-# then modify and return their local copy of the `context`.
+# then modify and return the `context`.
 #
 # the `pdata` they receive has already had any alt-configs merged in.
+# the `pdata` they receive is frozen and shared, see `utils.freeze` and `utils.thaw`.
 #
 # the final context is used to render CloudFormation and Terraform templates.
 # the logic in `buildercore/cloudformation.py` and `buildercore/terraform.py` should *not*
@@ -279,7 +291,7 @@ def build_context(pname, **more_context):
 def build_context_waf(pdata, context):
     if not pdata['aws'].get('waf'):
         return context
-    context['waf'] = pdata['aws']['waf']
+    context['waf'] = utils.thaw(pdata['aws']['waf'])
 
     new_managed_rules = {}
     for managed_rule_key, managed_rule in context['waf']['managed-rules'].items():
@@ -307,7 +319,7 @@ def build_context_docdb(pdata, context, existing_context=None):
     generated_password = utils.random_alphanumeric(length=64)
     current_master_password = existing_context.get('master-user-password')
 
-    context['docdb'] = pdata['aws']['docdb']
+    context['docdb'] = utils.thaw(pdata['aws']['docdb'])
     # non-configurable (for now) options
     context['docdb'].update({
         'minor-version-upgrades': True,
@@ -462,8 +474,8 @@ def build_context_ec2(pdata, context):
         msg = "'aws.ports' is no longer supported, use 'aws.ec2.ports' instead: %s" % stackname
         LOG.warning(msg)
 
-    context['ec2'] = pdata['aws']['ec2']
-    context['ec2']['ports'] = pdata['aws']['ec2'].get('ports', {})
+    context['ec2'] = utils.thaw(pdata['aws']['ec2'])
+    context['ec2']['ports'] = context['ec2'].get('ports', {})
 
     set_master_address(pdata, context) # mutator
 
@@ -502,7 +514,7 @@ def build_context_rds(pdata, context, existing_context):
     updating = bool(existing_context)
     replacing = False
 
-    context['rds'] = pdata['aws']['rds']
+    context['rds'] = utils.thaw(pdata['aws']['rds'])
 
     if updating:
         # what conditions (supported by builder) will cause a db replacement?
@@ -553,7 +565,7 @@ def build_context_elb(pdata, context):
     if 'elb' in pdata['aws']:
         context['elb'] = {}
         if isinstance(pdata['aws']['elb'], dict):
-            context['elb'] = pdata['aws']['elb']
+            context['elb'] = utils.thaw(pdata['aws']['elb'])
         context['elb'].update({
             'subnets': [
                 pdata['aws']['subnet-id'],
@@ -565,7 +577,7 @@ def build_context_elb(pdata, context):
 
 def build_context_alb(pdata, context):
     if 'alb' in pdata['aws'] and pdata['aws']['alb'] is not False:
-        context['alb'] = pdata['aws']['alb']
+        context['alb'] = utils.thaw(pdata['aws']['alb'])
         context['alb']['idle_timeout'] = str(context['alb']['idle_timeout'])
         context['alb']['subnets'] = [
             pdata['aws']['subnet-id'],
@@ -670,7 +682,7 @@ def build_context_fastly(pdata, context):
     # as 'domain' is the top-level elifesciences.org used to build DNS entries, if it's not around it means
     # no DNS entries are possible and hence no Fastly CDN can be setup
     if pdata['domain'] and pdata['aws'].get('fastly'):
-        backends = pdata['aws']['fastly'].get('backends', OrderedDict({}))
+        backends = utils.thaw(pdata['aws']['fastly'].get('backends', OrderedDict({})))
         context['fastly'] = {
             'backends': OrderedDict([(n, _build_backend(b)) for n, b in backends.items()]),
             'subdomains': [_build_subdomain(x) for x in pdata['aws']['fastly']['subdomains']],
@@ -680,8 +692,8 @@ def build_context_fastly(pdata, context):
             'default-ttl': pdata['aws']['fastly']['default-ttl'],
             'healthcheck': pdata['aws']['fastly']['healthcheck'],
             'errors': pdata['aws']['fastly']['errors'],
-            'gcslogging': _parameterize_gcslogging(pdata['aws']['fastly']['gcslogging']),
-            'bigquerylogging': _parameterize_bigquerylogging(pdata['aws']['fastly']['bigquerylogging']),
+            'gcslogging': _parameterize_gcslogging(utils.thaw(pdata['aws']['fastly']['gcslogging'])),
+            'bigquerylogging': _parameterize_bigquerylogging(utils.thaw(pdata['aws']['fastly']['bigquerylogging'])),
             'ip-blacklist': pdata['aws']['fastly']['ip-blacklist'],
             'vcl-templates': pdata['aws']['fastly']['vcl-templates'],
             'vcl': pdata['aws']['fastly']['vcl'],
@@ -716,7 +728,7 @@ def build_context_eks(pdata, context):
     if not pdata['aws'].get('eks'):
         return context
 
-    context['eks'] = pdata['aws']['eks']
+    context['eks'] = utils.thaw(pdata['aws']['eks'])
 
     def _build_addon_policy(label, data):
         return {
@@ -857,6 +869,79 @@ def generate_stack(pname, **more_context):
     terraform_template_file = terraform.write_template(stackname, terraform_template)
     return context, cloudformation_template_file, terraform_template_file
 
+#
+# bulk render
+#
+
+def render_combination_list(pname_list=None):
+    """returns a list of `(pname, alt-config)` pairs for every project and each of it's alt-configs.
+    the project's default configuration has an alt-config of `None`."""
+    combination_list = []
+    for pname, pdata in project.project_map().items():
+        if pname_list and pname not in pname_list:
+            continue
+        alt_config_list = list(pdata.get('aws-alt', {})) + list(pdata.get('gcp-alt', {}))
+        combination_list.append((pname, None))
+        combination_list.extend((pname, alt_config) for alt_config in dict.fromkeys(alt_config_list))
+    return combination_list
+
+def render_combination(output_dir, pname, alt_config=None):
+    """renders the CloudFormation and Terraform templates for project `pname` using `alt_config` and writes them to `output_dir`.
+    returns a map describing the result. errors are captured in the result rather than raised."""
+    stackname = core.mk_stackname(pname, alt_config or 'dummy')
+    result = {
+        'project': pname,
+        'alt-config': alt_config,
+        'stackname': stackname,
+        'cloudformation': None,
+        'terraform': None,
+        'error': None,
+    }
+    start = time.perf_counter()
+    try:
+        more_context = {'stackname': stackname}
+        if alt_config:
+            more_context['alt-config'] = alt_config
+        context = build_context(pname, **more_context)
+
+        if 'aws' in context:
+            path = os.path.join(output_dir, stackname + ".json")
+            with open(path, 'w') as fh:
+                fh.write(cloudformation.render_template(context))
+            result['cloudformation'] = path
+
+        terraform_template = terraform.render(context)
+        if terraform_template != terraform.EMPTY_TEMPLATE:
+            path = os.path.join(output_dir, stackname + ".tf.json")
+            with open(path, 'w') as fh:
+                fh.write(terraform_template)
+            result['terraform'] = path
+
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+def render_all(output_dir, pname_list=None, max_workers=None):
+    """renders the CloudFormation and Terraform templates for every project and alt-config, writing them to `output_dir`.
+    rendering is CPU bound so combinations are spread across `max_workers` processes, default is one per CPU.
+    returns a list of results in project order, see `render_combination`."""
+    utils.mkdir_p(output_dir)
+    combination_list = render_combination_list(pname_list)
+    if not combination_list:
+        return []
+    pname_list, alt_config_list = zip(*combination_list)
+    work_fn = partial(render_combination, output_dir)
+
+    if max_workers == 1:
+        return list(map(work_fn, pname_list, alt_config_list))
+
+    # 'fork' so each worker inherits the already loaded project data rather than loading it again.
+    # note: `multiprocessing.Pool` blocks indefinitely once gevent has monkey-patched threading (see `threadbare`).
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+        return list(executor.map(work_fn, pname_list, alt_config_list))
+
 #
 # update existing template
 #
@@ -972,30 +1057,47 @@ def template_delta(context):
     Most resources that support non-destructive updates like CloudFront are instead included."""
     old_template = cloudformation.read_template(context['stackname'])
     template = json.loads(cloudformation.render_template(context))
+    return Delta.from_cloudformation_and_terraform(
+        cloudformation_delta(old_template, template),
+        terraform.generate_delta(context)
+    )
+
+@cached
+def _title_matcher(pattern_list):
+    """returns a function that matches a title against any of the regular expressions in `pattern_list`.
+    the patterns are compiled into a single regular expression once."""
+    return re.compile("|".join("(?:%s)" % pattern for pattern in pattern_list)).match
+
+def resource_diff(old, new):
+    """returns a sorted list of paths to the values that differ between the `old` and `new` resource or output.
+    for example: `['Properties.InstanceType', 'Properties.Tags']`"""
+    path_list = []
+    for key in sorted(set(old) | set(new)):
+        old_val, new_val = old.get(key), new.get(key)
+        if old_val == new_val:
+            continue
+        if isinstance(old_val, dict) and isinstance(new_val, dict):
+            path_list.extend("%s.%s" % (key, subkey) for subkey in sorted(set(old_val) | set(new_val))
+                             if old_val.get(subkey) != new_val.get(subkey))
+        else:
+            path_list.append(key)
+    return path_list
 
-    removeable_title_patterns = REMOVABLE_TITLE_PATTERNS[:]
-    updateable_title_patterns = UPDATABLE_TITLE_PATTERNS[:]
+def cloudformation_delta(old_template, template):
+    """compares the `old_template` to the newly rendered `template` and returns a `CloudFormationDelta`.
+    both templates are deserialised CloudFormation templates."""
+    removeable_title_patterns = REMOVABLE_TITLE_PATTERNS
+    updateable_title_patterns = UPDATABLE_TITLE_PATTERNS
 
     # when should we be able to modify load balancers?
     # this condition covers the case of migrating from an ELB to an ALB.
     # it doesn't cover downgrading, removing an LB altogether etc.
     if 'ElasticLoadBalancer' in old_template['Resources']:
-        updateable_title_patterns.extend(LB_UPDATABLE_TITLE_PATTERNS)
-        removeable_title_patterns.extend(LB_REMOVABLE_TITLE_PATTERNS)
-
-    def _related_to_ec2(output):
-        if 'Value' in output:
-            if 'Ref' in output['Value']:
-                return 'EC2Instance' in output['Value']['Ref']
-            if 'Fn::GetAtt' in output['Value']:
-                return 'EC2Instance' in output['Value']['Fn::GetAtt'][0]
-        return False
-
-    def _title_is_updatable(title):
-        return len([p for p in updateable_title_patterns if re.match(p, title)]) > 0
+        updateable_title_patterns = updateable_title_patterns + LB_UPDATABLE_TITLE_PATTERNS
+        removeable_title_patterns = removeable_title_patterns + LB_REMOVABLE_TITLE_PATTERNS
 
-    def _title_is_removable(title):
-        return len([p for p in removeable_title_patterns if re.match(p, title)]) > 0
+    _title_is_updatable = _title_matcher(tuple(updateable_title_patterns))
+    _title_is_removable = _title_matcher(tuple(removeable_title_patterns))
 
     # TODO: investigate if this is still necessary
     # start backward compatibility code
@@ -1021,11 +1123,12 @@ def template_delta(context):
             LOG.warning("section %r not present in old template but is present in new: %s", section, title)
             return False # can we handle this better?
 
-        title_in_old = dict(old_template[section][title])
-        title_in_new = dict(template[section][title])
+        title_in_old = old_template[section][title]
+        title_in_new = template[section][title]
 
         # ignore UserData changes, it's not useful to update them and cause
-        # a needless reboot
+        # a needless reboot.
+        # note: this modifies the new template so the delta carries the old values.
         if title_in_old.get('Type') == 'AWS::EC2::Instance':
             for property_name in EC2_NOT_UPDATABLE_PROPERTIES:
                 title_in_new['Properties'][property_name] = title_in_old['Properties'][property_name]
@@ -1039,52 +1142,62 @@ def template_delta(context):
             return title.strip('1')
         return None
 
+    old_resources = old_template['Resources']
+    old_outputs = old_template.get('Outputs', {})
+    old_parameters = old_template.get('Parameters', {})
+    resources = template['Resources']
+    outputs = template.get('Outputs', {})
+    parameters = template.get('Parameters', {})
+
     delta_plus_resources = {
-        title: r for (title, r) in template['Resources'].items()
-        if (title not in old_template['Resources']
-            and (legacy_title(title) not in old_template['Resources'])
+        title: r for (title, r) in resources.items()
+        if (title not in old_resources
+            and (legacy_title(title) not in old_resources)
             and (title != 'EC2Instance'))
     }
     delta_plus_outputs = {
-        title: o for (title, o) in template.get('Outputs', {}).items()
-        if (title not in old_template.get('Outputs', {}) and _title_is_updatable(title))
+        title: o for (title, o) in outputs.items()
+        if (title not in old_outputs and _title_is_updatable(title))
     }
     delta_plus_parameters = {
-        title: o for (title, o) in template.get('Parameters', {}).items()
-        if (title not in old_template.get('Parameters', {}))
+        title: o for (title, o) in parameters.items()
+        if (title not in old_parameters)
     }
 
     delta_edit_resources = {
-        title: r for (title, r) in template['Resources'].items()
+        title: r for (title, r) in resources.items()
         if (_title_is_updatable(title) and _title_has_been_updated(title, 'Resources'))
     }
     delta_edit_outputs = {
-        title: o for (title, o) in template.get('Outputs', {}).items()
+        title: o for (title, o) in outputs.items()
         if (_title_is_updatable(title) and _title_has_been_updated(title, 'Outputs'))
     }
 
-    delta_minus_resources = {r: v for r, v in old_template['Resources'].items() if r not in template['Resources'] and _title_is_removable(r)}
-    delta_minus_outputs = {o: v for o, v in old_template.get('Outputs', {}).items() if o not in template.get('Outputs', {})}
-    delta_minus_parameters = {p: v for p, v in old_template.get('Parameters', {}).items() if p not in template.get('Parameters', {})}
+    delta_minus_resources = {r: v for r, v in old_resources.items() if r not in resources and _title_is_removable(r)}
+    delta_minus_outputs = {o: v for o, v in old_outputs.items() if o not in outputs}
+    delta_minus_parameters = {p: v for p, v in old_parameters.items() if p not in parameters}
 
-    return Delta.from_cloudformation_and_terraform(
-        cloudformation.CloudFormationDelta(
-            {
-                'Resources': delta_plus_resources,
-                'Outputs': delta_plus_outputs,
-                'Parameters': delta_plus_parameters,
-            },
-            {
-                'Resources': delta_edit_resources,
-                'Outputs': delta_edit_outputs,
-            },
-            {
-                'Resources': delta_minus_resources,
-                'Outputs': delta_minus_outputs,
-                'Parameters': delta_minus_parameters,
-            }
-        ),
-        terraform.generate_delta(context)
+    diff = {
+        'Resources': {title: resource_diff(old_resources[title], r) for title, r in delta_edit_resources.items()},
+        'Outputs': {title: resource_diff(old_outputs[title], o) for title, o in delta_edit_outputs.items()},
+    }
+
+    return cloudformation.CloudFormationDelta(
+        {
+            'Resources': delta_plus_resources,
+            'Outputs': delta_plus_outputs,
+            'Parameters': delta_plus_parameters,
+        },
+        {
+            'Resources': delta_edit_resources,
+            'Outputs': delta_edit_outputs,
+        },
+        {
+            'Resources': delta_minus_resources,
+            'Outputs': delta_minus_outputs,
+            'Parameters': delta_minus_parameters,
+        },
+        diff
     )
 
 def _current_cloudformation_template(stackname):
@@ -1101,7 +1214,11 @@ def _current_cloudformation_template(stackname):
 def download_cloudformation_template(stackname):
     cloudformation.write_template(stackname, json.dumps(_current_cloudformation_template(stackname)))
 
-def regenerate_stack(stackname, **more_context):
+def regenerate_stack(stackname, force=False, **more_context):
+    """rebuilds the context for an existing `stackname` and calculates the delta between it's current and new templates.
+    returns a triple of `(context, delta, current_context)`.
+    when the fingerprint in the current context matches, nothing has changed and `delta` is `None`.
+    use `force` to always regenerate the templates."""
     current_context = context_handler.load_context(stackname)
     download_cloudformation_template(stackname)
     (pname, _instance_id) = core.parse_stackname(stackname)
@@ -1121,6 +1238,24 @@ def regenerate_stack(stackname, **more_context):
     # 3. $ aws s3 cp kubernetes-aws--test.json s3://elife-builder/contexts/kubernetes-aws--test.json
 
     more_context['alt-config'] = current_context.get('alt-config', None)
+
+    unchanged = all(current_context.get(key) == val for key, val in more_context.items())
+    if not force and unchanged and stack_fingerprint_matches(pname, current_context):
+        LOG.info("project data and builder unchanged since %r was last updated, skipping template regeneration", stackname)
+        return current_context, None, current_context
+
     context = build_context(pname, existing_context=current_context, **more_context)
     delta = template_delta(context)
     return context, delta, current_context
+
+def stack_fingerprint_matches(pname, context):
+    "returns `True` if the fingerprint in the given `context` for project `pname` matches."
+    if pname not in project.project_list():
+        return False
+    pdata = context_project_data(pname, context.get('alt-config'))
+    return context_handler.fingerprint_matches(pdata, context)
+
+def fingerprint_context(context):
+    "returns a copy of the given `context` with a fingerprint of it's project data, the context and the builder code."
+    pdata = context_project_data(context['project_name'], context.get('alt-config'))
+    return context_handler.fingerprinted(pdata, context)
@@ -39,6 +39,7 @@ def download_template(stackname):
 def write_template(stackname, contents):
     "writes a json version of the python cloudformation template to the stacks directory"
     output_fname = core.stack_path(stackname)
+    utils.mkdir_p(os.path.dirname(output_fname))
     with open(output_fname, 'w') as fp:
         fp.write(contents)
     LOG.info("wrote cloudformation template for %r to: %s", stackname, output_fname)
@@ -73,9 +74,11 @@ def validate_template(rendered_template):
 
 # ---
 
-class CloudFormationDelta(namedtuple('Delta', ['plus', 'edit', 'minus'])):
+class CloudFormationDelta(namedtuple('Delta', ['plus', 'edit', 'minus', 'diff'])):
     """represents a delta between and old and new CloudFormation generated template, showing which resources are being added, updated, or removed
 
+    `diff` is a map of `{section: {title: [path, ...]}}` of the values that changed for each title in `edit`.
+
     Extends the namedtuple-generated class to add custom methods."""
     @property
     def non_empty(self):
@@ -90,7 +93,7 @@ class CloudFormationDelta(namedtuple('Delta', ['plus', 'edit', 'minus'])):
             self.minus['Parameters'],
         ])
 _empty_cloudformation_dictionary = {'Resources': {}, 'Outputs': {}, 'Parameters': {}}
-CloudFormationDelta.__new__.__defaults__ = (_empty_cloudformation_dictionary, _empty_cloudformation_dictionary, _empty_cloudformation_dictionary)
+CloudFormationDelta.__new__.__defaults__ = (_empty_cloudformation_dictionary, _empty_cloudformation_dictionary, _empty_cloudformation_dictionary, {})
 
 EMPTY_TEMPLATE = {'Resources': {}}
 
@@ -149,6 +152,8 @@ def bootstrap(stackname, context):
         # http://boto3.readthedocs.io/en/latest/reference/services/cloudformation.html#CloudFormation.ServiceResource.create_stack
         conn.create_stack(StackName=stackname, TemplateBody=stack_body, Parameters=parameters)
         _wait_until_in_progress(stackname)
+        invalidate_outputs(stackname)
+        core.invalidate_stack_index(stackname)
         return None
 
 class StackTakingLongTimeToCompleteError(RuntimeError):
@@ -210,13 +215,41 @@ def read_template(stackname):
     "returns the contents of a cloudformation template as a python data structure"
     return _read_template(os.path.join(config.STACK_DIR, stackname + ".json"))
 
+#
+# stack outputs cache
+# a stack's outputs only change when it's template changes, yet they are read many times over during a deployment.
+# they are fetched once and re-used until invalidated.
+#
+
+# {stackname: [{'OutputKey': ..., 'OutputValue': ...}, ...], ...}
+_OUTPUTS = {}
+
+def invalidate_outputs(stackname=None):
+    "forgets the outputs of `stackname` so they are fetched again, or the outputs of all stacks if no `stackname` given."
+    if stackname:
+        _OUTPUTS.pop(stackname, None)
+    else:
+        _OUTPUTS.clear()
+
+def _stack_outputs(stackname):
+    """returns the list of a stack's 'Outputs' or `None` if it has none.
+    outputs are only cached when the stack isn't being created, updated or deleted.
+    performs a boto API call if the outputs aren't cached."""
+    if stackname in _OUTPUTS:
+        return _OUTPUTS[stackname]
+    data = core.describe_stack(stackname).meta.data # boto3
+    outputs = data.get('Outputs')
+    if not data.get('StackStatus', '').endswith('_IN_PROGRESS'):
+        _OUTPUTS[stackname] = outputs
+    return outputs
+
 def outputs_map(stackname):
     """returns a map of a stack's 'Output' keys to their values.
-    performs a boto API call."""
-    data = core.describe_stack(stackname).meta.data # boto3
-    if "Outputs" not in data:
+    may perform a boto API call."""
+    outputs = _stack_outputs(stackname)
+    if outputs is None:
         return {}
-    return {o['OutputKey']: o.get('OutputValue') for o in data['Outputs']}
+    return {o['OutputKey']: o.get('OutputValue') for o in outputs}
 
 @core.requires_stack_file
 def template_outputs_map(stackname):
@@ -239,10 +272,10 @@ def template_using_elb_v2(stackname):
 def read_output(stackname, key):
     """finds a literal `Output` from a cloudformation template matching given `key`.
     fails hard if expected key not found, or too many keys found.
-    performs a boto API call."""
-    data = core.describe_stack(stackname).meta.data # boto3
-    ensure('Outputs' in data, "Outputs missing: %s" % data)
-    selected_outputs = [o for o in data['Outputs'] if o['OutputKey'] == key]
+    may perform a boto API call."""
+    outputs = _stack_outputs(stackname)
+    ensure(outputs is not None, "Outputs missing: %s" % stackname)
+    selected_outputs = [o for o in outputs if o['OutputKey'] == key]
     ensure(selected_outputs, "No outputs found for key %r" % (key,))
     ensure(len(selected_outputs) == 1, "Too many outputs selected for key %r: %s" % (key, selected_outputs))
     ensure('OutputValue' in selected_outputs[0], "Badly formed Output for key %r: %s" % (key, selected_outputs[0]))
@@ -302,6 +335,10 @@ def _update_template(stackname, template):
     waiting = "waiting for template of %s to be updated" % stackname
     done = "template of %s is in state UPDATE_COMPLETE" % stackname
     call_while(stack_is_updating, interval=config.AWS_POLLING_INTERVAL, timeout=7200, update_msg=waiting, done_msg=done)
+    # ec2 instances may have been replaced and outputs changed.
+    core.invalidate_ec2_inventory(stackname)
+    invalidate_outputs(stackname)
+    core.invalidate_stack_index(stackname)
 
 def destroy(stackname, context):
     try:
@@ -315,6 +352,8 @@ def destroy(stackname, context):
                     return False
                 raise # not sure what happened, but we're not handling it here. die.
         call_while(partial(is_deleting, stackname), timeout=3600, update_msg='Waiting for CloudFormation to finish deleting stack ...')
+        invalidate_outputs(stackname)
+        core.invalidate_stack_index(stackname)
         _delete_stack_file(stackname)
         keypair.delete_keypair(stackname) # deletes the keypair wherever it can find it (locally, remotely)
 
@@ -1,5 +1,8 @@
+import atexit
+import functools
 import logging
 import os
+import time
 from io import BytesIO
 
 import pssh.exceptions
@@ -26,6 +29,112 @@ NetworkAuthenticationError = pssh.exceptions.AuthenticationError
 threadbare.state.set_defaults({"abort_exception": CommandError,
                                "key_filename": os.path.expanduser(config.USER_PRIVATE_KEY)})
 
+#
+# ssh connection pool
+#
+
+# threadbare creates a new ssh connection to a host for every `settings` context and drops it when the context is left.
+# tasks like `cfn.update` connect to the same hosts many times over (setup, `buildvars.refresh`, `run_script`, highstate),
+# so connections are taken from a pool instead and returned to it when the context is left.
+# connections are never shared between processes. parallel execution forks a process per host and
+# each process has it's own pool, connections are only re-used within the same process.
+
+# {pid: {client-key: [(released-at, client), ...], ...}, ...}
+_SSH_POOL = {}
+
+def _idle_ssh_clients():
+    """returns the idle connections for the current process.
+    a forked process inherits it's parent's pool but must not use or close it's connections."""
+    return _SSH_POOL.setdefault(os.getpid(), {})
+
+def _close_ssh_client(client):
+    "disconnects `client` from the host. pssh's `disconnect` is a no-op and otherwise only disconnects when the client is garbage collected."
+    client._disconnect()
+
+def ssh_client_healthy(client):
+    "returns `True` if the connection to the host is still open and responding."
+    if client.sock is None or client.sock.closed or client.session is None:
+        return False
+    try:
+        client.eagain(client.session.keepalive_send)
+        return True
+    except Exception:
+        LOG.debug("ssh connection to %s is unhealthy", client.host, exc_info=True)
+        return False
+
+def evict_idle_ssh_clients(now=None):
+    "closes any pooled connections that have been idle for longer than `config.SSH_POOL_IDLE_TIMEOUT` seconds."
+    now = time.monotonic() if now is None else now
+    for key, idle in _idle_ssh_clients().items():
+        expired = [client for released_at, client in idle if now - released_at > config.SSH_POOL_IDLE_TIMEOUT]
+        if expired:
+            _idle_ssh_clients()[key] = [(released_at, client) for released_at, client in idle if client not in expired]
+            for client in expired:
+                LOG.debug("closing idle ssh connection to %s", client.host)
+                _close_ssh_client(client)
+
+def pooled_ssh_client(client_key):
+    """returns a healthy idle connection from the pool for the given threadbare `client_key` (user, host, pkey, port),
+    or a new connection if there isn't one."""
+    evict_idle_ssh_clients()
+    idle = _idle_ssh_clients().get(client_key, [])
+    while idle:
+        _, client = idle.pop()
+        if ssh_client_healthy(client):
+            LOG.debug("re-using ssh connection to %s", client.host)
+            return client
+        _close_ssh_client(client)
+    # the same parameters threadbare would create the client with.
+    return threadbare.operations.SSHClient(password=None, **dict(client_key))
+
+def release_ssh_client(client_key, client):
+    "returns `client` to the pool of idle connections for re-use."
+    idle = _idle_ssh_clients().setdefault(client_key, [])
+    if client not in [pooled for _, pooled in idle]:
+        idle.append((time.monotonic(), client))
+
+@atexit.register
+def close_ssh_pool():
+    "closes all idle connections in the current process's pool."
+    for idle in _idle_ssh_clients().values():
+        for _, client in idle:
+            _close_ssh_client(client)
+    _SSH_POOL.pop(os.getpid(), None)
+
+class PooledSSHClientMap(dict):
+    """the map of connections threadbare looks in for one to re-use before creating it's own, see `threadbare.operations._ssh_client`.
+    a connection missing from the map is taken from the pool and returned to it when the current `settings` context is left."""
+
+    def __contains__(self, client_key):
+        if not dict.__contains__(self, client_key):
+            client = pooled_ssh_client(client_key)
+            dict.__setitem__(self, client_key, client)
+            pid = os.getpid()
+
+            def release():
+                if os.getpid() == pid:
+                    release_ssh_client(client_key, client)
+            threadbare.state.add_cleanup(release)
+        return True
+
+def use_ssh_pool():
+    """ensures connections made within the current `settings` context are taken from the pool.
+    does nothing outside of a `settings` context, where threadbare doesn't keep it's connections."""
+    _env = threadbare.state.ENV
+    if _env.read_only:
+        return
+    client_map = _env.get('ssh_client', {})
+    if not isinstance(client_map, PooledSSHClientMap):
+        _env['ssh_client'] = PooledSSHClientMap(client_map)
+
+def _pooled(operation):
+    "wraps a threadbare `operation` so the connection it makes is taken from the pool."
+    @functools.wraps(operation)
+    def wrapper(*args, **kwargs):
+        use_ssh_pool()
+        return operation(*args, **kwargs)
+    return wrapper
+
 #
 # api
 #
@@ -51,11 +160,11 @@ settings = threadbare.state.settings
 lcd = threadbare.operations.lcd # local change dir
 rcd = threadbare.operations.rcd # remote change dir
 
-remote = threadbare.operations.remote
-remote_sudo = threadbare.operations.remote_sudo
-upload = threadbare.operations.upload
-download = threadbare.operations.download
-remote_file_exists = threadbare.operations.remote_file_exists
+remote = _pooled(threadbare.operations.remote)
+remote_sudo = _pooled(threadbare.operations.remote_sudo)
+upload = _pooled(threadbare.operations.upload)
+download = _pooled(threadbare.operations.download)
+remote_file_exists = _pooled(threadbare.operations.remote_file_exists)
 
 #
 # wrappers/convenience functions
@@ -1,6 +1,9 @@
 "Bit of a floating module, I guess to avoid circular dependencies. Needs to be reconciled somehow."
 
-from . import bluegreen, bluegreen_v2, cloudformation, context_handler
+from functools import partial
+
+from . import bluegreen, bluegreen_v2, cloudformation, context_handler, core, utils
+from .utils import ensure
 
 
 def concurrency_for(stackname, concurrency_name):
@@ -10,22 +13,37 @@ def concurrency_for(stackname, concurrency_name):
     - serial: one at a time
     - parallel: all together
     - blue-green: 50% at a time
+    - blue-green:N: 1/N at a time, for stacks using an ELBv2 load balancer. for example 'blue-green:3'.
+    - rolling: a window of nodes at a time, 25% by default.
+      the window may be a number of nodes ('rolling:3') or a percentage ('rolling:10%')
+      and may be followed by the number of failed nodes to tolerate before stopping ('rolling:3:1').
 
     requires `stackname` to exist on the filesystem, see `src.decorators.requires_aws_stack_template`."""
 
-    concurrency_names = ['serial', 'parallel', 'blue-green']
+    concurrency_names = ['serial', 'parallel', 'blue-green[:<groups>]', 'rolling[:<window>[:<max-failures>]]']
+
+    name, _, num_groups = (concurrency_name or '').partition(':')
+    if name == 'blue-green':
+        num_groups = num_groups or '2'
+        ensure(utils.isint(num_groups) and int(num_groups) > 1, "blue-green concurrency needs two or more groups, got: %s" % num_groups, ValueError)
+        num_groups = int(num_groups)
 
-    if concurrency_name == 'blue-green':
         context = context_handler.load_context(stackname)
 
         if cloudformation.template_using_elb_v1(stackname):
+            ensure(num_groups == 2, "blue-green concurrency for an ELB (v1) load balancer only supports two groups", ValueError) # noqa: PLR2004
             return bluegreen.BlueGreenConcurrency(context['aws']['region'])
 
-        return bluegreen_v2.do
+        if num_groups == 2: # noqa: PLR2004
+            return bluegreen_v2.do
+        return partial(bluegreen_v2.do, num_groups=num_groups)
 
     if concurrency_name in ["serial", "parallel"]:
         return concurrency_name
 
+    if core.parse_rolling_concurrency(concurrency_name):
+        return concurrency_name
+
     if concurrency_name is None:
         return 'parallel'
 
@@ -14,10 +14,22 @@ For testing, see `switch_in_test_settings` and `set_config` in `./src/tests/base
 import getpass
 import logging
 import os
+import time
 from os.path import join
 
 from buildercore import utils
-from buildercore.utils import ensure, lmap
+from buildercore.utils import ensure
+
+# time taken by each stage of this module's setup, reported by `BUILDER_PROFILE_STARTUP=1 ./bldr ...`.
+# see `src/profiling.py`.
+SETUP_TIMINGS = [] # [(stage, seconds), ...]
+_SETUP_STAGE_START = [time.perf_counter()]
+
+def _setup_stage(stage):
+    "records the time since the previous stage of setup ended as the time taken by `stage`."
+    now = time.perf_counter()
+    SETUP_TIMINGS.append((stage, now - _SETUP_STAGE_START[0]))
+    _SETUP_STAGE_START[0] = now
 
 # *_DIR are relative
 # *_PATH are absolute
@@ -40,6 +52,7 @@ ENV = {
     'INSTANCE': None,
     'BUILDER_TOPFILE': '',
     'USER_SETTINGS_PATH': '',
+    'BUILDER_PROJECT_CACHE': '1', # True
 }
 ENV = {k: os.environ.get(k, default) for k, default in ENV.items()}
 
@@ -65,6 +78,8 @@ STACK_DIR = join(CFN_DIR, "stacks") # "./.cfn/stacks"
 CONTEXT_DIR = join(CFN_DIR, "contexts") # "./.cfn/stacks"
 SCRIPTS_DIR = "scripts"
 KEYPAIR_DIR = join(CFN_DIR, "keypairs") # "./.cfn/keypairs"
+PROJECT_CACHE_DIR = join(CFN_DIR, "project-cache") # "./.cfn/project-cache"
+STACK_INDEX_DIR = join(CFN_DIR, "stack-index") # "./.cfn/stack-index"
 
 # lsh@2023-03-29: projects can now specify specfic versions of Terraform to use.
 # this is possible using 'tfenv': https://github.com/tfutils/tfenv
@@ -72,14 +87,21 @@ TERRAFORM_BIN_PATH = join(PROJECT_PATH, ".tfenv", "bin", "terraform")
 # the .cfn dir was for cloudformation stuff, but we keep keypairs in there too, so this can't hurt
 # perhaps a namechange from .cfn to .state or something later
 TERRAFORM_DIR = join(CFN_DIR, "terraform")
+# Terraform providers are downloaded once into a cache shared by every stack.
+# - https://developer.hashicorp.com/terraform/cli/config/config-file#provider-plugin-cache
+TERRAFORM_PLUGIN_CACHE_PATH = join(PROJECT_PATH, CFN_DIR, "terraform-plugin-cache") # "/.../.cfn/terraform-plugin-cache/"
 
 STACK_PATH = join(PROJECT_PATH, STACK_DIR) # "/.../.cfn/stacks/"
 CONTEXT_PATH = join(PROJECT_PATH, CONTEXT_DIR) # "/.../.cfn/contexts/"
 KEYPAIR_PATH = join(PROJECT_PATH, KEYPAIR_DIR) # "/.../.cfn/keypairs/"
 SCRIPTS_PATH = join(PROJECT_PATH, SCRIPTS_DIR) # "/.../scripts/"
+PROJECT_CACHE_PATH = join(PROJECT_PATH, PROJECT_CACHE_DIR) # "/.../.cfn/project-cache/"
+STACK_INDEX_PATH = join(PROJECT_PATH, STACK_INDEX_DIR) # "/.../.cfn/stack-index/"
+
+# directories that are written to are created when they are first written to.
+# importing `buildercore` shouldn't modify the filesystem.
 
-# create all necessary paths and ensure they are writable
-lmap(utils.mkdir_p, [TEMP_PATH, STACK_PATH, CONTEXT_PATH, SCRIPTS_PATH, KEYPAIR_PATH])
+_setup_stage('environment')
 
 # read user config
 
@@ -95,13 +117,13 @@ if os.path.exists(ENV['USER_SETTINGS_PATH']):
 elif os.path.exists(USER_SETTINGS_PATH):
     with open(USER_SETTINGS_PATH) as fh:
         USER.update(utils.yaml_load(fh.read()))
+_setup_stage('user settings')
 
 # logging
 
 LOG_DIR = "logs"
 LOG_PATH = join(PROJECT_PATH, LOG_DIR) # /.../logs/
 LOG_FILE = join(LOG_PATH, "app.log") # /.../logs/app.log
-utils.mkdir_p(LOG_PATH)
 
 FORMAT = logging.Formatter("%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s")
 CONSOLE_FORMAT = logging.Formatter("%(levelname)s - %(name)s - %(message)s")
@@ -116,8 +138,19 @@ CONSOLE_HANDLER = logging.StreamHandler()
 CONSOLE_HANDLER.setLevel(logging.INFO) # output level for *this handler*
 CONSOLE_HANDLER.setFormatter(CONSOLE_FORMAT)
 
+class LazyFileHandler(logging.FileHandler):
+    """a `FileHandler` that opens it's log file when the first record is written to it,
+    creating the log file's directory if necessary."""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+
+    def _open(self):
+        utils.mkdir_p(os.path.dirname(self.baseFilename))
+        return super()._open()
+
 # FileHandler sends to a named file
-FILE_HANDLER = logging.FileHandler(LOG_FILE)
+FILE_HANDLER = LazyFileHandler(LOG_FILE)
 _log_level = ENV['LOG_LEVEL_FILE']
 FILE_HANDLER.setLevel(getattr(logging, _log_level))
 FILE_HANDLER.setFormatter(FORMAT)
@@ -134,6 +167,7 @@ logging.getLogger('paramiko.transport').setLevel(logging.ERROR)
 # 2021-11-09 15:43:51,541 botocore.credentials [INFO] Found credentials in shared credentials file: ~/.aws/credentials
 # INFO - botocore.credentials - Found credentials in shared credentials file: ~/.aws/credentials
 logging.getLogger('botocore.credentials').setLevel(logging.WARNING)
+_setup_stage('logging')
 
 def get_logger(name):
     "ensures logging is setup before handing out a Logger object to use"
@@ -154,6 +188,20 @@ BUILDER_TIMEOUT = int(ENV['BUILDER_TIMEOUT'])
 # a value <=2 and the likelihood of throttling goes up.
 AWS_POLLING_INTERVAL = 4 # seconds
 
+# how long a snapshot of a region's ec2 instances can be re-used before it's fetched again.
+# shorter than `AWS_POLLING_INTERVAL` so polling for ec2 state changes never sees a stale snapshot.
+EC2_INVENTORY_TTL = 3 # seconds
+
+# maximum number of AWS API requests made at once when many independent changes are applied together.
+AWS_MAX_CONCURRENT_REQUESTS = 8
+
+# how long a region's index of CloudFormation stacks can be re-used before it's fetched again.
+# stacks changed by builder are fetched individually the next time the index is used.
+STACK_INDEX_TTL = 60 # seconds
+
+# how long an unused ssh connection is kept open for re-use before it's closed.
+SSH_POOL_IDLE_TIMEOUT = 300 # seconds
+
 KEYPAIR_PREFIX = 'keypairs/'
 CONTEXT_PREFIX = 'contexts/'
 
@@ -167,6 +215,10 @@ ensure(isinstance(USER['project-files'], list),
 # all project files are rooted in the builder project directory. no good reason, subject to change.
 PROJECTS_PATH_LIST = [join(PROJECT_PATH, project_file) for project_file in USER['project-files']]
 
+# the fully expanded project map is cached on disk, keyed by the contents of the project files.
+# disable with `BUILDER_PROJECT_CACHE=0 ./bldr ...`
+PROJECT_CACHE = ENV['BUILDER_PROJECT_CACHE'] == '1'
+
 CLONED_PROJECT_FORMULA_PATH = os.path.join(PROJECT_PATH, 'cloned-projects') # same path as used by Vagrant
 
 USER_PRIVATE_KEY = ENV['CUSTOM_SSH_KEY']
@@ -184,3 +236,5 @@ TWI_CLEANUP = ENV['BLDR_TWI_CLEANUP'] == '1' # tear down test stack after testin
 # ---
 
 STACKS_PATH_LIST = [join(PROJECT_PATH, stack_file) for stack_file in USER['stack-files']]
+
+_setup_stage('other')
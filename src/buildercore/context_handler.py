@@ -10,12 +10,16 @@
 # See cloudformation.py and trop.py for rendering Cloudformation templates with this context data
 # See terraform.py for rendering Terraform templates with this context data
 
+import copy
+import hashlib
 import json
 import logging
 import os
 from os.path import join
 
-from . import config, s3
+from kids.cache import cache as cached
+
+from . import config, s3, utils
 
 LOG = logging.getLogger(__name__)
 
@@ -25,15 +29,49 @@ def s3_context_key(stackname):
 def local_context_file(stackname):
     return join(config.CONTEXT_DIR, stackname + ".json")
 
+#
+# context cache
+# the local copy of a context is kept alongside the ETag of the S3 object it was downloaded from.
+# the local copy is revalidated against S3 with a conditional GET and is only downloaded again if it has changed.
+# once loaded, a context is re-used for the rest of the process.
+#
+
+# {stackname: context, ...}
+_CONTEXTS = {}
+
+def local_etag_file(stackname):
+    return local_context_file(stackname) + ".etag"
+
+def _read_local_etag(stackname):
+    "returns the ETag of the local copy of the context for `stackname` or `None` if there isn't a local copy."
+    path = local_etag_file(stackname)
+    if not os.path.exists(path) or not os.path.exists(local_context_file(stackname)):
+        return None
+    with open(path) as fh:
+        return fh.read().strip() or None
+
+def _write_local_etag(stackname, etag):
+    utils.mkdir_p(config.CONTEXT_DIR)
+    with open(local_etag_file(stackname), 'w') as fh:
+        fh.write(etag)
+
+def _delete_local_etag(stackname):
+    path = local_etag_file(stackname)
+    if os.path.exists(path):
+        os.unlink(path)
+
 def download_from_s3(stackname, refresh=False):
+    """downloads the context for `stackname` from S3 if there is no local copy or the local copy is out of date.
+    use `refresh=True` to always download the context.
+    returns `False` if the context doesn't exist on S3."""
     key = s3_context_key(stackname)
-    if not s3.exists(key):
+    utils.mkdir_p(config.CONTEXT_DIR)
+    etag = None if refresh else _read_local_etag(stackname)
+    new_etag, downloaded = s3.download_if_changed(key, local_context_file(stackname), etag)
+    if not new_etag:
         return False
-
-    expected_path = local_context_file(stackname)
-    if os.path.exists(expected_path) and refresh:
-        os.unlink(expected_path)
-    s3.download(key, expected_path)
+    if downloaded:
+        _write_local_etag(stackname, new_etag)
     return True
 
 def _load_context_from_disk(stackname):
@@ -42,8 +80,8 @@ def _load_context_from_disk(stackname):
         return json.load(fh)
 
 def _load_context_from_s3(stackname):
-    "downloads context from S3 then returns the results of loading it from disk"
-    if not download_from_s3(stackname, refresh=True):
+    "downloads context from S3 if it has changed then returns the results of loading it from disk"
+    if not download_from_s3(stackname):
         raise MissingContextFileError("We are missing the context file for %s, even on S3. Does the stack exist?" % stackname)
     return _load_context_from_disk(stackname)
 
@@ -68,7 +106,10 @@ def load_context(stackname):
     #contents = json.load(open(path, 'r'))
 
     # lsh@2021-06-22: broke the above logic into two parts so I can swap out s3 during testing
-    contents = _load_context_from_s3(stackname)
+    # the local copy is now revalidated against S3 and re-used if it hasn't changed.
+    if stackname not in _CONTEXTS:
+        _CONTEXTS[stackname] = _load_context_from_s3(stackname)
+    contents = copy.deepcopy(_CONTEXTS[stackname])
 
     # fallback: if legacy 'project.aws' key exists, use that for 'aws'
     if contents.get('project', {}).get('aws'):
@@ -79,6 +120,10 @@ def load_context(stackname):
     return contents
 
 def write_context_locally(stackname, contents):
+    utils.mkdir_p(config.CONTEXT_DIR)
+    # the local copy no longer matches any copy on S3.
+    _CONTEXTS.pop(stackname, None)
+    _delete_local_etag(stackname)
     with open(local_context_file(stackname), 'w') as fh:
         fh.write(contents)
 
@@ -86,17 +131,24 @@ def write_context_to_s3(stackname):
     path = local_context_file(stackname)
     key = s3_context_key(stackname)
     with open(path, 'rb') as fh:
-        s3.write(key, fh, overwrite=True)
+        resp = s3.write(key, fh, overwrite=True)
+    # the local copy is now the same as the copy on S3.
+    _write_local_etag(stackname, resp['ETag'])
 
 def write_context(stackname, context):
-    write_context_locally(stackname, json.dumps(context))
+    contents = json.dumps(context)
+    write_context_locally(stackname, contents)
     write_context_to_s3(stackname)
+    _CONTEXTS[stackname] = json.loads(contents)
 
 def delete_context_from_s3(stackname):
     key = s3_context_key(stackname)
+    _CONTEXTS.pop(stackname, None)
     return s3.delete(key)
 
 def delete_context_locally(stackname):
+    _CONTEXTS.pop(stackname, None)
+    _delete_local_etag(stackname)
     path = local_context_file(stackname)
     if os.path.exists(path):
         os.unlink(path)
@@ -105,6 +157,58 @@ def delete_context(stackname):
     delete_context_locally(stackname)
     delete_context_from_s3(stackname)
 
+#
+# fingerprints
+#
+
+# a context that was built from the same project data by the same builder code will always
+# produce the same templates. a fingerprint of these is stored in the context under this key
+# once the stack's templates have been successfully updated.
+FINGERPRINT_KEY = 'fingerprint'
+
+def _directory_fingerprint(path):
+    """returns a digest of the name and contents of every file beneath `path`.
+    compiled Python files are ignored."""
+    digest = hashlib.sha256()
+    for root, dir_list, file_list in os.walk(path):
+        dir_list[:] = sorted(dirname for dirname in dir_list if dirname != '__pycache__')
+        for fname in sorted(file_list):
+            if fname.endswith(('.pyc', '.pyo')):
+                continue
+            fpath = join(root, fname)
+            digest.update(os.path.relpath(fpath, path).encode())
+            with open(fpath, 'rb') as fh:
+                digest.update(fh.read())
+    return digest.hexdigest()
+
+@cached
+def code_fingerprint():
+    """returns a digest of the `buildercore` code and files used to build contexts and render templates.
+    templates are also rendered from files that aren't Python, like Fastly VCL, WAF rules and BigQuery schemas."""
+    return _directory_fingerprint(os.path.dirname(os.path.abspath(__file__)))
+
+def _normalise(data):
+    "returns `data` as a canonical JSON string. keys are sorted and coerced to strings the same way they are when a context is stored."
+    return json.dumps(json.loads(json.dumps(data, default=str)), sort_keys=True)
+
+def fingerprint(pdata, context):
+    """returns a digest of the project data `pdata` used to build `context`, the `context` itself and the builder code.
+    any stored fingerprint in `context` is ignored."""
+    context = {key: val for key, val in context.items() if key != FINGERPRINT_KEY}
+    digest = hashlib.sha256(code_fingerprint().encode())
+    digest.update(_normalise(pdata).encode())
+    digest.update(_normalise(context).encode())
+    return digest.hexdigest()
+
+def fingerprinted(pdata, context):
+    "returns a copy of `context` with it's fingerprint."
+    return dict(context, **{FINGERPRINT_KEY: fingerprint(pdata, context)})
+
+def fingerprint_matches(pdata, context):
+    """returns `True` if the fingerprint stored in `context` matches the given project data `pdata`, the `context` and the builder code.
+    a match means regenerating the context and templates would result in no changes."""
+    return bool(context.get(FINGERPRINT_KEY)) and context[FINGERPRINT_KEY] == fingerprint(pdata, context)
+
 def only_if(*servicenames):
     """Decorator that only executes an update function if the context contains a particular servicename that would need it"""
     def decorate_with_only_if(fn):
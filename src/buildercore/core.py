@@ -1,7 +1,11 @@
 "general logic for the `buildercore` module."
 
+import json
 import logging
+import math
 import os
+import tempfile
+import threading
 import time
 from collections import OrderedDict
 from contextlib import contextmanager
@@ -10,7 +14,6 @@ from os.path import join
 import boto3
 import botocore
 import botocore.config
-from kids.cache import cache as cached
 from slugify import slugify
 
 from . import (  # BE SUPER CAREFUL OF CIRCULAR DEPENDENCIES
@@ -113,7 +116,7 @@ def all_sns_subscriptions(region, stackname=None):
     Unfortunately there is no boto method to filter SNS subscriptions by SQS name.
     An SQS queue may also be subscribed to multiple different topics,
     as well as being subscribed to the *same* topic multiple times (somehow, de-duping
-    is handled in `bootstrap.unsub_sqs`)."""
+    is handled in `bootstrap.sqs_plan`)."""
 
     # a subscription looks like:
     # {'Endpoint': 'arn:aws:sqs:us-east-1:512686554592:observer--substest1',
@@ -137,6 +140,10 @@ def all_sns_subscriptions(region, stackname=None):
     return subs_list
 
 
+# creating boto3 clients and resources with the default session isn't thread safe.
+# - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/clients.html#multithreading-or-multiprocessing-with-clients
+_BOTO_LOCK = threading.Lock()
+
 def boto_resource(service, region=None):
     kwargs = {}
     if region:
@@ -150,7 +157,8 @@ def boto_resource(service, region=None):
                 'mode': 'adaptive'
             }
         )
-    return boto3.resource(service, **kwargs)
+    with _BOTO_LOCK:
+        return boto3.resource(service, **kwargs)
 
 def boto_client(service, region=None):
     """the boto3 'service' client is a lower-level construct compared to the boto3 'resource' client.
@@ -158,7 +166,8 @@ def boto_client(service, region=None):
     exceptions = ['route53', 's3']
     if service not in exceptions:
         ensure(region, "'region' is a required parameter for all services except: %s" % (', '.join(exceptions),))
-    return boto3.client(service, region_name=region)
+    with _BOTO_LOCK:
+        return boto3.client(service, region_name=region)
 
 def boto_conn(pname_or_stackname, service, client=False):
     "convenience. returns a boto Resource or client for the given project or stack name, using the region found in the project config."
@@ -182,6 +191,76 @@ def tags2dict(tags):
         return {}
     return {el['Key']: el['Value'] for el in tags}
 
+#
+# ec2 inventory
+# a short-lived snapshot of the ec2 instances in a region, shared by all stacks in a single run.
+# ec2 state is polled heavily and the same instances are often looked up several times per task,
+# so describing the instances once and serving each stack from an index saves many API calls.
+#
+
+# {region: (fetched-at, [ec2.Instance, ...], {stackname: [ec2.Instance, ...]}), ...}
+_EC2_INVENTORY = {}
+
+# {(region, stackname): (fetched-at, [ec2.Instance, ...]), ...}
+_EC2_STACK_INVENTORY = {}
+
+def _inventory_is_fresh(fetched_at):
+    return (time.monotonic() - fetched_at) < config.EC2_INVENTORY_TTL
+
+def ec2_inventory(region, refresh=False):
+    """returns a pair of `(all ec2 instances, {stackname: [ec2 instance, ...]})` for the given `region`.
+    all instances are fetched with a single (paginated) query and re-used for `config.EC2_INVENTORY_TTL` seconds.
+    instances are indexed by their `aws:cloudformation:stack-name` tag, instances without one are not indexed."""
+    inventory = _EC2_INVENTORY.get(region)
+    if inventory and not refresh and _inventory_is_fresh(inventory[0]):
+        return inventory[1], inventory[2]
+
+    conn = boto_resource('ec2', region)
+    # the resource collection handles pagination, 1000 is the maximum page size.
+    # - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.ServiceResource.instances
+    ec2_list = list(conn.instances.all().page_size(1000))
+    index = {}
+    for ec2 in ec2_list:
+        stackname = tags2dict(ec2.tags).get('aws:cloudformation:stack-name')
+        if stackname:
+            index.setdefault(stackname, []).append(ec2)
+    _EC2_INVENTORY[region] = (time.monotonic(), ec2_list, index)
+    return ec2_list, index
+
+def _stack_ec2_inventory(stackname):
+    """returns a list of ec2 instances for `stackname` in any state.
+    a fresh inventory of the stack's region is used if one exists, otherwise just the stack's instances are fetched."""
+    region = find_region(stackname)
+    inventory = _EC2_INVENTORY.get(region)
+    if inventory and _inventory_is_fresh(inventory[0]):
+        return list(inventory[2].get(stackname, []))
+
+    key = (region, stackname)
+    stack_inventory = _EC2_STACK_INVENTORY.get(key)
+    if stack_inventory and _inventory_is_fresh(stack_inventory[0]):
+        return list(stack_inventory[1])
+
+    # http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeInstances.html
+    # http://boto3.readthedocs.io/en/latest/reference/services/ec2.html#EC2.ServiceResource.instances
+    conn = boto_resource('ec2', region)
+    filters = [
+        {'Name': 'tag:aws:cloudformation:stack-name', 'Values': [stackname]}
+    ]
+    ec2_list = list(conn.instances.filter(Filters=filters))
+    _EC2_STACK_INVENTORY[key] = (time.monotonic(), ec2_list)
+    return list(ec2_list)
+
+def invalidate_ec2_inventory(stackname=None):
+    """discards any cached ec2 instances for the given `stackname` and every region inventory.
+    discards everything if no `stackname` is given.
+    call this after ec2 instances are created, started, stopped or destroyed."""
+    _EC2_INVENTORY.clear()
+    if not stackname:
+        _EC2_STACK_INVENTORY.clear()
+        return
+    for key in [key for key in _EC2_STACK_INVENTORY if key[1] == stackname]:
+        del _EC2_STACK_INVENTORY[key]
+
 def ec2_instance_list(state='running'):
     """returns a list of all ec2 instances in given `state`.
     default state is `running`. `None` is considered 'any state'."""
@@ -189,52 +268,36 @@ def ec2_instance_list(state='running'):
     err_msg = "unknown ec2 state %r; known states: %s and None (all states)" % (state, known_states_str)
     ensure(state is None or state in ALL_EC2_STATES, err_msg)
 
-    conn = boto_resource('ec2', find_region())
-
-    filters = []
+    ec2_instances, _ = ec2_inventory(find_region())
     if state:
-        filters = [
-            {'Name': 'instance-state-name', 'Values': [state]}
-        ]
-    # probably not paginated, but we can specify 1000 results at once:
-    # - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.ServiceResource.instances
-    result = conn.instances.filter(Filters=filters, MaxResults=1000)
-    ec2_list = [ec2.meta.data for ec2 in result]
+        ec2_instances = [ec2 for ec2 in ec2_instances if ec2.state['Name'] == state]
+
+    # `meta.data` is shared with the inventory, don't modify it.
+    ec2_list = [dict(ec2.meta.data) for ec2 in ec2_instances]
     for ec2 in ec2_list:
-        ec2['TagsDict'] = tags2dict(ec2['Tags'])
+        ec2['TagsDict'] = tags2dict(ec2.get('Tags'))
     return ec2_list
 
 def find_ec2_instances(stackname, state='running', node_ids=None, allow_empty=False):
     "returns list of ec2 instances data for a *specific* stackname. Ordered by node index (1 to N)"
-    # http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeInstances.html
-    conn = boto_conn(stackname, 'ec2')
-    filters = [
-        {'Name': 'tag:aws:cloudformation:stack-name', 'Values': [stackname]}
-    ]
-    # hypothesis is that this is causing filters to skip running instances, non-deterministically.
-    # We'll try to filter the list in-memory instead (below)
-    # if state:
-    #    filters.append({'Name': 'instance-state-name', 'Values': [state]})
+    ec2_instances = _stack_ec2_inventory(stackname)
 
-    # an instance-id looks like: i-011d46bf3978e5618
-    # NOTE: only lifecycle._ec2_nodes_states uses `node_ids` and nothing is passing it node ids
-    if node_ids:
-        filters.append({'Name': 'instance-id', 'Values': node_ids})
-
-    # http://boto3.readthedocs.io/en/latest/reference/services/ec2.html#EC2.ServiceResource.instances
-    ec2_instances = list(conn.instances.filter(Filters=filters))
-
-    # hack, see problems with query above. this problem hasn't been replicated (yet) on boto3
+    # filtering by state in the query was suspected of skipping running instances, non-deterministically.
+    # the list is filtered in-memory instead.
     if state:
         state = [state] if '|' not in state else state.split('|')
         ec2_instances = [i for i in ec2_instances if i.state['Name'] in state]
 
+    # an instance-id looks like: i-011d46bf3978e5618
+    # NOTE: only lifecycle._ec2_nodes_states uses `node_ids` and nothing is passing it node ids
+    if node_ids:
+        ec2_instances = [i for i in ec2_instances if i.id in node_ids]
+
     LOG.debug("find_ec2_instances returned: %s", [(e.id, e.state) for e in ec2_instances])
 
     # multiple instances are sorted by node asc
     ec2_instances = sorted(ec2_instances, key=lambda ec2inst: tags2dict(ec2inst.tags).get('Node', 0))
 
-    LOG.debug("find_ec2_instances with filters %s returned: %s", filters, [e.id for e in ec2_instances])
     if not allow_empty and not ec2_instances:
         raise NoRunningInstancesError("found no running ec2 instances for %r. The stack nodes may have been stopped, but here we were requiring them to be running" % stackname)
     return ec2_instances
@@ -449,6 +512,11 @@ def stack_all_ec2_nodes(stackname, workfn, username=config.DEPLOY_USER, concurre
     if concurrency == 'parallel':
         return parallel_work(single_node_work_fn, params)
 
+    rolling = parse_rolling_concurrency(concurrency)
+    if rolling:
+        window, max_failures = rolling
+        return rolling_work(single_node_work_fn, params, window, max_failures)
+
     if callable(concurrency):
         return concurrency(single_node_work_fn, params)
 
@@ -462,6 +530,77 @@ def parallel_work(single_node_work, params):
     with settings(**params):
         return command.execute(command.parallel(single_node_work), hosts=list(params['public_ips'].values()))
 
+#
+# rolling concurrency
+# works on a window of nodes at a time, for clusters too large to work on all at once and too slow to work on one at a time.
+#
+
+# the window used by a plain 'rolling' concurrency.
+DEFAULT_ROLLING_WINDOW = '25%'
+
+def parse_rolling_concurrency(concurrency):
+    """parses a 'rolling' concurrency string into a pair of `(window, max-failures)`.
+    returns `None` if `concurrency` isn't a rolling concurrency.
+
+    `window` is the number of nodes worked on at once, either a number ('rolling:3') or a percentage of nodes ('rolling:25%').
+    `max-failures` is the number of failed nodes tolerated before the work is stopped ('rolling:3:1'), defaulting to 0."""
+    if not isstr(concurrency):
+        return None
+    name, _, rest = concurrency.partition(':')
+    if name != 'rolling':
+        return None
+    window, _, max_failures = rest.partition(':')
+    window = window or DEFAULT_ROLLING_WINDOW
+    max_failures = max_failures or '0'
+    size = window[:-1] if window.endswith('%') else window
+    ensure(utils.isint(size) and int(size) > 0, "rolling window must be a number or percentage greater than zero, got: %s" % window, ValueError)
+    ensure(not window.endswith('%') or int(size) <= 100, "rolling window percentage can't be greater than 100%%, got: %s" % window, ValueError) # noqa: PLR2004
+    ensure(utils.isint(max_failures) and int(max_failures) >= 0, "rolling max-failures must be zero or greater, got: %s" % max_failures, ValueError)
+    return window, int(max_failures)
+
+def rolling_window_size(window, num_nodes):
+    "returns the number of nodes in a rolling `window` given the total `num_nodes`. a window is never empty."
+    if window.endswith('%'):
+        return max(1, math.ceil(num_nodes * int(window[:-1]) / 100))
+    return int(window)
+
+def rolling_work(single_node_work, params, window, max_failures=0):
+    """executes `single_node_work` in parallel on a `window` of nodes at a time, in node order.
+    the work is stopped when more than `max_failures` nodes have failed and the first error is raised.
+    tolerated failures are raised once all nodes have been worked on."""
+    node_ids = sorted(params['public_ips'], key=lambda node_id: params['nodes'][node_id])
+    size = rolling_window_size(window, len(node_ids))
+
+    def timed_single_node_work():
+        start = time.monotonic()
+        try:
+            return single_node_work()
+        finally:
+            LOG.info("node %s finished in %.1fs", current_node_id(), time.monotonic() - start)
+
+    results = {}
+    failures = []
+    for offset in range(0, len(node_ids), size):
+        batch = node_ids[offset:offset + size]
+        LOG.info("rolling %s of %s nodes: %s", len(results) + len(batch), len(node_ids), [params['nodes'][node_id] for node_id in batch])
+        start = time.monotonic()
+        with settings(**params):
+            batch_results = command.execute(command.parallel(timed_single_node_work),
+                                            hosts=[params['public_ips'][node_id] for node_id in batch],
+                                            raise_unhandled_errors=False)
+        LOG.info("rolled %s nodes in %.1fs", len(batch), time.monotonic() - start)
+        for public_ip, result in batch_results.items():
+            if isinstance(result, BaseException):
+                LOG.error("work failed on %s: %s", public_ip, result)
+                failures.append(result)
+        results.update(batch_results)
+        if len(failures) > max_failures:
+            LOG.error("%s nodes failed (%s tolerated), not working on remaining %s nodes", len(failures), max_failures, len(node_ids) - len(results))
+            raise failures[0]
+    if failures:
+        raise failures[0]
+    return results
+
 def current_ec2_node_id():
     """Assumes it is called inside the 'workfn' of a 'stack_all_ec2_nodes'.
 
@@ -634,15 +773,175 @@ def stack_triple(aws_stack):
 #
 # lists of aws stacks
 #
+# listing stacks paginates every stack in the region, including those deleted in the last 90 days.
+# stacks that haven't been deleted are indexed by name and the index re-used for `config.STACK_INDEX_TTL` seconds.
+# the index is also written to disk so it can be re-used by other builder processes.
+# stacks changed by builder are marked 'dirty' and described individually the next time the index is used.
+#
 
-@cached
-def _aws_stacks(region, status=None, formatter=stack_triple):
-    "returns all stacks, even stacks deleted in the last 90 days, optionally filtered by status"
-    # NOTE: uses boto3 client interface rather than resource interface
-    # resource interface cannot filter by stack status
+# every stack status except 'DELETE_COMPLETE'.
+EXISTING_CFN_STATUS = [status for status in ALL_CFN_STATUS if status != 'DELETE_COMPLETE']
+
+# {region: {'fetched-at': seconds-since-epoch,
+#           'stacks': {stackname: stack-summary, ...},
+#           'dirty': {stackname: marked-at, ...},
+#           'described': {stackname: described-at, ...}}, ...}
+_STACK_INDEX = {}
+
+# guards `_STACK_INDEX` and the indices within it. stacks are invalidated from many threads at once, see `bootstrap.destroy_many`.
+_STACK_INDEX_LOCK = threading.RLock()
+
+def _stack_index_path(region):
+    return join(config.STACK_INDEX_PATH, region + ".json")
+
+def _read_stack_index(region):
+    "returns the index of stacks in `region` written to disk by any builder process or `None` if it doesn't exist or can't be read."
+    path = _stack_index_path(region)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as fh:
+            index = json.load(fh)
+    except (OSError, ValueError):
+        LOG.warning("failed to read stack index, ignoring: %s", path, exc_info=True)
+        return None
+    if not isinstance(index.get('dirty'), dict) or not isinstance(index.get('described'), dict):
+        # written by an older version of builder.
+        return None
+    return index
+
+def _merge_stack_index(index, other):
+    """returns the fresher of the two indices of stacks in the same region, `index` and `other`,
+    with the marks from both that are newer than the last time the fresher index described the stack.
+    builder processes replace the index on disk with their own, marks made by other processes would otherwise be lost."""
+    if not other:
+        return index
+    base, extra = (other, index) if other['fetched-at'] > index['fetched-at'] else (index, other)
+    dirty = dict(base['dirty'])
+    for stackname, marked_at in extra['dirty'].items():
+        if marked_at > base['described'].get(stackname, base['fetched-at']):
+            dirty[stackname] = max(marked_at, dirty.get(stackname, marked_at))
+    return dict(base, dirty=dirty)
+
+def _write_stack_index(region, index):
+    """writes the index of stacks in `region` to disk, merged with the index already on disk, returning the merged index.
+    the file is written to a temporary path first and then moved into place
+    so concurrent builder processes never see a partially written file."""
+    index = _merge_stack_index(index, _read_stack_index(region))
+    try:
+        utils.mkdir_p(config.STACK_INDEX_PATH)
+        fd, temp_path = tempfile.mkstemp(dir=config.STACK_INDEX_PATH, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(utils.json_dumps(index))
+            os.replace(temp_path, _stack_index_path(region))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+    except (OSError, AssertionError):
+        LOG.warning("failed to write stack index, ignoring: %s", _stack_index_path(region), exc_info=True)
+    return index
+
+def _stack_index_is_fresh(index):
+    return (time.time() - index['fetched-at']) < config.STACK_INDEX_TTL
+
+def _stack_summary(stack):
+    "returns a stack summary (as returned by `list_stacks`) for the given `stack` (as returned by `describe_stacks`)."
+    summary = subdict(stack, ['StackId', 'StackName', 'CreationTime', 'LastUpdatedTime', 'DeletionTime',
+                              'StackStatus', 'StackStatusReason', 'ParentId', 'RootId', 'DriftInformation'])
+    if 'Description' in stack:
+        summary['TemplateDescription'] = stack['Description']
+    return summary
+
+def _fetch_stack_index(region):
+    "returns a new index of the stacks in `region`. timestamps are ISO-8601 strings, as they are when read from disk."
+    fetched_at = time.time()
     paginator = boto_client('cloudformation', region).get_paginator('list_stacks')
-    paginator = paginator.paginate(StackStatusFilter=status or [])
-    results = utils.shallow_flatten([row['StackSummaries'] for row in paginator])
+    paginator = paginator.paginate(StackStatusFilter=EXISTING_CFN_STATUS)
+    summary_list = json.loads(utils.json_dumps(utils.shallow_flatten([row['StackSummaries'] for row in paginator])))
+    return {'fetched-at': fetched_at,
+            'stacks': {summary['StackName']: summary for summary in summary_list},
+            'dirty': {},
+            'described': {}}
+
+def _refresh_dirty_stacks(region, index):
+    """describes each stack marked 'dirty' in `index`, updating or removing it from the index.
+    stacks that are still changing remain 'dirty'."""
+    conn = boto_client('cloudformation', region)
+    for stackname, marked_at in list(index['dirty'].items()):
+        described_at = time.time()
+        try:
+            stack = conn.describe_stacks(StackName=stackname)['Stacks'][0]
+        except botocore.exceptions.ClientError as err:
+            if not err.response['Error']['Message'].endswith('does not exist'):
+                raise
+            stack = None
+        index['described'][stackname] = described_at
+        if not stack or stack['StackStatus'] == 'DELETE_COMPLETE':
+            index['stacks'].pop(stackname, None)
+        else:
+            index['stacks'][stackname] = json.loads(utils.json_dumps(_stack_summary(stack)))
+            if stack['StackStatus'].endswith('_IN_PROGRESS'):
+                continue
+        if index['dirty'].get(stackname) == marked_at:
+            del index['dirty'][stackname]
+
+def stack_index(region, refresh=False):
+    """returns a map of stack names to stack summaries for every stack in `region` that hasn't been deleted.
+    the index is re-used for `config.STACK_INDEX_TTL` seconds, see `invalidate_stack_index`."""
+    with _STACK_INDEX_LOCK:
+        index = None if refresh else _STACK_INDEX.get(region)
+        if not index or not _stack_index_is_fresh(index):
+            index = None if refresh else _read_stack_index(region)
+            if not index or not _stack_index_is_fresh(index):
+                index = _write_stack_index(region, _fetch_stack_index(region))
+        if index['dirty']:
+            _refresh_dirty_stacks(region, index)
+            index = _write_stack_index(region, index)
+        _STACK_INDEX[region] = index
+        # a copy, the index may be changed by another thread while the caller is using it.
+        return dict(index['stacks'])
+
+def invalidate_stack_index(stackname=None):
+    """marks `stackname` as changed in the index of stacks for it's region, in memory and on disk.
+    it will be described again the next time the index is used.
+    discards every index if no `stackname` is given.
+    call this after a CloudFormation stack is created, updated or deleted."""
+    with _STACK_INDEX_LOCK:
+        if not stackname:
+            _STACK_INDEX.clear()
+            if os.path.exists(config.STACK_INDEX_PATH):
+                for path in utils.listfiles(config.STACK_INDEX_PATH, ['.json']):
+                    os.unlink(path)
+            return
+        region = find_region(stackname)
+        index = _STACK_INDEX.get(region) or _read_stack_index(region)
+        if not index:
+            return
+        index['dirty'][stackname] = time.time()
+        _STACK_INDEX[region] = _write_stack_index(region, index)
+
+def find_stacks(region, pname=None, env=None, status=None):
+    """returns a list of summaries of stacks in `region` that haven't been deleted, sorted by name.
+    stacks can be filtered by project name `pname`, environment (instance-id) `env` and a list of `status`es.
+    stacks not managed by builder are excluded when filtering by project or environment."""
+    results = []
+    for stackname, summary in sorted(stack_index(region).items()):
+        if status and summary['StackStatus'] not in status:
+            continue
+        if pname or env:
+            if not stackname_parseable(stackname):
+                continue
+            bits = parse_stackname(stackname, all_bits=True)
+            if (pname and bits[0] != pname) or (env and bits[1] != env):
+                continue
+        results.append(summary)
+    return results
+
+def _aws_stacks(region, status=None, formatter=stack_triple):
+    "returns all stacks that haven't been deleted, optionally filtered by status"
+    results = find_stacks(region, status=status)
     if formatter:
         return lmap(formatter, results)
     return results
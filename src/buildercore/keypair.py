@@ -36,6 +36,7 @@ def delete_keypair_from_s3(stackname):
 
 def download_from_s3(stackname, die_if_exists=True):
     expected_path = stack_pem(stackname, die_if_exists=die_if_exists)
+    utils.mkdir_p(config.KEYPAIR_PATH)
     s3.download(s3_keypair_key(stackname), expected_path, overwrite=True)
     stack_pem(stackname, die_if_doesnt_exist=True)
     local('chmod 400 %s' % expected_path)
@@ -66,6 +67,7 @@ def create_keypair(stackname):
     expected_key = stack_pem(stackname, die_if_exists=True)
     ec2 = core.boto_conn(stackname, 'ec2')
     keypair = ec2.create_key_pair(KeyName=stackname, KeyType='ed25519')
+    utils.mkdir_p(config.KEYPAIR_PATH)
     with open(expected_key, 'w') as fh:
         fh.write(keypair.key_material)
     os.chmod(expected_key, 0o600)
@@ -86,6 +88,8 @@ def all_in_s3():
 
 def all_locally():
     "all keypairs on the filesystem"
+    if not os.path.isdir(config.KEYPAIR_PATH):
+        return []
     keys = os.listdir(config.KEYPAIR_PATH)
     key_paths = [join(config.KEYPAIR_PATH, fname) for fname in keys]
     return lfilter(os.path.isfile, key_paths)
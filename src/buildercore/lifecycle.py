@@ -4,8 +4,10 @@ The primary reason for doing this is to save on costs."""
 
 import logging
 import re
+import time
 
 import backoff
+import botocore
 
 from . import command, config, core, utils
 from .command import (
@@ -114,6 +116,73 @@ def _ensure_valid_ec2_states(states, valid_states):
         "The states of EC2 nodes are not supported, manual recovery is needed: %s" % states
     )
 
+#
+# batched polling
+# the states of many ec2 nodes across many stacks are fetched with a single request per interval.
+#
+
+# the maximum number of instance ids a single DescribeInstances request accepts.
+DESCRIBE_INSTANCES_BATCH_SIZE = 1000
+
+# polling slows down to at most this many seconds while no node changes state or requests are being throttled.
+MAX_POLLING_INTERVAL = 30 # seconds
+
+def _ec2_instance_states(region, instance_ids):
+    """returns a map of ec2 `instance-id` => state for the given `instance_ids`.
+    one DescribeInstances request is made per `DESCRIBE_INSTANCES_BATCH_SIZE` instance ids."""
+    conn = core.boto_client('ec2', region)
+    states = {}
+    for i in range(0, len(instance_ids), DESCRIBE_INSTANCES_BATCH_SIZE):
+        batch = instance_ids[i:i + DESCRIBE_INSTANCES_BATCH_SIZE]
+        for reservation in conn.describe_instances(InstanceIds=batch)['Reservations']:
+            for instance in reservation['Instances']:
+                states[instance['InstanceId']] = instance['State']['Name']
+    return states
+
+def wait_for_ec2_states(region, stack_instances, state, timeout=None):
+    """polls the ec2 nodes of many stacks in `region` until they are all in the given `state`.
+    `stack_instances` is a map of stackname => [instance-id, ...].
+    a single batched request is made per interval for the nodes still being waited on.
+    the interval doubles while no node changes state or requests are throttled and resets once progress is made.
+    raises an `EC2TimeoutError` if `timeout` (default `config.BUILDER_TIMEOUT`) seconds pass."""
+    timeout = config.BUILDER_TIMEOUT if timeout is None else timeout
+    pending = {stackname: set(instance_ids) for stackname, instance_ids in stack_instances.items() if instance_ids}
+    interval = config.AWS_POLLING_INTERVAL
+    elapsed = 0
+    while pending:
+        instance_ids = sorted(set().union(*pending.values()))
+        try:
+            states = _ec2_instance_states(region, instance_ids)
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] != 'RequestLimitExceeded':
+                raise
+            LOG.warning("throttled while polling the states of %s EC2 nodes", len(instance_ids))
+            states = {}
+
+        progress = False
+        for stackname, stack_instance_ids in list(pending.items()):
+            remaining = {instance_id for instance_id in stack_instance_ids if states.get(instance_id) != state}
+            progress = progress or remaining != stack_instance_ids
+            pending[stackname] = remaining
+            if not remaining:
+                LOG.info("all %s EC2 nodes are in state %r", stackname, state)
+                del pending[stackname]
+
+        if not pending:
+            break
+
+        if elapsed >= timeout:
+            msg = "Reached timeout %ds while waiting for EC2 nodes to be %r: %s" % (timeout, state, pending)
+            raise EC2TimeoutError(msg)
+
+        if progress:
+            interval = config.AWS_POLLING_INTERVAL
+        # "waiting 4s for 12 EC2 nodes in 5 stacks to be 'running'"
+        LOG.info("waiting %ss for %s EC2 nodes in %s stacks to be %r", interval, len(instance_ids), len(pending), state)
+        time.sleep(interval)
+        elapsed += interval
+        interval = min(interval * 2, MAX_POLLING_INTERVAL)
+
 def _daemons_ready():
     "Assumes it is connected to an ec2 host via threadbare"
     node_id = current_ec2_node_id()
@@ -193,6 +262,7 @@ def start(stackname):
     if ec2_to_be_started:
         LOG.info("EC2 nodes to be started: %s", ec2_to_be_started)
         _ec2_connection(stackname).instances.filter(InstanceIds=ec2_to_be_started).start()
+        core.invalidate_ec2_inventory(stackname)
 
     if rds_to_be_started:
         LOG.info("RDS nodes to be started: %s", rds_to_be_started)
@@ -212,8 +282,10 @@ def start(stackname):
         # start the instances again
         LOG.info("Boot failed (instance(s) not accessible through SSH). Attempting boot one more time: %s", ec2_to_be_checked)
         _ec2_connection(stackname).instances.filter(InstanceIds=ec2_to_be_checked).stop()
+        core.invalidate_ec2_inventory(stackname)
         _wait_ec2_all_in_state(stackname, 'stopped', ec2_to_be_checked)
         _ec2_connection(stackname).instances.filter(InstanceIds=ec2_to_be_checked).start()
+        core.invalidate_ec2_inventory(stackname)
         wait_for_ec2_steady_state(stackname, ec2_to_be_checked)
 
     if rds_to_be_started:
@@ -221,10 +293,48 @@ def start(stackname):
 
     update_dns(stackname)
 
+def start_many(stackname_list):
+    """starts the EC2 nodes of many stacks together, polling their states with a single batched request.
+    nodes that are stopping are waited on before starting.
+    stacks with nodes in a state that can't be started (like 'shutting-down') are skipped.
+    returns once all nodes are running, use `start` on each stack to finish starting it (RDS, SSH, DNS)
+    and to report the stacks that were skipped."""
+    by_region = {}
+    for stackname in stackname_list:
+        by_region.setdefault(core.find_region(stackname), []).append(stackname)
+
+    for region, region_stackname_list in by_region.items():
+        # fetch the states of all stacks in the region at once.
+        core.ec2_inventory(region, refresh=True)
+        ec2_states = {}
+        for stackname in region_stackname_list:
+            states = _ec2_nodes_states(stackname)
+            if set(states.values()).issubset({'stopped', 'pending', 'running', 'stopping'}):
+                ec2_states[stackname] = states
+            else:
+                LOG.warning("not starting %s, the states of its EC2 nodes are not supported: %s", stackname, states)
+
+        stopping = {stackname: _select_nodes_with_state('stopping', states) for stackname, states in ec2_states.items()}
+        wait_for_ec2_states(region, stopping, 'stopped')
+
+        to_be_started = {stackname: _select_nodes_with_state('stopped', states) + stopping[stackname] for stackname, states in ec2_states.items()}
+        to_be_checked = {stackname: to_be_started[stackname] + _select_nodes_with_state('pending', states) for stackname, states in ec2_states.items()}
+
+        instance_ids = sorted(instance_id for instance_ids in to_be_started.values() for instance_id in instance_ids)
+        if instance_ids:
+            LOG.info("EC2 nodes to be started: %s", instance_ids)
+            conn = core.boto_client('ec2', region)
+            for i in range(0, len(instance_ids), DESCRIBE_INSTANCES_BATCH_SIZE):
+                conn.start_instances(InstanceIds=instance_ids[i:i + DESCRIBE_INSTANCES_BATCH_SIZE])
+            core.invalidate_ec2_inventory()
+
+        wait_for_ec2_states(region, to_be_checked, 'running')
+
 def _stop(stackname, ec2_to_be_stopped, rds_to_be_stopped):
     LOG.info("Selected for stopping: EC2 %s, RDS %s", ec2_to_be_stopped, rds_to_be_stopped)
     if ec2_to_be_stopped:
         _ec2_connection(stackname).instances.filter(InstanceIds=ec2_to_be_stopped).stop()
+        core.invalidate_ec2_inventory(stackname)
     if rds_to_be_stopped:
         [_rds_connection(stackname).stop_db_instance(DBInstanceIdentifier=n) for n in rds_to_be_stopped]
 
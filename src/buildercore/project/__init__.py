@@ -1,5 +1,4 @@
 # from . import core # DONT import core. this project module should be relatively independent
-import copy
 import logging
 import os
 from functools import reduce
@@ -17,13 +16,12 @@ LOG = logging.getLogger(__name__)
 #
 
 def set_project_alt(pdata, env, altkey):
-    "non-destructive update of given project data with the specified alternative configuration."
+    """non-destructive update of given project data with the specified alternative configuration.
+    returns a new frozen version of `pdata` that shares all unmodified values with `pdata`."""
     assert env in ['vagrant', 'aws', 'gcp'], "'env' must be either 'vagrant' or 'aws'"
     env_key = env + '-alt'
     assert altkey in pdata[env_key], "project has no alternative config %r. Available: %s" % (altkey, list(pdata[env_key].keys()))
-    pdata_copy = copy.deepcopy(pdata) # don't modify the data given to us
-    pdata_copy[env] = pdata[env_key][altkey]
-    return pdata_copy
+    return utils.freeze(pdata).assoc(env, pdata[env_key][altkey])
 
 def _parse_path(project_path):
     """converts the given `project_path` into zero or many paths.
@@ -62,6 +60,22 @@ def _project_map(project_locations_list=None):
     # ['/path/to/projects.yaml', ...]
     path_list = parse_path_list(path_list)
 
+    if not config.PROJECT_CACHE:
+        return _parse_project_map(path_list)
+
+    # parsing the project files is slow, expanding a project is done lazily on access.
+    # the parsed result is cached on disk until the contents of any project file changes.
+    key = files.cache_key(path_list)
+    data = files.read_cache(key)
+    if data is None:
+        data = _parse_project_map(path_list)
+        files.write_cache(key, data)
+    return data
+
+def _parse_project_map(path_list):
+    """parses each project file in `path_list`,
+    returning a single lazily expanded map of all projects and their data."""
+
     # a list of parsed project data
     # [{'/path/to/projects.yaml': {'project1': {...}, 'project2': {...}, ...}, {'/path/to/another-projects.yaml': {...}}, ...]
     data = [files.projects_from_file(path) for path in path_list]
@@ -78,25 +92,25 @@ def _project_map(project_locations_list=None):
     # {'project1': {...}, 'project2': {...}, ...}
     # note: if you have two projects with the same name in different files, one will replace the other.
     # precedence depends on order of paths in given `project_locations_list`, earlier paths are overridden by later.
-    return reduce(utils.merge, data)
+    return reduce(files.ProjectMap.merge, data)
 
 def project_map(project_locations_list=None):
     """returns a single map of all projects and their data.
-    the returned value is a deepcopy of the cached `_project_map` data.
+    the returned value is a read-only `files.ProjectMap` that expands a project on first access.
 
     `cfngen.build_context` is one of probably many functions modifying the project data,
     unintentionally modifying it for all subsequent accesses including during tests.
 
-    this approach should be safer and avoid the speed problems with parsing the project
-    files again at the cost of a deepcopy."""
-    return utils.deepcopy(_project_map(project_locations_list))
+    accessing a project returns the cached project data frozen (see `utils.freeze`), shared by
+    all callers and never copied. use `utils.thaw` to get a modifiable copy."""
+    return _project_map(project_locations_list)
 
 def project_list():
     "returns a single list of project names."
     return list(project_map().keys())
 
 def project_data(pname):
-    "returns the data for a single project."
+    "returns the frozen data for a single project."
     data = project_map()
     try:
         return data[pname]
@@ -1,14 +1,34 @@
 import copy
+import hashlib
 import logging
+import os
+import pickle
+import tempfile
+from collections.abc import Mapping
+from os.path import join
 
 from kids.cache import cache as cached
 
-from buildercore import utils
+from buildercore import config, utils
 from buildercore.config import CLOUD_EXCLUDING_DEFAULTS_IF_NOT_PRESENT
 from buildercore.utils import ensure
 
 LOG = logging.getLogger(__name__)
 
+# bump to invalidate all cached project maps.
+CACHE_VERSION = 1
+
+# number of cached project maps to keep around.
+CACHE_SIZE = 10
+
+# the code that parses project files into the cached project map.
+# a change to any of these invalidates the cache, see `cache_key`.
+CACHE_SOURCE_LIST = [
+    __file__,
+    join(os.path.dirname(__file__), '__init__.py'), # `project._parse_project_map`
+    utils.__file__,
+]
+
 def read_project_file(project_file_path):
     """reads the contents of the YAML file at `project_file_path`.
     for example, `/path/to/builder/projects/elife.yaml`."""
@@ -47,12 +67,10 @@ def project_cloud_alt(project_alt_contents, project_base_cloud, global_cloud):
 
     return cloud_alt
 
-# TODO: have this accept a map of defaults and a list of project data maps,
-# rather than read from `all_projects`.
-def project_data(pname, project_file):
-    "does a deep merge of defaults+project data and any alt-configs."
-
-    global_defaults, project_list = all_projects(project_file)
+def expand_project(global_defaults, raw_project_data):
+    """does a deep merge of defaults+project data and any alt-configs.
+    `global_defaults` is the `defaults` section of a project file,
+    `raw_project_data` is a single project's section of the same project file."""
 
     # this first pass is doing two things:
     # 1. deep-merging the 'regular' data and ignoring the 'alternate' data.
@@ -69,7 +87,7 @@ def project_data(pname, project_file):
         {'aws': CLOUD_EXCLUDING_DEFAULTS_IF_NOT_PRESENT},
     ]
     pdata = copy.deepcopy(global_defaults)
-    utils.deepmerge(pdata, project_list[pname], excluding)
+    utils.deepmerge(pdata, raw_project_data, excluding)
 
     # second pass, expand the 'aws' and 'gcp' alternate configurations.
     pdata['aws-alt'] = project_cloud_alt(
@@ -84,10 +102,116 @@ def project_data(pname, project_file):
     )
     return pdata
 
+def project_data(pname, project_file):
+    "does a deep merge of defaults+project data and any alt-configs for project `pname` in `project_file`."
+    global_defaults, project_list = all_projects(project_file)
+    return expand_project(global_defaults, project_list[pname])
+
+class ProjectMap(Mapping):
+    """a read-only map of project names to project data.
+
+    expanding project data (merging defaults, expanding alt-configs) is slow and most
+    tasks only need a single project, so each project is expanded on first access and
+    then memoised. the memoised data is frozen (see `utils.freeze`) and shared between
+    callers, it can't be modified in-place."""
+
+    def __init__(self, sources=None):
+        # {pname: (global_defaults, raw_project_data), ...}
+        self._sources = sources or {}
+        # {pname: expanded_project_data, ...}
+        self._expanded = {}
+
+    def __getitem__(self, pname):
+        if pname not in self._expanded:
+            global_defaults, raw_project_data = self._sources[pname]
+            self._expanded[pname] = utils.freeze(expand_project(global_defaults, raw_project_data))
+        return self._expanded[pname]
+
+    def __contains__(self, pname):
+        # `Mapping.__contains__` would expand the project.
+        return pname in self._sources
+
+    def __iter__(self):
+        return iter(self._sources)
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __repr__(self):
+        return "<ProjectMap %s>" % list(self._sources.keys())
+
+    def __getstate__(self):
+        # expanded data is not serialised, only what is needed to expand it again.
+        return {'_sources': self._sources, '_expanded': {}}
+
+    def merge(self, other):
+        """returns a new `ProjectMap` with the projects in `other` merged over the projects in this map.
+        projects with the same name in both maps are replaced."""
+        sources = utils.merge(self._sources, other._sources)
+        return ProjectMap(sources)
+
 def projects_from_file(path_to_file, *args, **kwargs):
     "returns a map of {path_to_file: project data} for given `path_to_file`."
-    _, project_list = all_projects(path_to_file)
+    global_defaults, project_list = all_projects(path_to_file)
 
     # lsh@2022-09-05: removed OrderedDicts as we're now using python3.8 exclusively.
-    pdata = {pname: project_data(pname, path_to_file) for pname in project_list}
-    return {path_to_file: pdata}
+    sources = {pname: (global_defaults, raw_project_data) for pname, raw_project_data in project_list.items()}
+    return {path_to_file: ProjectMap(sources)}
+
+#
+# on-disk cache of the parsed project map
+#
+
+def cache_key(path_list):
+    """returns a digest of the given `path_list`, the contents of each path and the code used to expand them.
+    any change to a project file will result in a new key."""
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for source_path in CACHE_SOURCE_LIST:
+        with open(source_path, 'rb') as fh:
+            digest.update(fh.read())
+    for path in path_list:
+        digest.update(path.encode())
+        with open(path, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+def _cache_path(key):
+    return join(config.PROJECT_CACHE_PATH, key + ".pickle")
+
+def read_cache(key):
+    "returns the `ProjectMap` cached under `key` or `None` if it doesn't exist or can't be read."
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as fh:
+            return pickle.load(fh)
+    except Exception:
+        LOG.warning("failed to read project cache, ignoring: %s", path, exc_info=True)
+        return None
+
+def _prune_cache():
+    "removes all but the most recent `CACHE_SIZE` cached project maps."
+    path_list = utils.listfiles(config.PROJECT_CACHE_PATH, ['.pickle'])
+    path_list = sorted(path_list, key=os.path.getmtime, reverse=True)
+    for path in path_list[CACHE_SIZE:]:
+        os.unlink(path)
+
+def write_cache(key, data):
+    """writes the `ProjectMap` in `data` to disk under `key`.
+    the file is written to a temporary path first and then moved into place
+    so concurrent builder processes never see a partially written file."""
+    utils.mkdir_p(config.PROJECT_CACHE_PATH)
+    fd, temp_path = tempfile.mkstemp(dir=config.PROJECT_CACHE_PATH, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, _cache_path(key))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    try:
+        _prune_cache()
+    except OSError:
+        LOG.warning("failed to prune project cache", exc_info=True)
@@ -1,15 +1,26 @@
 import logging
 import os
+import tempfile
 from io import IOBase
 
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from kids.cache import cache as cached
 
-from . import config, core
+from . import config, core, utils
 from .utils import ensure, isstr
 
 LOG = logging.getLogger(__name__)
 
+# the maximum number of keys S3 will delete in a single request.
+DELETE_BATCH_SIZE = 1000
+
+# objects larger than the threshold are downloaded in parts, several parts at once.
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * 1024 * 1024, max_concurrency=config.AWS_MAX_CONCURRENT_REQUESTS)
+
+# legacy prefixes
+PROTECTED_PREFIXES = ['boxes/', 'cfn/', 'private/']
+
 @cached
 def builder_bucket():
     "returns connection to the bucket where builder stores templates and credentials."
@@ -17,13 +28,23 @@ def builder_bucket():
         nom, region = config.BUILDER_BUCKET, config.BUILDER_REGION
         resource = core.boto_resource('s3', region)
         bucket = resource.Bucket(nom)
-        ensure(bucket in resource.buckets.all(), "bucket %r in region %r does not exist" % (nom, region))
+        ensure(bucket_exists(resource.meta.client, nom), "bucket %r in region %r does not exist" % (nom, region))
         return bucket
     except ClientError:
         LOG.error("unhandled error attempting to find S3 bucket %r in region %r", nom, region,
                   extra={'bucket': nom, 'region': region})
         raise
 
+def bucket_exists(client, bucket_name):
+    "predicate, returns True if the given bucket exists. a single HEAD request rather than listing all buckets."
+    try:
+        client.head_bucket(Bucket=bucket_name)
+        return True
+    except ClientError as err:
+        if err.response['Error']['Code'] in ['404', 'NoSuchBucket']:
+            return False
+        raise
+
 def exists(key):
     "predicate, returns True if given key in configured bucket+region exists"
     try:
@@ -35,38 +56,66 @@ def exists(key):
         raise
 
 def write(key, something, overwrite=False):
-    "stream is a file-like object"
-    if exists(key) and not overwrite:
-        raise KeyError("key %r exists and overwrite==False. refusing to overwrite." % key)
+    """stream is a file-like object.
+    when `overwrite` is `False` the write is conditional on the key not existing (`If-None-Match`),
+    so no separate request is made to check if it exists.
+    returns the response from S3, including the `ETag` of the new object."""
     k = builder_bucket().Object(key)
     LOG.info("writing key %r", key, extra={'key': key})
+    params = {} if overwrite else {'IfNoneMatch': '*'}
 
     # http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Object.put
     if isstr(something):
-        k.put(Body=something.encode()) # bytes
+        body = something.encode() # bytes
     elif isinstance(something, IOBase):
         # this seek() here is interesting
         # the check in isstr above is actually moving it's pointer
         something.seek(0)
-        k.put(Body=something) # py3 file
+        body = something # py3 file
     else:
         raise ValueError("boto can't handle value of type %r, just strings and files" % type(something))
+    try:
+        return k.put(Body=body, **params)
+    except ClientError as err:
+        if err.response['Error']['Code'] in ['412', 'PreconditionFailed']:
+            raise KeyError("key %r exists and overwrite==False. refusing to overwrite." % key) from err
+        raise
 
-def delete(key):
-    "deletes a single key from the builder bucket"
-    # legacy prefixes
-    protected = ['boxes/', 'cfn/', 'private/']
-    if not all(not key.startswith(prefix) for prefix in protected):
+def ensure_unprotected(key):
+    "raises a `ValueError` if `key` starts with a protected prefix."
+    if any(key.startswith(prefix) for prefix in PROTECTED_PREFIXES):
         msg = "you tried to delete a key with a protected prefix"
-        LOG.warning(msg, extra={'key': key, 'protected': protected})
+        LOG.warning(msg, extra={'key': key, 'protected': PROTECTED_PREFIXES})
         raise ValueError(msg)
-    if not exists(key):
-        return True
+
+def delete(key):
+    """deletes a single key from the builder bucket.
+    deleting a key that doesn't exist is not an error and S3 is strongly consistent,
+    so there is no need to check for the key before or after."""
+    ensure_unprotected(key)
     LOG.info("deleting key %s", key, extra={'key': key})
-    k = builder_bucket().Object(key)
-    k.delete()
-    # http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Object.wait_until_not_exists
-    k.wait_until_not_exists()
+    builder_bucket().Object(key).delete()
+    return True
+
+def delete_objects(key_list):
+    """deletes many keys from the builder bucket, up to `DELETE_BATCH_SIZE` keys per request.
+    requests are made concurrently. raises a `RuntimeError` if any key could not be deleted."""
+    key_list = list(key_list)
+    for key in key_list:
+        ensure_unprotected(key)
+    bucket = builder_bucket()
+    client = bucket.meta.client
+
+    def delete_batch(batch):
+        LOG.info("deleting %s keys", len(batch), extra={'key_list': batch})
+        resp = client.delete_objects(Bucket=bucket.name, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+        return resp.get('Errors', [])
+
+    batch_list = [key_list[i:i + DELETE_BATCH_SIZE] for i in range(0, len(key_list), DELETE_BATCH_SIZE)]
+    error_list = utils.shallow_flatten(utils.concurrently(delete_batch, batch_list, max_workers=config.AWS_MAX_CONCURRENT_REQUESTS))
+    if error_list:
+        LOG.error("failed to delete %s keys", len(error_list), extra={'errors': error_list})
+        raise RuntimeError("failed to delete keys: %s" % ", ".join("%s (%s)" % (err['Key'], err['Code']) for err in error_list))
     return True
 
 def validate_prefix(prefix):
@@ -79,11 +128,9 @@ def validate_prefix(prefix):
         raise ValueError("only prefixes starting with /test/ allowed: %r" % prefix)
 
 def delete_contents(prefix):
+    "deletes all keys starting with the given `prefix`, see `delete_objects`."
     validate_prefix(prefix)
-    # TODO: optimisation here: http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Bucket.delete_objects
-    for key in builder_bucket().objects.filter(Prefix=prefix):
-        LOG.info("deleting key %s", key, extra={'key': key})
-        key.delete() # not delete(key) ?
+    return delete_objects(simple_listing(prefix))
 
 def listing(prefix):
     "returns a list of Key objects starting with given prefix rooted in the builder bucket"
@@ -98,5 +145,32 @@ def download(key, output_path, overwrite=False):
         ensure(not os.path.exists(output_path), "given output path exists, will not overwrite: %r" % output_path)
     ensure(exists(key), "key %r not found in bucket %r" % (key, config.BUILDER_BUCKET))
     LOG.info("downloading key %s", key, extra={'key': key})
-    builder_bucket().Object(key).download_file(output_path)
+    builder_bucket().Object(key).download_file(output_path, Config=TRANSFER_CONFIG)
     return output_path
+
+def download_if_changed(key, output_path, etag=None):
+    """downloads `key` to `output_path` unless it's ETag matches the given `etag`, a conditional GET.
+    returns a pair of `(etag, downloaded?)` or `(None, False)` if `key` doesn't exist.
+    the file is written to a temporary path first and then moved into place."""
+    params = {'IfNoneMatch': etag} if etag else {}
+    try:
+        resp = builder_bucket().Object(key).get(**params)
+    except ClientError as err:
+        code = err.response['Error']['Code']
+        if code in ['304', 'NotModified']:
+            return etag, False
+        if code in ['404', 'NoSuchKey']:
+            return None, False
+        raise
+    LOG.info("downloading key %s", key, extra={'key': key})
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in resp['Body'].iter_chunks():
+                fh.write(chunk)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return resp['ETag'], True
@@ -1,13 +1,18 @@
 import contextlib
+import fcntl
+import hashlib
 import json
 import logging
 import os
 import re
 import shutil
+import threading
+import time
 from collections import OrderedDict, namedtuple
 from os.path import join
 
-from python_terraform import IsFlagged, IsNotFlagged, Terraform
+import python_terraform
+from python_terraform import IsFlagged, IsNotFlagged
 
 from . import aws, config, fastly
 from .context_handler import load_context, only_if
@@ -1446,7 +1451,114 @@ def _clean_stdout(stdout):
     stdout = re.sub(re.compile(r"\n+", re.MULTILINE), "\n", stdout)
     return stdout
 
+class Terraform(python_terraform.Terraform):
+    """a `python_terraform.Terraform` whose commands are run with the variables in `environ` added to the environment.
+    python-terraform only passes on the environment of the process."""
+    def __init__(self, environ=None, **kwargs):
+        self.environ = environ or {}
+        super().__init__(**kwargs)
+
+    def generate_cmd_string(self, cmd, *args, **kwargs):
+        cmd_list = super().generate_cmd_string(cmd, *args, **kwargs)
+        if not self.environ:
+            return cmd_list
+        return ['env'] + ['%s=%s' % (key, val) for key, val in sorted(self.environ.items())] + cmd_list
+
+# the lock file in the plugin cache held while `terraform init` installs providers, see `_plugin_cache_lock`.
+PLUGIN_CACHE_LOCK_FILE = '.builder-lock'
+
+# seconds to wait between attempts to lock the plugin cache.
+PLUGIN_CACHE_LOCK_INTERVAL = 0.5
+
+# serialises `terraform init` within this process, see `_plugin_cache_lock`.
+_PLUGIN_CACHE_LOCK = threading.Lock()
+
+@contextlib.contextmanager
+def _plugin_cache_lock(plugin_cache_dir):
+    """holds an exclusive lock on the plugin cache `plugin_cache_dir`.
+    Terraform's plugin cache isn't safe for concurrent use by `terraform init`:
+    - https://developer.hashicorp.com/terraform/cli/config/config-file#provider-plugin-cache
+    threads in this process take `_PLUGIN_CACHE_LOCK` first and then a lock file shared with other processes.
+    the lock file is polled rather than waited on as a blocking `flock` would also block any
+    greenlets in this thread when gevent is in use, including the one holding the lock."""
+    with _PLUGIN_CACHE_LOCK, open(join(mkdir_p(plugin_cache_dir), PLUGIN_CACHE_LOCK_FILE), 'w') as fp:
+        while True:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                LOG.info("waiting for another process to finish with the plugin cache: %s", plugin_cache_dir)
+                time.sleep(PLUGIN_CACHE_LOCK_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+# the fingerprint of the files `terraform init` was last successfully run with, see `init`.
+INIT_FINGERPRINT_FILE = '.builder-init'
+
+# versions of Terraform already queried by this process.
+_TERRAFORM_VERSIONS = set()
+
+def _write_if_changed(stackname, name, contents, extension='tf.json'):
+    """writes `contents` to the file `name` belonging to given `stackname` unless the file already has those contents.
+    returns `True` if the file was written."""
+    path = join(config.TERRAFORM_DIR, stackname, name + ('.' + extension if extension else ''))
+    if os.path.exists(path):
+        with open(path) as fp:
+            if fp.read() == contents:
+                return False
+    with _open(stackname, name, extension=extension, mode='w') as fp:
+        fp.write(contents)
+    return True
+
+def _template_providers(stackname):
+    "returns a sorted list of the names of the providers of the resources and data in the stack's generated template."
+    path = join(config.TERRAFORM_DIR, stackname, 'generated.tf.json')
+    if not os.path.exists(path):
+        return []
+    with open(path) as fp:
+        template = json.load(fp)
+    type_list = list(template.get('resource', {})) + list(template.get('data', {}))
+    return sorted({type_name.split('_', 1)[0] for type_name in type_list})
+
+def _init_fingerprint(stackname):
+    """returns a fingerprint of everything `terraform init` depends on: the version of Terraform,
+    the backend and the providers, including any only used by the generated template."""
+    digest = hashlib.sha256()
+    for name in ['.terraform-version', 'backend.tf.json', 'providers.tf.json']:
+        with open(join(config.TERRAFORM_DIR, stackname, name), 'rb') as fp:
+            digest.update(fp.read())
+    digest.update(json.dumps(_template_providers(stackname)).encode())
+    return digest.hexdigest()
+
+def _is_initialised(stackname, fingerprint):
+    "returns `True` if `terraform init` was successfully run in the stack's working directory with the same files."
+    stack_dir = join(config.TERRAFORM_DIR, stackname)
+    path = join(stack_dir, INIT_FINGERPRINT_FILE)
+    if not os.path.exists(path) or not os.path.isdir(join(stack_dir, '.terraform')):
+        return False
+    with open(path) as fp:
+        return fp.read() == fingerprint
+
+def _log_terraform_version(terraform, version):
+    "queries Terraform for it's version once per `version` per process, ensuring it can be run."
+    if version in _TERRAFORM_VERSIONS:
+        return
+    try:
+        rc, stdout, _ = terraform.cmd("version")
+        ensure(rc == 0, "failed to query Terraform for it's version.")
+        msg = "\n-----------\n" + stdout + "-----------"
+        LOG.info(msg)
+        _TERRAFORM_VERSIONS.add(version)
+    except ValueError:
+        # "ValueError: not enough values to unpack (expected 3, got 0)"
+        # we're probably testing and the Terraform object has been mocked.
+        pass
+
 def init(stackname, context):
+    """writes the files Terraform needs to manage the resources of `stackname` and runs `terraform init`.
+    `terraform init` is skipped if it has already been run with the same files, see `_init_fingerprint`."""
 
     # Terraform prunes unused providers when running but conditionally adding them
     # here simplifies the `.cfn/terraform/$stackname/` files and any Terraform upgrades.
@@ -1541,33 +1653,36 @@ def init(stackname, context):
 
     # ensure tfenv knows which version of Terraform to use:
     # - https://github.com/tfutils/tfenv#terraform-version-file
-    with _open(stackname, '.terraform-version', extension=None, mode='w') as fp:
-        fp.write(context['terraform']['version'])
+    _write_if_changed(stackname, '.terraform-version', context['terraform']['version'], extension=None)
+    _write_if_changed(stackname, 'backend', json.dumps(backend, indent=4))
+    _write_if_changed(stackname, 'providers', json.dumps(providers, indent=4))
+
+    # providers are shared between stacks in a plugin cache.
+    # a value set in the environment takes precedence.
+    environ = {}
+    plugin_cache_dir = os.environ.get('TF_PLUGIN_CACHE_DIR')
+    if not plugin_cache_dir:
+        plugin_cache_dir = config.TERRAFORM_PLUGIN_CACHE_PATH
+        environ['TF_PLUGIN_CACHE_DIR'] = plugin_cache_dir
 
     terraform = Terraform(**{
         # "/path/to/builder/.cfn/terraform/project--env/"
         'working_dir': join(config.PROJECT_PATH, config.TERRAFORM_DIR, stackname),
         # "/path/to/builder/.tfenv/bin/terraform"
         'terraform_bin_path': config.TERRAFORM_BIN_PATH,
+        'environ': environ,
     })
 
-    try:
-        rc, stdout, _ = terraform.cmd("version")
-        ensure(rc == 0, "failed to query Terraform for it's version.")
-        msg = "\n-----------\n" + stdout + "-----------"
-        LOG.info(msg)
-    except ValueError:
-        # "ValueError: not enough values to unpack (expected 3, got 0)"
-        # we're probably testing and the Terraform object has been mocked.
-        pass
-
-    with _open(stackname, 'backend', mode='w') as fp:
-        fp.write(json.dumps(backend, indent=4))
-
-    with _open(stackname, 'providers', mode='w') as fp:
-        fp.write(json.dumps(providers, indent=4))
+    fingerprint = _init_fingerprint(stackname)
+    if _is_initialised(stackname, fingerprint):
+        LOG.info("Terraform working directory for %s already initialised, skipping `terraform init`", stackname)
+        return terraform
 
-    terraform.init(input=False, capture_output=False, raise_on_error=True)
+    _log_terraform_version(terraform, context['terraform']['version'])
+    with _plugin_cache_lock(plugin_cache_dir):
+        terraform.init(input=False, capture_output=False, raise_on_error=True)
+    with _open(stackname, INIT_FINGERPRINT_FILE, extension=None, mode='w') as fp:
+        fp.write(fingerprint)
     return terraform
 
 @only_if_managed_services_are_present
@@ -14,7 +14,7 @@ see also `terraform.py`."""
 import json
 import logging
 import os
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from functools import partial
 from os.path import join
 
@@ -40,7 +40,7 @@ from troposphere import (
 from troposphere import elasticloadbalancing as elb
 from troposphere import elasticloadbalancingv2 as alb
 
-from . import aws, bvars, config, utils
+from . import aws, bvars, config, context_handler, utils
 from .utils import deepcopy, ensure, isstr, lmap, lookup, subdict
 
 # todo: remove on upgrade to python 3
@@ -183,17 +183,17 @@ def overridden_component(context, component, index, allowed, interesting=None):
     overrides = context[component].get('overrides', {}).get(index, {})
     for element in overrides:
         ensure(element in allowed, "`%s` override is not allowed for `%s` clusters" % (element, component))
-    overridden_context = deepcopy(context)
-    overridden_context[component].pop('overrides', None)
+    overridden = deepcopy(context[component])
+    overridden.pop('overrides', None)
     for key, value in overrides.items():
         if key not in interesting:
             continue
-        assert key in overridden_context[component], "Can't override `%s` as it's not already a key in `%s`" % (key, overridden_context[component].keys())
-        if isinstance(overridden_context[component][key], dict):
-            overridden_context[component][key].update(value)
+        assert key in overridden, "Can't override `%s` as it's not already a key in `%s`" % (key, overridden.keys())
+        if isinstance(overridden[key], dict):
+            overridden[key].update(value)
         else:
-            overridden_context[component][key] = value
-    return overridden_context[component]
+            overridden[key] = value
+    return overridden
 
 def _is_domain_2nd_level(hostname):
     """returns True if hostname is a 2nd level TLD.
@@ -252,8 +252,12 @@ def cnames(context):
 
 def build_vars(context, node):
     """returns a subset of given context data with some extra node information
-    that will be encoded and stored on the ec2 instance at /etc/build-vars.json.b64"""
-    buildvars = deepcopy(context)
+    that will be encoded and stored on the ec2 instance at /etc/build-vars.json.b64
+    the result shares nested data with `context`, only it's top-level keys should be modified."""
+    buildvars = dict(context)
+
+    # the fingerprint describes the context, not the node.
+    buildvars.pop(context_handler.FINGERPRINT_KEY, None)
 
     # preseve some of the project data. all of it is too much.
     keepers = [
@@ -362,12 +366,16 @@ def render_ext_volume(context, context_ext, template, actual_ec2_instances, node
         }
         template.add_resource(ec2.VolumeAttachment(EXT_MP_TITLE % node, **args))
 
-def render_ext(context, template, cluster_size, actual_ec2_instances):
+def render_ext(context, template, ec2_instances):
+    cluster_size = context['ec2']['cluster-size'] if context['ec2'] else 0
+    actual_ec2_instances = ec2_instances.keys()
     # backward compatibility: ext is still specified outside of ec2 rather than as a sub-key
     context['ec2']['ext'] = context['ext']
     for node in range(1, cluster_size + 1):
         overrides = context['ec2'].get('overrides', {}).get(node, {})
-        overridden_context = deepcopy(context)
+        # only 'ext' is overridden, a shallow copy of the rest of the context is enough.
+        overridden_context = dict(context)
+        overridden_context['ext'] = deepcopy(context['ext'])
         overridden_context['ext'].update(overrides.get('ext', {}))
         # TODO: extract `allowed` variable
         node_context = overridden_component(context, 'ec2', index=node, allowed=['type', 'ext', 'ami'])
@@ -425,7 +433,8 @@ def render_ec2(context, template):
         if node in suppressed:
             continue
 
-        overridden_context = deepcopy(context)
+        # only 'ec2' is overridden and `ec2instance` doesn't modify the context, a shallow copy is enough.
+        overridden_context = dict(context)
         overridden_ec2 = overridden_component(context, 'ec2', index=node, allowed=['type', 'ext', 'ami'], interesting=['type', 'ami'])
         overridden_context['ec2'] = overridden_ec2
 
@@ -1194,7 +1203,8 @@ def external_dns_cloudfront(context):
 
     return dns_records
 
-def render_cloudfront(context, template, origin_hostname):
+def render_cloudfront(context, template):
+    origin_hostname = context['full_hostname']
     if not context['cloudfront']['origins']:
         ensure(context['full_hostname'], "A public hostname is required to be pointed at by the Cloudfront CDN")
 
@@ -1637,42 +1647,61 @@ def add_outputs(context, template):
         template.add_output(mkoutput("IntDomainName", "Domain name of the newly created stack instance", Ref(R53_INT_TITLE)))
 
 
+# a renderer is called when it's `context_key` is present in the context.
+# renderers that use the results of other renderers declare them in `depends_on` as a map of
+# `{keyword argument: renderer name}` and are always called after them, otherwise they are called in order.
+# the result of a renderer that isn't called is an empty dict.
+Renderer = namedtuple('Renderer', ['name', 'context_key', 'fn', 'depends_on'])
+
+RENDERER_LIST = [
+    Renderer('ec2', 'ec2', render_ec2, {}),
+    Renderer('rds', 'rds', render_rds, {}),
+    Renderer('ext', 'ext', render_ext, {'ec2_instances': 'ec2'}),
+    Renderer('sns', 'sns', render_sns, {}),
+    Renderer('sqs', 'sqs', render_sqs, {}),
+    Renderer('s3', 's3', render_s3, {}),
+
+    # hostname is assigned to an ELB, which has priority over
+    # N>=1 EC2 instances
+    Renderer('elb', 'elb', render_elb, {'ec2_instances': 'ec2'}),
+    Renderer('alb', 'alb', render_alb, {'ec2_instances': 'ec2'}),
+    Renderer('ec2-dns', 'ec2', render_ec2_dns, {}),
+    Renderer('cloudfront', 'cloudfront', render_cloudfront, {}),
+    Renderer('fastly', 'fastly', render_fastly, {}),
+    Renderer('elasticache', 'elasticache', render_elasticache, {}),
+    Renderer('docdb', 'docdb', render_docdb, {}),
+    Renderer('waf', 'waf', render_waf, {}),
+]
+
+def renderer_order(renderer_list):
+    """returns the given `renderer_list` ordered so that every renderer comes after the renderers it depends on.
+    otherwise the original order is preserved."""
+    known = {renderer.name for renderer in renderer_list}
+    for renderer in renderer_list:
+        unknown = set(renderer.depends_on.values()) - known
+        ensure(not unknown, "renderer %r depends on unknown renderers: %s" % (renderer.name, unknown))
+
+    ordered, done, pending = [], set(), list(renderer_list)
+    while pending:
+        ready = [renderer for renderer in pending if set(renderer.depends_on.values()) <= done]
+        ensure(ready, "renderers have circular dependencies: %s" % [renderer.name for renderer in pending])
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+        pending.remove(ready[0])
+    return ordered
+
 def render(context):
     """given a dictionary `context`, generates a CloudFormation instance.
     returns the instance as JSON."""
 
     template = Template()
 
-    ec2_instances = render_ec2(context, template) if context['ec2'] else {}
-    cluster_size = context['ec2']['cluster-size'] if context['ec2'] else 0
-
-    # order is possibly important as each render function is modifying
-    # the state of a single `Template` object.
-    renderer_list = [
-        # ('ec2', render_ec2), # called above. other renderers depend on it's result
-        ('rds', render_rds),
-        ('ext', render_ext, {'cluster_size': cluster_size, 'actual_ec2_instances': ec2_instances.keys()}),
-        ('sns', render_sns),
-        ('sqs', render_sqs),
-        ('s3', render_s3),
-
-        # hostname is assigned to an ELB, which has priority over
-        # N>=1 EC2 instances
-        ('elb', render_elb, {'ec2_instances': ec2_instances}),
-        ('alb', render_alb, {'ec2_instances': ec2_instances}),
-        ('ec2', render_ec2_dns),
-        ('cloudfront', render_cloudfront, {'origin_hostname': context['full_hostname']}),
-        ('fastly', render_fastly),
-        ('elasticache', render_elasticache),
-        ('docdb', render_docdb),
-        ('waf', render_waf),
-    ]
-
-    for value in renderer_list:
-        context_key, render_fn = value[0], value[1]
-        kwargs = value[2] if len(value) == 3 else {} # noqa: PLR2004
-        if context[context_key]: # "if 's3' in context, then render_s3(...)"
-            render_fn(context, template, **kwargs)
+    results = {}
+    for renderer in renderer_order(RENDERER_LIST):
+        if context[renderer.context_key]: # "if 's3' in context, then render_s3(...)"
+            kwargs = {kwarg: results[name] for kwarg, name in renderer.depends_on.items()}
+            results[renderer.name] = renderer.fn(context, template, **kwargs)
+        results[renderer.name] = results.get(renderer.name) or {}
 
     # todo: needs some attention.
     add_outputs(context, template)
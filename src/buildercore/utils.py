@@ -9,6 +9,7 @@ import sys
 import tempfile
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
 from io import StringIO
@@ -46,6 +47,103 @@ def deepcopy(x):
     # return pickle.loads(pickle.dumps(x, -1))
     return copy.deepcopy(x) # very very slow
 
+#
+# immutable data
+# frozen data can be shared between readers without copying.
+# `freeze` and `thaw` convert between frozen and regular (mutable) data,
+# `assoc` and `dissoc` return new versions of frozen dicts that share unmodified values.
+#
+
+class FrozenError(TypeError):
+    pass
+
+class _Frozen:
+    "mixin that disables the mutating methods of dicts and lists once the instance has been constructed."
+
+    _frozen = False
+
+    def _refuse(self):
+        if self._frozen:
+            raise FrozenError("%s is immutable, see `utils.thaw`." % type(self).__name__)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (self._items(),))
+
+def _refusing(method_name):
+    "returns a replacement for the mutating method `method_name` that refuses to work once frozen."
+    def method(self, *args, **kwargs):
+        self._refuse()
+        return getattr(super(_Frozen, self), method_name)(*args, **kwargs)
+    method.__name__ = method_name
+    return method
+
+class FrozenDict(_Frozen, dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._frozen = True
+
+    def _items(self):
+        return dict(self)
+
+    def assoc(self, key, val):
+        "returns a new frozen dict with `key` set to `val`. all other values are shared, not copied."
+        data = self._items()
+        data[key] = freeze(val)
+        return type(self)(data)
+
+    def dissoc(self, *key_list):
+        "returns a new frozen dict without the keys in `key_list`. all other values are shared, not copied."
+        return type(self)((key, val) for key, val in self.items() if key not in key_list)
+
+class FrozenOrderedDict(FrozenDict, OrderedDict):
+    def _items(self):
+        return OrderedDict(self)
+
+class FrozenList(_Frozen, list):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._frozen = True
+
+    def _items(self):
+        return list(self)
+
+for _method_name in ['__setitem__', '__delitem__', '__ior__', 'clear', 'pop', 'popitem', 'setdefault', 'update', 'move_to_end']:
+    setattr(FrozenDict, _method_name, _refusing(_method_name))
+    setattr(FrozenOrderedDict, _method_name, _refusing(_method_name))
+for _method_name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse']:
+    setattr(FrozenList, _method_name, _refusing(_method_name))
+
+def freeze(data):
+    """returns an immutable copy of the given `data`.
+    dicts, OrderedDicts and lists are converted to their frozen equivalents, other values are returned as-is.
+    data that is already frozen is returned without copying."""
+    if isinstance(data, _Frozen):
+        return data
+    if isinstance(data, OrderedDict):
+        return FrozenOrderedDict((key, freeze(val)) for key, val in data.items())
+    if isinstance(data, dict):
+        return FrozenDict((key, freeze(val)) for key, val in data.items())
+    if isinstance(data, list):
+        return FrozenList(freeze(val) for val in data)
+    return data
+
+def thaw(data):
+    """returns a mutable copy of the given `data`, the inverse of `freeze`.
+    much faster than `deepcopy` but only dicts, OrderedDicts and lists are copied."""
+    if isinstance(data, OrderedDict):
+        return OrderedDict((key, thaw(val)) for key, val in data.items())
+    if isinstance(data, dict):
+        return {key: thaw(val) for key, val in data.items()}
+    if isinstance(data, list):
+        return [thaw(val) for val in data]
+    return data
+
 def isint(v):
     return str(v).lstrip('-+').isdigit()
 
@@ -113,6 +211,17 @@ def mkidx(fn, lst):
         groups[key] = grp
     return groups
 
+def concurrently(fn, arg_list, max_workers=None):
+    """calls `fn` with each item in `arg_list` using a pool of at most `max_workers` threads, returning a list of results in the same order.
+    `fn` is called with every item, even if a call fails. the first exception raised (in `arg_list` order) is re-raised once all calls have finished."""
+    arg_list = list(arg_list)
+    max_workers = min(max_workers or len(arg_list), len(arg_list))
+    if max_workers < 2: # noqa: PLR2004
+        return [fn(arg) for arg in arg_list]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        future_list = [pool.submit(fn, arg) for arg in arg_list]
+    return [future.result() for future in future_list]
+
 def deepmerge(into, from_here, excluding=None):
     "destructive deep merge of `into` with values `from_here`"
     if not excluding:
@@ -262,6 +371,9 @@ def ordered_dump(data, stream=None, dumper_class=yaml.Dumper, default_flow_style
             yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
             list(data.items()))
     OrderedDumper.add_representer(OrderedDict, _dict_representer)
+    OrderedDumper.add_representer(FrozenOrderedDict, _dict_representer)
+    OrderedDumper.add_representer(FrozenDict, yaml.representer.SafeRepresenter.represent_dict)
+    OrderedDumper.add_representer(FrozenList, yaml.representer.SafeRepresenter.represent_list)
     kwds.update({'default_flow_style': default_flow_style, 'indent': indent, 'line_break': line_break})
     # WARN: if stream is provided, return value is None
     return yaml.dump(data, stream, OrderedDumper, **kwds)
@@ -298,7 +410,7 @@ def ymd(dt=None, fmt="%Y-%m-%d"):
     return dt.strftime(fmt)
 
 def mkdir_p(path):
-    os.system("mkdir -p %s" % path)
+    os.makedirs(path, exist_ok=True)
     ensure(os.path.isdir(path), "directory couldn't be created: %s" % path)
     ensure(os.access(path, os.W_OK | os.X_OK), "directory isn't writable: %s" % path)
     return path
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import re
 import sys
 from pprint import pformat
 
@@ -59,6 +60,46 @@ type the name of the stack to continue or anything else to quit:
         raise TaskExit('you needed to type "%s" to continue.' % stackname)
     return bootstrap.destroy(stackname)
 
+def destroy_many(pattern, concurrency=bootstrap.DESTROY_MANY_CONCURRENCY):
+    """Delete many stacks whose names match a regular expression, several at a time.
+    the whole stack name must match. for example: ./bldr destroy_many:".+--(ci|end2end)"
+    use `concurrency=n` to change the number of stacks deleted at once."""
+    if not pattern:
+        msg = "a regular expression matching stack names is required."
+        raise TaskExit(msg)
+    region = core.find_region()
+    stackname_list = [stack['StackName'] for stack in core.find_stacks(region)]
+    stackname_list = [stackname for stackname in stackname_list if core.stackname_parseable(stackname) and re.fullmatch(pattern, stackname)]
+    if not stackname_list:
+        raise TaskExit("no stacks match %r." % pattern)
+
+    print("the following stacks will be deleted:")
+    print(stackname_list)
+    print()
+    confirmation = "destroy %s stacks" % len(stackname_list)
+    msg = '''this is a BIG DEAL. you cannot recover from this.
+type "%s" to continue or anything else to quit:
+> ''' % confirmation
+    # `utils.get_input` refuses to run in non-interactive mode.
+    uin = utils.get_input(msg)
+    if not uin or not uin.strip().lower() == confirmation:
+        raise TaskExit('you needed to type "%s" to continue.' % confirmation)
+
+    results = bootstrap.destroy_many(stackname_list, concurrency=int(concurrency))
+
+    print()
+    failed = 0
+    for stackname, (elapsed, error) in results.items():
+        if error:
+            failed += 1
+            print("%-50s failed after %.0fs: %s" % (stackname, elapsed, error))
+        else:
+            print("%-50s deleted in %.0fs" % (stackname, elapsed))
+    print()
+    print("%s of %s stacks deleted" % (len(results) - failed, len(results)))
+    if failed:
+        raise TaskExit("%s stacks failed to be deleted." % failed)
+
 # todo: merge with `destroy`
 def ensure_destroyed(stackname):
     try:
@@ -78,7 +119,8 @@ def update(stackname, autostart="0", concurrency='serial', dry_run=False, servic
 
     Runs the ec2 update by default (bootstrap script, Salt highstate).
     Use comma-separated `service_list=foo,bar,baz` to target specific services.
-    Available services: ec2, s3, sqs"""
+    Available services: ec2, s3, sqs
+    With `dry_run=true` the sqs service only logs the subscription changes it would make."""
     instances = _check_want_to_be_running(stackname, utils.strtobool(autostart))
     if not instances:
         return None
@@ -90,7 +132,7 @@ def update(stackname, autostart="0", concurrency='serial', dry_run=False, servic
     return bootstrap.update_stack(stackname, service_list=service_list, concurrency=concurrency, dry_run=dry_run)
 
 @timeit
-def update_infrastructure(stackname, skip=None, start=None):
+def update_infrastructure(stackname, skip=None, start=None, force=False):
     """Limited update of the Cloudformation template and/or Terraform template.
 
     Resources can be added, but most of the existing ones are immutable.
@@ -106,33 +148,45 @@ def update_infrastructure(stackname, skip=None, start=None):
 
     Allows to skip EC2, SQS, S3 updates by passing `skip=ec2\\,sqs\\,s3`
 
-    By default starts EC2 instances but this can be avoid by passing `start=`"""
+    By default starts EC2 instances but this can be avoid by passing `start=`
+
+    Templates are not regenerated if the project data and builder are unchanged since
+    the last successful update. Use `force=true` to always regenerate them."""
 
     if start is None:
         start = ["ec2"]
     skip = skip.split(",") if skip else []
     start = start.split(",") if isinstance(start, str) else start or []
+    force = utils.strtobool(force)
 
     (_pname, _) = core.parse_stackname(stackname)
     more_context = {}
-    context, delta, current_context = cfngen.regenerate_stack(stackname, **more_context)
+    context, delta, current_context = cfngen.regenerate_stack(stackname, force=force, **more_context)
 
     if _are_there_existing_servers(current_context) and 'ec2' in start:
         core_lifecycle.start(stackname)
-    LOG.info("Create: %s", pformat(delta.plus))
-    LOG.info("Update: %s", pformat(delta.edit))
-    LOG.info("Delete: %s", pformat(delta.minus))
-    LOG.info("Terraform delta: %s", delta.terraform)
 
-    # see: `buildercore.config.BUILDER_NON_INTERACTIVE` for skipping confirmation prompts
-    if not utils.confirm('Confirming changes to CloudFormation and Terraform templates?', 'confirm'):
-        msg = "failed to confirm"
-        raise TaskExit(msg)
+    if delta is None:
+        LOG.info("No changes to CloudFormation or Terraform templates")
+    else:
+        LOG.info("Create: %s", pformat(delta.plus))
+        LOG.info("Update: %s", pformat(delta.edit))
+        LOG.info("Delete: %s", pformat(delta.minus))
+        LOG.info("Changed: %s", pformat(delta.cloudformation.diff))
+        LOG.info("Terraform delta: %s", delta.terraform)
+
+        # see: `buildercore.config.BUILDER_NON_INTERACTIVE` for skipping confirmation prompts
+        if not utils.confirm('Confirming changes to CloudFormation and Terraform templates?', 'confirm'):
+            msg = "failed to confirm"
+            raise TaskExit(msg)
+
+        context_handler.write_context(stackname, context)
 
-    context_handler.write_context(stackname, context)
+        cloudformation.update_template(stackname, delta.cloudformation)
+        terraform.update_template(stackname)
 
-    cloudformation.update_template(stackname, delta.cloudformation)
-    terraform.update_template(stackname)
+        # the templates were successfully updated, the next update can be skipped if nothing changes.
+        context_handler.write_context(stackname, cfngen.fingerprint_context(context))
 
     # TODO: move inside bootstrap.update_stack
     # EC2
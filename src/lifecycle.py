@@ -33,6 +33,10 @@ def start_many(pattern):
     print()
     utils.confirm("continue?")
 
+    # start all ec2 nodes together with a single batched poll,
+    # then finish starting each stack in parallel (rds, ssh, dns).
+    lifecycle.start_many(stackname_list)
+
     @parallel
     def workerfn():
         return lifecycle.start(state.ENV['stackname'])
@@ -33,11 +33,10 @@ def requires_masterless(fn):
 
 def parse_validate_repolist(fdata, *repolist):
     "returns a list of triples"
-    known_formulas = fdata.get('formula-dependencies', [])
-    known_formulas.extend([
+    known_formulas = fdata.get('formula-dependencies', []) + [
         fdata['formula-repo'],
         fdata['private-repo']
-    ])
+    ]
 
     known_formula_map = OrderedDict(zip(map(os.path.basename, known_formulas), known_formulas))
 
@@ -121,8 +120,7 @@ def set_versions(stackname, *repolist):
         return 'nothing to do'
 
     def updater():
-        for repo, formula, revision in repolist:
-            bootstrap.run_script('update-masterless-formula.sh', repo, formula, revision)
+        bootstrap.run_scripts([[('update-masterless-formula.sh', [repo, formula, revision]) for repo, formula, revision in repolist]])
 
     core.stack_all_ec2_nodes(stackname, updater, concurrency='serial')
     return None
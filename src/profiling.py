@@ -0,0 +1,146 @@
+"""startup profiling for `./bldr`.
+
+`./bldr` is called many thousands of times a week by CI and it's fixed startup cost adds up.
+enable with `BUILDER_PROFILE_STARTUP=1 ./bldr ...` to print a report to stderr after the task has run of:
+
+* the time spent importing each module, by itself and including the modules it imports,
+* the time spent in each stage of `buildercore.config` setup,
+* the time until the task was called and the time the task took.
+
+use `BUILDER_PROFILE_STARTUP=/path/to/report.json ./bldr ...` to also write the report as JSON.
+
+this module must be imported before any other module to see every import. it only uses the standard library."""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+ENVVAR = 'BUILDER_PROFILE_STARTUP'
+SETTING = os.environ.get(ENVVAR, '')
+ENABLED = SETTING not in ['', '0']
+
+# number of modules listed in the printed report.
+REPORT_SIZE = 25
+
+_START = time.perf_counter()
+
+# cpu time used before this module was imported, roughly the Python interpreter's own startup.
+_INTERPRETER_CPU = time.process_time()
+
+# {module-name: (seconds-including-imports, seconds-excluding-imports), ...}
+IMPORTS = {}
+
+# time spent importing other modules by each module currently being imported.
+_IMPORT_STACK = []
+
+# [(label, seconds-since-start), ...]
+MARKS = []
+
+def _timed_exec_module(exec_module):
+    "wraps a loader's `exec_module` function, recording the time taken to execute each module."
+    def timed_exec_module(module):
+        _IMPORT_STACK.append(0.0)
+        start = time.perf_counter()
+        try:
+            return exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            imports_elapsed = _IMPORT_STACK.pop()
+            if _IMPORT_STACK:
+                _IMPORT_STACK[-1] += elapsed
+            IMPORTS[module.__name__] = (elapsed, elapsed - imports_elapsed)
+    timed_exec_module.timed = True
+    return timed_exec_module
+
+class ImportTimer:
+    """a `sys.meta_path` finder that times the modules found by the other finders.
+    the loader of each module found is given a timed `exec_module`."""
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, 'find_spec', None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            # classes are shared loaders for builtin and frozen modules, they are fast and are ignored.
+            exec_module = getattr(loader, 'exec_module', None)
+            if exec_module and not isinstance(loader, type) and not getattr(exec_module, 'timed', False):
+                # some loaders can't be given new attributes and aren't timed.
+                with contextlib.suppress(AttributeError):
+                    loader.exec_module = _timed_exec_module(exec_module)
+            return spec
+        return None
+
+def install():
+    "starts timing imports."
+    if not any(isinstance(finder, ImportTimer) for finder in sys.meta_path):
+        sys.meta_path.insert(0, ImportTimer())
+
+def mark(label):
+    "records the time since startup as `label`, if profiling is enabled. only the first mark for a `label` is kept."
+    if ENABLED and label not in dict(MARKS):
+        MARKS.append((label, time.perf_counter() - _START))
+
+def report():
+    "returns a map of startup timings."
+    config = sys.modules.get('buildercore.config')
+    marks = dict(MARKS)
+    total = time.perf_counter() - _START
+    task_called = marks.get('task called')
+    imports = [
+        {'module': name, 'self': self_elapsed, 'cumulative': elapsed}
+        for name, (elapsed, self_elapsed) in IMPORTS.items()
+    ]
+    return {
+        'interpreter-cpu': _INTERPRETER_CPU,
+        'until-task-called': task_called,
+        'task': None if task_called is None else total - task_called,
+        'total': total,
+        'config': getattr(config, 'SETUP_TIMINGS', []),
+        'imports-total': sum(row['self'] for row in imports),
+        'imports': sorted(imports, key=lambda row: row['self'], reverse=True),
+    }
+
+def _ms(seconds):
+    return "n/a" if seconds is None else "%.1fms" % (seconds * 1000)
+
+def print_report(data, out=None):
+    out = out or sys.stderr
+
+    def p(line=''):
+        print(line, file=out)
+
+    p("startup profile (%s):" % ENVVAR)
+    p("  %-26s %10s" % ("python startup (cpu)", _ms(data['interpreter-cpu'])))
+    p("  %-26s %10s" % ("until task called", _ms(data['until-task-called'])))
+    p("  %-26s %10s" % ("task", _ms(data['task'])))
+    p("  %-26s %10s" % ("total", _ms(data['total'])))
+    p()
+    p("buildercore.config setup:")
+    for stage, elapsed in data['config']:
+        p("  %-26s %10s" % (stage, _ms(elapsed)))
+    p()
+    p("imports (%s modules, %s), slowest %s by self time:" % (len(data['imports']), _ms(data['imports-total']), REPORT_SIZE))
+    p("  %10s %12s  %s" % ("self", "cumulative", "module"))
+    for row in data['imports'][:REPORT_SIZE]:
+        p("  %10s %12s  %s" % (_ms(row['self']), _ms(row['cumulative']), row['module']))
+
+def finish():
+    """prints the startup report if profiling is enabled.
+    the report is also written as JSON if `BUILDER_PROFILE_STARTUP` is a path."""
+    if not ENABLED:
+        return
+    data = report()
+    print_report(data)
+    if SETTING != '1':
+        with open(SETTING, 'w') as fh:
+            json.dump(data, fh, indent=4)
+        print("wrote %s" % SETTING, file=sys.stderr)
+
+if ENABLED:
+    install()
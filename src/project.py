@@ -1,8 +1,11 @@
 import os
+import tempfile
+import time
 
 import utils
 from buildercore import cfngen, config, core, project
 from buildercore.command import local, settings
+from buildercore.utils import ensure
 from decorators import format_output, requires_project
 
 
@@ -46,3 +49,29 @@ def new():
     "creates a new project formula from a template"
     pname = utils.uin('project name')
     local('./scripts/new-project.sh %s' % pname)
+
+def render_all(output_dir=None, pname=None, processes=None):
+    """renders the CloudFormation and Terraform templates for every project and alt-config in parallel.
+    templates are written to `output_dir`, default is a new temporary directory.
+    use `pname` to render a single project and `processes` to limit the number of worker processes."""
+    output_dir = output_dir or tempfile.mkdtemp(prefix='builder-templates-', dir=config.TEMP_PATH)
+    pname_list = [pname] if pname else None
+    if pname:
+        ensure(pname in project.project_map(), "unknown project %r" % pname, utils.TaskExit)
+    max_workers = int(processes) if processes else None
+
+    start = time.perf_counter()
+    result_list = cfngen.render_all(output_dir, pname_list, max_workers)
+    elapsed = time.perf_counter() - start
+
+    failure_list = [result for result in result_list if result['error']]
+    for result in result_list:
+        status = 'failed' if result['error'] else 'ok'
+        print("%-60s %8.1fms  %s" % (result['stackname'], result['elapsed'] * 1000, status))
+    for result in failure_list:
+        print("\n%s (alt-config %s) failed:\n%s" % (result['project'], result['alt-config'], result['error']))
+
+    print("\nrendered %s combinations in %.2fs, %s failed" % (len(result_list), elapsed, len(failure_list)))
+    print("wrote templates to: %s" % output_dir)
+    if failure_list:
+        raise utils.TaskExit("failed to render %s combinations" % len(failure_list))
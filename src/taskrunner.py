@@ -1,43 +1,42 @@
+# import profiling first so it can time every import, see `profiling.py`.
+import profiling # noqa: I001
+
 # import threadbare early so `gevent.monkey_patch` can patch everything.
 # threadbare module is otherwise not used.
-import threadbare # noqa: F401, I001
+import threadbare # noqa: F401
 
+import ast
+import importlib
 import sys
 import traceback
-from functools import reduce
-
-import askmaster
-import aws
-import aws.cloudformation
-import aws.ec2
-import aws.rds
-import buildvars
-import cfn
-import checks
-import deploy
-import lifecycle
-import master
-import masterless
-import project
-import report
-import stack
-import tasks
-import utils
-import vault
+from functools import partial, reduce
+from os.path import dirname, join
+
+from kids.cache import cache as cached
+
 from buildercore import config
-from decorators import echo_output
+from buildercore.utils import errcho
 
+SRC_DIR = dirname(__file__)
+
+def _echo_output(result):
+    """prints the `result` of a builtin task like `decorators.echo_output` does.
+    importing `decorators` would import most of `buildercore`."""
+    errcho('output:')
+    print(result)
+    return result
 
-@echo_output
 def ping():
-    return "pong"
+    return _echo_output("pong")
 
-@echo_output
 def echo(msg, *args, **kwargs):
     if args or kwargs:
-        return "received: %s with args: %s and kwargs: %s" % (msg, args, kwargs)
-    return "received: %s" % (msg,)
+        return _echo_output("received: %s with args: %s and kwargs: %s" % (msg, args, kwargs))
+    return _echo_output("received: %s" % (msg,))
+
 
+# NOTE: tasks are referenced by their path, for example 'cfn.destroy'.
+# a task's module is only imported when that task is called, see `mk_task_map`.
 
 # NOTE: 'unqualified' tasks are those that can be called just by their function name.
 # for example: `./bldr start` is the unqualified function `lifecycle.start`.
@@ -48,154 +47,185 @@ def echo(msg, *args, **kwargs):
 UNQUALIFIED_TASK_LIST = [
     ping, echo,
 
-    cfn.destroy,
+    'cfn.destroy',
     # see: elife-jenkins-workflow-libs/vars/elifeFormula.groovy
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.basebox-1804, Jenkinsfile.clean-journal-environments
-    cfn.ensure_destroyed,
+    'cfn.ensure_destroyed',
+    'cfn.destroy_many',
     # see: elife-jenkins-workflow-libs/vars/builderUpdate.groovy, elifeFormula.groovy
-    cfn.update,
-    cfn.update_infrastructure,
+    'cfn.update',
+    'cfn.update_infrastructure',
 
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.basebox-1804, Jenkinsfile.update-journal-pr
-    cfn.launch,
-    cfn.ssh,
-    cfn.owner_ssh,
+    'cfn.launch',
+    'cfn.ssh',
+    'cfn.owner_ssh',
     # see: elife-jenkins-workflow-libs/vars/builderTestArtifact.groovy
-    cfn.download_file,
+    'cfn.download_file',
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.journal-cms-restore-continuumtest
-    cfn.upload_file,
+    'cfn.upload_file',
     # see: elife-jenkins-workflow-libs/vars/builderCmd*.groovy
-    cfn.cmd,
+    'cfn.cmd',
     # see: elife-jenkins-workflow-libs/vars/builderDeployRevision.groovy
-    deploy.switch_revision_update_instance,
+    'deploy.switch_revision_update_instance',
     # see: elife-jenkins-workflow-libs/vars/builderStart.groovy
-    lifecycle.start,
+    'lifecycle.start',
     # see: elife-jenkins-workflow-libs/vars/builderStop.groovy
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.basebox-1804, Jenkinsfile.ec2-plugin-ami-update
-    lifecycle.stop,
-    lifecycle.restart,
+    'lifecycle.stop',
+    'lifecycle.restart',
     # see: elife-jenkins-workflow-libs/vars/builderStopIfRunningFor.groovy
-    lifecycle.stop_if_running_for,
-    lifecycle.update_dns,
+    'lifecycle.stop_if_running_for',
+    'lifecycle.update_dns',
 ]
 
 # NOTE: these are 'qualified' tasks where the full path to the function must be used.
 # for example: `./bldr buildvars.switch_revision`
 TASK_LIST = [
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.basebox-1804, Jenkinsfile.ec2-plugin-ami-update
-    tasks.create_ami,
-    tasks.repair_cfn_info,
-    tasks.repair_context,
+    'tasks.create_ami',
+    'tasks.repair_cfn_info',
+    'tasks.repair_context',
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.basebox-1804, Jenkinsfile.ec2-plugin-ami-update
-    tasks.remove_minion_key,
+    'tasks.remove_minion_key',
     # see: elife-alfred-formula/jenkinsfiles/Jenkinsfile.master-server
-    master.update,
+    'master.update',
 
-    askmaster.fail2ban_running,
-    askmaster.installed_linux_kernel,
-    askmaster.linux_distro,
-    askmaster.installed_salt_version,
+    'askmaster.fail2ban_running',
+    'askmaster.installed_linux_kernel',
+    'askmaster.linux_distro',
+    'askmaster.installed_salt_version',
 
     # see: elife-jenkins-workflow-libs/vars/builderRunAll.groovy
-    buildvars.switch_revision,
+    'buildvars.switch_revision',
 
     # see: journal/Jenkinsfile.prod
-    deploy.load_balancer_register_all,
+    'deploy.load_balancer_register_all',
 
-    project.data,
-    project.context,
-    project.new,
+    'project.data',
+    'project.context',
+    'project.new',
+    'project.render_all',
 
-    stack.list_stacks,
-    stack.stack_config,
-    stack.regenerate_stack,
-    stack.generate_stacks,
+    'stack.list_stacks',
+    'stack.stack_config',
+    'stack.regenerate_stack',
+    'stack.generate_stacks',
 
-    aws.ec2.start_node,
-    aws.ec2.stop_node,
-    aws.ec2.restart_node,
-    aws.ec2.reboot_node,
+    'aws.ec2.start_node',
+    'aws.ec2.stop_node',
+    'aws.ec2.restart_node',
+    'aws.ec2.reboot_node',
 
-    lifecycle.start_many,
+    'lifecycle.start_many',
 
     # see: elife-jenkins-workflow-libs/vars/elifeFormula.groovy
-    masterless.launch,
+    'masterless.launch',
     # see: elife-jenkins-workflow-libs/vars/elifeFormula.groovy
-    masterless.set_versions,
-
-    vault.login,
-    vault.logout,
-    vault.policies_update,
-    vault.token_lookup,
-    vault.token_list_accessors,
-    vault.token_lookup_accessor,
-    vault.token_create,
-    vault.token_revoke,
-
-    report.all_projects,
-    report.all_ec2_projects,
-    report.all_ec2_instances,
-    report.all_ec2_instances_for_salt_upgrade,
-    report.all_rds_projects,
-    report.all_rds_instances,
-    report.all_lb_projects,
-    report.all_cloudfront_projects,
-    report.all_cloudformation_instances,
-    report.all_formulas,
-    report.all_adhoc_ec2_instances,
-    report.long_running_large_ec2_instances,
-    report.all_amis_to_prune,
-    report.ec2_node_count,
+    'masterless.set_versions',
+
+    'vault.login',
+    'vault.logout',
+    'vault.policies_update',
+    'vault.token_lookup',
+    'vault.token_list_accessors',
+    'vault.token_lookup_accessor',
+    'vault.token_create',
+    'vault.token_revoke',
+
+    'report.all_projects',
+    'report.all_ec2_projects',
+    'report.all_ec2_instances',
+    'report.all_ec2_instances_for_salt_upgrade',
+    'report.all_rds_projects',
+    'report.all_rds_instances',
+    'report.all_lb_projects',
+    'report.all_cloudfront_projects',
+    'report.all_cloudformation_instances',
+    'report.all_formulas',
+    'report.all_adhoc_ec2_instances',
+    'report.long_running_large_ec2_instances',
+    'report.all_amis_to_prune',
+    'report.ec2_node_count',
     # see: https://alfred.elifesciences.org/job/process/job/process-project-security-updates/
-    report.process_project_security_updates,
-    report.ri_recommendations,
+    'report.process_project_security_updates',
+    'report.ri_recommendations',
 
-    checks.stack_exists,
-    tasks.delete_all_amis_to_prune,
+    'checks.stack_exists',
+    'tasks.delete_all_amis_to_prune',
 ]
 
 # 'debug' tasks are those that are available when the environment variable BLDR_ROLE is set to 'admin'
 # this list of debug tasks don't require the full path to be used
 # for example: 'BLDR_ROLE=admin ./bldr fix_bootstrap' will execute the 'fix_bootstrap' task
 UNQUALIFIED_DEBUG_TASK_LIST = [
-    cfn.fix_bootstrap,
+    'cfn.fix_bootstrap',
     # cfn.aws_stack_list, # moved to 'aws.cloudformation.stack_list'
 ]
 
 # same as above, but the task name must be fully written out
 # for example: 'BLDR_ROLE=admin ./bldr master.download_keypair'
 DEBUG_TASK_LIST = [
-    aws.rds.snapshot_list,
-    aws.cloudformation.stack_list,
+    'aws.rds.snapshot_list',
+    'aws.cloudformation.stack_list',
 
-    deploy.load_balancer_status,
+    'deploy.load_balancer_status',
 
-    master.write_missing_keypairs_to_s3,
-    master.download_keypair,
-    master.server_access,
-    master.update,
-    master.update_salt,
+    'master.write_missing_keypairs_to_s3',
+    'master.download_keypair',
+    'master.server_access',
+    'master.update',
+    'master.update_salt',
 
-    buildvars.read,
-    buildvars.valid,
-    buildvars.fix,
-    buildvars.force,
-    buildvars.refresh,
+    'buildvars.read',
+    'buildvars.valid',
+    'buildvars.fix',
+    'buildvars.force',
+    'buildvars.refresh',
 
-    project.clone_project_formulas,
-    project.clone_all_project_formulas,
+    'project.clone_project_formulas',
+    'project.clone_all_project_formulas',
 ]
 
+@cached
+def module_docstrings(module_name):
+    """returns a map of function names to their docstrings for the top-level functions in `module_name`.
+    the module's source is parsed rather than imported, see `mk_task_map`."""
+    path = join(SRC_DIR, *module_name.split('.')) + '.py'
+    with open(path) as fh:
+        tree = ast.parse(fh.read(), path)
+    return {node.name: ast.get_docstring(node, clean=False) for node in tree.body if isinstance(node, ast.FunctionDef)}
+
+def task_fn(path):
+    "imports the module of the task at `path` and returns the task function."
+    module_name, fn_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), fn_name)
+
+def _call_task(task, *args, **kwargs):
+    "calls the `task` function or imports and calls the task function at path `task`."
+    if isinstance(task, str):
+        task = task_fn(task)
+    profiling.mark('task called')
+    return task(*args, **kwargs)
+
 def mk_task_map(task, qualified=True):
-    """returns a map of information about the given task function.
-    when `qualified` is `False`, the path to the task is truncated to just the task name"""
-    # lsh@2022-09-16: not sure why I was truncating the module path ('aws.rds' => 'rds'),
-    # but I need the full thing now.
-    #path = "%s.%s" % (task.__module__.split('.')[-1], task.__name__)
-    path = "%s.%s" % (task.__module__, task.__name__)
-    unqualified_path = task.__name__
+    """returns a map of information about the given task function or path to a task function.
+    when `qualified` is `False`, the path to the task is truncated to just the task name.
+    the module of a task given as a path isn't imported until the task is called.
+    importing every task module is slow and only one task is ever called."""
+    if isinstance(task, str):
+        path = task
+        module_name, unqualified_path = path.rsplit('.', 1)
+        docstr = module_docstrings(module_name).get(unqualified_path)
+    else:
+        # lsh@2022-09-16: not sure why I was truncating the module path ('aws.rds' => 'rds'),
+        # but I need the full thing now.
+        #path = "%s.%s" % (task.__module__.split('.')[-1], task.__name__)
+        path = "%s.%s" % (task.__module__, task.__name__)
+        unqualified_path = task.__name__
+        docstr = task.__doc__
     #description = (task.__doc__ or '').strip().replace('\n', ' ')
-    docstr = (task.__doc__ or '').replace('  ', '')
+    docstr = (docstr or '').replace('  ', '')
     docstr_bits = docstr.split('\n', 1)
     short_str = docstr_bits[0]
     long_str = docstr_bits[1] if len(docstr_bits) > 1 else ''
@@ -204,7 +234,7 @@ def mk_task_map(task, qualified=True):
         "path": path,
         "short_description": short_str,
         "long_description": long_str,
-        "fn": task,
+        "fn": partial(_call_task, task),
     }
 
 def generate_task_list(show_debug_tasks=False):
@@ -301,20 +331,22 @@ def exec_task(task_str, task_map_list):
         return_map['rc'] = 0
         return return_map
 
-    except utils.TaskExit as te:
-        msg = str(te)
-        if msg:
-            print(msg)
-        print('\nQuit.')
-        return_map['rc'] = 1
-        return return_map
-
     except KeyboardInterrupt:
         print('\nStopped.')
         return_map['rc'] = 1
         return return_map
 
     except BaseException as e:
+        # `utils` is imported by any task that can raise a `TaskExit`.
+        import utils  # noqa: PLC0415
+        if isinstance(e, utils.TaskExit):
+            msg = str(e)
+            if msg:
+                print(msg)
+            print('\nQuit.')
+            return_map['rc'] = 1
+            return return_map
+
         print('exception while executing task %r: %s\n' % (task_name, str(e)))
         print(traceback.format_exc())
         return_map['rc'] = 2 # arbitrary
@@ -358,10 +390,13 @@ def main(arg_list):
             if tm['long_description']:
                 print()
 
+        profiling.finish()
+
         # no explicit invocation of help gets you an error code
         return 0 if command_string else 1
 
     task_result = exec_task(command_string, task_map_list)
+    profiling.finish()
     return task_result['rc']
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
+import contextlib
 import importlib
 import json
 import logging
 import os
 import shutil
+import signal
+import subprocess
 from os.path import join
 from random import randint
 from unittest import TestCase
@@ -61,6 +64,54 @@ def copy_fixture(fixture_subpath, destination_path):
     shutil.copyfile(fixture_path(fixture_subpath), destination_path)
     return destination_path
 
+@contextlib.contextmanager
+def fail_after(seconds):
+    """raises a `TimeoutError` if the body hasn't finished after `seconds`, and again every second after that.
+    uses `SIGALRM` so a call blocking the whole thread, like a deadlocked lock, is also interrupted.
+    repeating the error interrupts each blocked call in turn, even when the error is caught."""
+    def handler(signum, frame):
+        raise TimeoutError("timed out after %ss" % seconds)
+    previous_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds, 1)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+class TerraformInit:
+    """stands in for `Terraform.init`, running a short subprocess like the real `terraform init`.
+    records the number of calls and whether any of them overlapped."""
+    def __init__(self, seconds=0.2):
+        self.seconds = seconds
+        self.active = 0
+        self.call_count = 0
+        self.overlapped = False
+
+    def __call__(self, *args, **kwargs):
+        self.active += 1
+        self.call_count += 1
+        self.overlapped = self.overlapped or self.active > 1
+        try:
+            subprocess.run(['sleep', str(self.seconds)], check=True)
+        finally:
+            self.active -= 1
+
+def run_ec2_instance(stackname=None, node=1):
+    """runs an ec2 instance in 'us-east-1', tagged as node `node` of `stackname` if given.
+    use within `moto.mock_aws`. returns the instance id."""
+    conn = core.boto_client('ec2', 'us-east-1')
+    tags = []
+    if stackname:
+        tags = [
+            {'Key': 'aws:cloudformation:stack-name', 'Value': stackname},
+            {'Key': 'Name', 'Value': '%s--%s' % (stackname, node)},
+            {'Key': 'Node', 'Value': str(node)},
+        ]
+    kwargs = {'TagSpecifications': [{'ResourceType': 'instance', 'Tags': tags}]} if tags else {}
+    resp = conn.run_instances(ImageId='ami-12c6146b', MinCount=1, MaxCount=1, **kwargs)
+    return resp['Instances'][0]['InstanceId']
+
 def switch_in_test_settings(projects_files=None):
     if not projects_files:
         projects_files = ['src/tests/fixtures/projects/']
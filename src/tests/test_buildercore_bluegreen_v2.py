@@ -166,3 +166,67 @@ def test_registered():
         with patch('buildercore.core.all_node_params', return_value=NODE_PARAMS):
             with patch('buildercore.cloudformation.outputs_map', return_value=TARGET_GROUP_OUTPUT):
                 assert bluegreen_v2._registered(stackname, NODE_PARAMS) == expected
+
+def test_divide():
+    node_params = {
+        'nodes': {'i-%s' % node: node for node in range(1, 6)},
+        'public_ips': {'i-%s' % node: '127.0.0.%s' % node for node in range(1, 6)},
+        'stackname': 'dummy1--test',
+    }
+    groups = bluegreen_v2.divide(node_params, 3)
+    assert [sorted(group['nodes'].values()) for group in groups] == [[1, 4], [2, 5], [3]]
+    assert groups[0]['public_ips'] == {'i-1': '127.0.0.1', 'i-4': '127.0.0.4'}
+    assert groups[0]['stackname'] == 'dummy1--test'
+
+def test_polling():
+    "polling intervals and timeouts follow the health check interval and deregistration delay of the TargetGroups"
+    mock = MagicMock()
+    mock.describe_target_groups.return_value = {'TargetGroups': [
+        {'HealthCheckIntervalSeconds': 10, 'HealthyThresholdCount': 3},
+        {'HealthCheckIntervalSeconds': 30, 'HealthyThresholdCount': 5},
+    ]}
+    mock.describe_target_group_attributes.side_effect = [
+        {'Attributes': [{'Key': 'deregistration_delay.timeout_seconds', 'Value': '20'}]},
+        {'Attributes': [{'Key': 'deregistration_delay.timeout_seconds', 'Value': '600'}]},
+    ]
+    target_group_output = {'ELBv2TargetGroupHttp80': 'arn--my-target-group', 'ELBv2TargetGroupHttp443': 'arn--my-other-target-group'}
+    with patch('buildercore.bluegreen_v2.conn', return_value=mock), \
+         patch('buildercore.cloudformation.outputs_map', return_value=target_group_output):
+        timings = bluegreen_v2._target_group_timings('foo')
+        assert timings == {'health-check-interval': 10, 'time-to-healthy': 150, 'deregistration-delay': 600}
+
+        with patch('buildercore.bluegreen_v2._target_group_timings', return_value=timings):
+            assert bluegreen_v2._polling('foo', registering=True) == (2, 600)
+            assert bluegreen_v2._polling('foo', registering=False) == (5, 1200)
+
+def test_do():
+    "each group of nodes is deregistered, worked on and registered in turn"
+    node_params = {
+        'nodes': {'i-%s' % node: node for node in range(1, 4)},
+        'public_ips': {'i-%s' % node: '127.0.0.%s' % node for node in range(1, 4)},
+        'stackname': 'dummy1--test',
+    }
+    calls = []
+
+    def recorder(name):
+        def fn(stackname_or_work_fn, group=None):
+            calls.append((name, sorted(group['nodes'].values()) if group else None))
+        return fn
+
+    with patch('buildercore.bluegreen_v2.info'), \
+         patch('buildercore.bluegreen_v2.wait_all_in_service', recorder('wait_all_in_service')), \
+         patch('buildercore.bluegreen_v2.deregister', recorder('deregister')), \
+         patch('buildercore.bluegreen_v2.wait_deregistered_all', recorder('wait_deregistered_all')), \
+         patch('buildercore.core.parallel_work', recorder('parallel_work')), \
+         patch('buildercore.bluegreen_v2.register', recorder('register')), \
+         patch('buildercore.bluegreen_v2.wait_registered_any', recorder('wait_registered_any')), \
+         patch('buildercore.bluegreen_v2.wait_registered_all', recorder('wait_registered_all')):
+        bluegreen_v2.do(None, node_params, num_groups=3)
+
+    expected = [('wait_all_in_service', None)]
+    for node in [1, 2, 3]:
+        expected += [('deregister', [node]), ('wait_deregistered_all', [node]), ('parallel_work', [node]), ('register', [node])]
+        if node != 3: # noqa: PLR2004
+            expected += [('wait_registered_any', [node])]
+    expected += [('wait_registered_all', [1, 2, 3])]
+    assert calls == expected
@@ -1,13 +1,25 @@
 import json
+import os
 from os.path import join
 from unittest import mock
 
-from buildercore import bootstrap
+import pytest
+from moto import mock_aws
+
+from buildercore import bootstrap, cfngen, config, core
 from buildercore.utils import yaml_dumps
 
 from . import base
 
 
+def _aws_client():
+    "returns a mock SNS and SQS client for the queue 'observer--end2end' whose subscriptions deliver raw messages."
+    client = mock.MagicMock()
+    client.get_queue_url.return_value = {'QueueUrl': 'https://sqs.us-east-1.amazonaws.com/512686554592/observer--end2end'}
+    client.get_queue_attributes.return_value = {'Attributes': {'QueueArn': 'arn:aws:sqs:us-east-1:512686554592:observer--end2end'}}
+    client.get_subscription_attributes.return_value = {'Attributes': {'RawMessageDelivery': 'true'}}
+    return client
+
 class TestBuildercoreBootstrap(base.BaseCase):
     def test_master_configuration(self):
         formulas = ['https://github.com/elifesciences/journal-formula', 'https://github.com/elifesciences/lax-formula']
@@ -33,18 +45,20 @@ pillar_roots:
 """
         self.assertEqual(master_configuration_yaml, expected_configuration)
 
-    def test_unsub_sqs(self):
+    def test_sqs_plan_unsubscribe(self):
         stackname = 'observer--end2end'
         with open(join(self.fixtures_dir, 'sns_subscriptions.json')) as fh:
             subs_fixture = json.load(fh)
-        with mock.patch('buildercore.core._all_sns_subscriptions', return_value=subs_fixture):
+        with mock.patch('buildercore.core._all_sns_subscriptions', return_value=subs_fixture), \
+             mock.patch('buildercore.core.boto_client', return_value=_aws_client()):
             old_context = {'sqs':{stackname: ['bus-articles--end2end', 'bus-metrics--end2end']}}
             with mock.patch('buildercore.context_handler.load_context', return_value=old_context):
                 # observer no longer wants to subscribe to metrics
                 new_context = dict(old_context)
                 del new_context['sqs'][stackname][1]
 
-                actual = bootstrap.unsub_sqs(stackname, new_context['sqs'], 'someregion', dry_run=True)
+                plan = bootstrap.sqs_plan(stackname, new_context['sqs'], 'someregion')
+                actual = ({stackname: plan[stackname]['unsubscribe']}, {stackname: plan[stackname]['permissions']})
                 expected = (
                     {
                         stackname: [{'Endpoint': 'arn:aws:sqs:us-east-1:512686554592:observer--end2end',
@@ -60,7 +74,7 @@ pillar_roots:
                 )
                 self.assertEqual(expected, actual)
 
-    def test_unsub_sqs_detect_multiple_subs(self):
+    def test_sqs_plan_detect_multiple_subs(self):
         "when multiple subscriptions to a single topic exist, unsusbscribe from them"
         stackname = 'observer--end2end'
         with open(join(self.fixtures_dir, 'sns_subscriptions.json')) as fh:
@@ -78,10 +92,12 @@ pillar_roots:
         #fixture.insert(0, multiple_sub_same_topic)
         fixture.append(multiple_sub_same_topic)
 
-        with mock.patch('buildercore.core._all_sns_subscriptions', return_value=fixture):
+        with mock.patch('buildercore.core._all_sns_subscriptions', return_value=fixture), \
+             mock.patch('buildercore.core.boto_client', return_value=_aws_client()):
             context = {'sqs': {stackname: ['bus-articles--end2end', 'bus-metrics--end2end']}}
             with mock.patch('buildercore.context_handler.load_context', return_value=context):
-                actual = bootstrap.unsub_sqs(stackname, context['sqs'], 'someregion', dry_run=True)
+                plan = bootstrap.sqs_plan(stackname, context['sqs'], 'someregion')
+                actual = ({stackname: plan[stackname]['unsubscribe']}, {stackname: plan[stackname]['permissions']})
                 expected_unsub_map = {
                     stackname: [
                         {'Endpoint': 'arn:aws:sqs:us-east-1:512686554592:observer--end2end',
@@ -95,6 +111,64 @@ pillar_roots:
                 expected = (expected_unsub_map, expected_perm_map)
                 assert expected == actual
 
+    @mock_aws
+    def test_apply_sqs_plan(self):
+        "subscriptions to topics no longer wanted are removed and new topics are subscribed to"
+        stackname = 'observer--end2end'
+        region = 'us-east-1'
+        sns = core.boto_client('sns', region)
+        sqs = core.boto_client('sqs', region)
+        queue_url = sqs.create_queue(QueueName=stackname)['QueueUrl']
+        queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+        metrics_arn = sns.create_topic(Name='bus-metrics--end2end')['TopicArn']
+        sns.subscribe(TopicArn=metrics_arn, Protocol='sqs', Endpoint=queue_arn)
+
+        context = {'sqs': {stackname: ['bus-articles--end2end']}}
+        with mock.patch('buildercore.context_handler.load_context', return_value=context):
+            plan = bootstrap.sqs_plan(stackname, context['sqs'], region)
+            self.assertEqual(['bus-metrics--end2end'], [sub['Topic'] for sub in plan[stackname]['unsubscribe']])
+            self.assertEqual(['bus-articles--end2end'], plan[stackname]['subscribe'])
+            bootstrap.apply_sqs_plan(stackname, plan, region)
+
+            # nothing left to do
+            plan = bootstrap.sqs_plan(stackname, context['sqs'], region)
+            self.assertFalse(bootstrap._sqs_queue_changed(plan[stackname]))
+
+        subscription_list = sns.list_subscriptions()['Subscriptions']
+        self.assertEqual(['bus-articles--end2end'], [sub['TopicArn'].split(':')[-1] for sub in subscription_list])
+        attributes = sns.get_subscription_attributes(SubscriptionArn=subscription_list[0]['SubscriptionArn'])['Attributes']
+        self.assertEqual('true', attributes['RawMessageDelivery'])
+        policy = json.loads(sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['Policy'])['Attributes']['Policy'])
+        self.assertEqual([subscription_list[0]['TopicArn']], [st['Condition']['StringLike']['aws:SourceArn'] for st in policy['Statement']])
+
+    @mock_aws
+    def test_apply_sqs_plan__repair(self):
+        "a queue that lost it's policy and a subscription without raw message delivery are repaired"
+        stackname = 'observer--end2end'
+        region = 'us-east-1'
+        sns = core.boto_client('sns', region)
+        sqs = core.boto_client('sqs', region)
+        queue_url = sqs.create_queue(QueueName=stackname)['QueueUrl']
+        queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+        articles_arn = sns.create_topic(Name='bus-articles--end2end')['TopicArn']
+        subscription_arn = sns.subscribe(TopicArn=articles_arn, Protocol='sqs', Endpoint=queue_arn)['SubscriptionArn']
+
+        context = {'sqs': {stackname: ['bus-articles--end2end']}}
+        with mock.patch('buildercore.context_handler.load_context', return_value=context):
+            plan = bootstrap.sqs_plan(stackname, context['sqs'], region)
+            self.assertEqual(([], []), (plan[stackname]['unsubscribe'], plan[stackname]['subscribe']))
+            self.assertTrue(plan[stackname]['update_policy'])
+            self.assertEqual([subscription_arn], [sub['SubscriptionArn'] for sub in plan[stackname]['raw_delivery']])
+            bootstrap.apply_sqs_plan(stackname, plan, region)
+
+            plan = bootstrap.sqs_plan(stackname, context['sqs'], region)
+            self.assertFalse(bootstrap._sqs_queue_changed(plan[stackname]))
+
+        attributes = sns.get_subscription_attributes(SubscriptionArn=subscription_arn)['Attributes']
+        self.assertEqual('true', attributes['RawMessageDelivery'])
+        policy = json.loads(sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['Policy'])['Attributes']['Policy'])
+        self.assertEqual([articles_arn], [st['Condition']['StringLike']['aws:SourceArn'] for st in policy['Statement']])
+
     def test_remove_topics_from_sqs_policy(self):
         original = {
             'Version': '2008-10-17',
@@ -153,3 +227,143 @@ pillar_roots:
 
         cleaned = bootstrap.remove_topics_from_sqs_policy(original, ['arn:aws:sns:us-east-1:512686554592:bus-articles--end2end'])
         self.assertIsNone(cleaned)
+
+    def test_put_cached_scripts(self):
+        "only scripts missing from the remote host are uploaded and present scripts are remembered"
+        highstate = bootstrap._remote_script_path('highstate.sh')
+        bootstrap_sh = bootstrap._remote_script_path('bootstrap.sh')
+        self.assertTrue(highstate.startswith(bootstrap.REMOTE_SCRIPT_DIR + '/highstate.sh-'))
+
+        remote_sudo = mock.Mock(side_effect=[{'stdout': [highstate]}, {'stdout': []}])
+        with mock.patch('buildercore.bootstrap.remote_sudo', remote_sudo), \
+             mock.patch('buildercore.bootstrap._put_temporary_script', return_value='/tmp/highstate.sh-1') as put, \
+             mock.patch('buildercore.command.env', return_value='1.2.3.4'), \
+             mock.patch.object(bootstrap, '_REMOTE_SCRIPTS', set()):
+            expected = {'highstate.sh': highstate, 'bootstrap.sh': bootstrap_sh}
+            self.assertEqual(expected, bootstrap.put_cached_scripts(['highstate.sh', 'bootstrap.sh']))
+            put.assert_called_once_with('highstate.sh')
+            replace_cmd = remote_sudo.call_args[0][0]
+            self.assertIn("mv /tmp/highstate.sh-1 %s" % highstate, replace_cmd)
+
+            # scripts are not checked for again on the same host
+            bootstrap.put_cached_scripts(['highstate.sh', 'bootstrap.sh'])
+            self.assertEqual(2, remote_sudo.call_count)
+
+    def test_run_scripts(self):
+        "scripts are run with a single remote command and their timings are parsed from the output"
+        remote_scripts = {'bootstrap.sh': '/opt/builder/scripts/bootstrap.sh-abc', 'highstate.sh': '/opt/builder/scripts/highstate.sh-def'}
+        stdout = ['...', 'builder-script-timing 0 0 1500', '...', 'builder-script-timing 1 0 250']
+        remote_sudo = mock.Mock(return_value={'stdout': stdout, 'return_code': 0})
+        with mock.patch('buildercore.bootstrap.put_cached_scripts', return_value=remote_scripts), \
+             mock.patch('buildercore.bootstrap.remote_sudo', remote_sudo):
+            script_list = [('bootstrap.sh', ['foo', 'bar'], {'grain_project': 'dummy1'}), ('highstate.sh', ['--no-dry-run'])]
+            self.assertEqual([0, 0], bootstrap.run_scripts(script_list))
+        remote_sudo.assert_called_once()
+        cmd = remote_sudo.call_args[0][0]
+        self.assertIn("grain_project=dummy1 /bin/bash /opt/builder/scripts/bootstrap.sh-abc 'foo' 'bar';", cmd)
+        self.assertIn("/bin/bash /opt/builder/scripts/highstate.sh-def '--no-dry-run';", cmd)
+
+    def test_run_scripts__failure(self):
+        "a failing script stops the scripts after it and raises an error"
+        remote_scripts = {'bootstrap.sh': '/opt/builder/scripts/bootstrap.sh-abc', 'highstate.sh': '/opt/builder/scripts/highstate.sh-def'}
+        stdout = ['builder-script-timing 0 2 1500']
+        with mock.patch('buildercore.bootstrap.put_cached_scripts', return_value=remote_scripts), \
+             mock.patch('buildercore.bootstrap.remote_sudo', return_value={'stdout': stdout, 'return_code': 2}), \
+             self.assertRaisesRegex(bootstrap.command.CommandError, "script bootstrap.sh failed with return code 2"):
+            bootstrap.run_scripts([('bootstrap.sh', []), ('highstate.sh', [])])
+
+    def test_run_scripts__resumed(self):
+        "scripts that finished before the connection was lost are not run again"
+        remote_scripts = {'bootstrap.sh': '/opt/builder/scripts/bootstrap.sh-abc', 'highstate.sh': '/opt/builder/scripts/highstate.sh-def'}
+        remote_sudo = mock.Mock(side_effect=[
+            bootstrap.command.NetworkError("connection lost"),
+            {'stdout': ['builder-script-timing 0 0 1500']},
+            {'stdout': ['builder-script-timing 1 0 250'], 'return_code': 0},
+        ])
+        with mock.patch('buildercore.bootstrap.put_cached_scripts', return_value=remote_scripts), \
+             mock.patch('buildercore.bootstrap.remote_sudo', remote_sudo):
+            self.assertEqual([0, 0], bootstrap.run_scripts([('bootstrap.sh', []), ('highstate.sh', [])]))
+        first_cmd, status_cmd, resumed_cmd = [call[0][0] for call in remote_sudo.call_args_list]
+        self.assertIn("bootstrap.sh-abc", first_cmd)
+        self.assertTrue(status_cmd.startswith("cat %s/builder-scripts-" % bootstrap.SCRIPT_STATUS_DIR))
+        self.assertNotIn("bootstrap.sh-abc", resumed_cmd)
+        self.assertIn("highstate.sh-def", resumed_cmd)
+
+    def test_run_scripts__concurrent(self):
+        "a list of scripts are run concurrently and their return codes are returned in order"
+        remote_scripts = {'update-masterless-formula.sh': '/opt/builder/scripts/update-masterless-formula.sh-abc', 'highstate.sh': '/opt/builder/scripts/highstate.sh-def'}
+        stdout = ['[bar-formula] ...', 'builder-script-timing 1 0 900', '[foo-formula] ...', 'builder-script-timing 0 0 1500', 'builder-script-timing 2 0 250']
+        remote_sudo = mock.Mock(return_value={'stdout': stdout, 'return_code': 0})
+        with mock.patch('buildercore.bootstrap.put_cached_scripts', return_value=remote_scripts), \
+             mock.patch('buildercore.bootstrap.remote_sudo', remote_sudo):
+            script_list = [
+                [('update-masterless-formula.sh', ['foo-formula', 'https://github.com/elifesciences/foo-formula', 'abc123']),
+                 ('update-masterless-formula.sh', ['bar-formula', 'https://github.com/elifesciences/bar-formula', 'def456'])],
+                ('highstate.sh', ['--no-dry-run']),
+            ]
+            self.assertEqual([0, 0, 0], bootstrap.run_scripts(script_list))
+        cmd = remote_sudo.call_args[0][0]
+        self.assertIn("sed -u 's/^/[foo-formula] /'", cmd)
+        self.assertIn("sed -u 's/^/[bar-formula] /'", cmd)
+        self.assertIn("wait $pid", cmd)
+
+def test_destroy():
+    "the resources of a stack are destroyed and then it's context"
+    with mock.patch('buildercore.context_handler.load_context', return_value={}), \
+         mock.patch('buildercore.terraform.destroy') as tf_destroy, \
+         mock.patch('buildercore.cloudformation.destroy') as cfn_destroy, \
+         mock.patch('buildercore.bootstrap.delete_dns') as delete_dns, \
+         mock.patch('buildercore.context_handler.delete_context') as delete_context:
+        bootstrap.destroy('dummy1--foo')
+    tf_destroy.assert_called_once_with('dummy1--foo', {})
+    cfn_destroy.assert_called_once_with('dummy1--foo', {})
+    delete_dns.assert_called_once_with('dummy1--foo')
+    delete_context.assert_called_once_with('dummy1--foo')
+
+def test_destroy__failure():
+    "the context of a stack is kept if any of it's resources couldn't be destroyed"
+    with mock.patch('buildercore.context_handler.load_context', return_value={}), \
+         mock.patch('buildercore.terraform.destroy') as tf_destroy, \
+         mock.patch('buildercore.cloudformation.destroy', side_effect=RuntimeError("stack cannot be deleted")), \
+         mock.patch('buildercore.bootstrap.delete_dns') as delete_dns, \
+         mock.patch('buildercore.context_handler.delete_context') as delete_context, \
+         pytest.raises(RuntimeError, match="stack cannot be deleted"):
+        bootstrap.destroy('dummy1--foo')
+    assert tf_destroy.called
+    assert delete_dns.called
+    assert not delete_context.called
+
+def test_destroy_many():
+    "a stack that fails to be destroyed doesn't stop the others"
+    error = RuntimeError("stack cannot be deleted")
+
+    def destroy(stackname):
+        if stackname == 'dummy1--bar':
+            raise error
+
+    with mock.patch('buildercore.bootstrap.destroy', side_effect=destroy) as destroy_mock:
+        results = bootstrap.destroy_many(['dummy1--foo', 'dummy1--bar', 'dummy1--baz'], concurrency=2)
+    assert destroy_mock.call_count == 3 # noqa: PLR2004
+    assert {stackname: err for stackname, (_, err) in results.items()} == {'dummy1--foo': None, 'dummy1--bar': error, 'dummy1--baz': None}
+
+def test_destroy_many__terraform(test_projects, datadir):
+    "stacks with Terraform resources can be destroyed concurrently, `terraform init` included"
+    stackname_list = ['project-with-fastly-minimal--%s' % env for env in ['foo', 'bar', 'baz']]
+    context_map = {stackname: cfngen.build_context('project-with-fastly-minimal', stackname=stackname) for stackname in stackname_list}
+    terraform_init = base.TerraformInit()
+    with mock.patch.object(config, 'TERRAFORM_DIR', datadir), \
+         mock.patch.object(config, 'TERRAFORM_PLUGIN_CACHE_PATH', join(datadir, 'plugin-cache')), \
+         mock.patch.dict(os.environ, {'TF_PLUGIN_CACHE_DIR': ''}), \
+         mock.patch('buildercore.terraform.Terraform') as terraform_class, \
+         mock.patch('buildercore.context_handler.load_context', side_effect=context_map.get), \
+         mock.patch('buildercore.cloudformation.destroy'), \
+         mock.patch('buildercore.bootstrap.delete_dns'), \
+         mock.patch('buildercore.context_handler.delete_context') as delete_context, \
+         base.fail_after(20):
+        terraform_class.return_value.init.side_effect = terraform_init
+        results = bootstrap.destroy_many(stackname_list)
+    assert {stackname: err for stackname, (_, err) in results.items()} == dict.fromkeys(stackname_list)
+    assert terraform_init.call_count == len(stackname_list)
+    assert not terraform_init.overlapped
+    assert terraform_class.return_value.destroy.call_count == len(stackname_list)
+    assert delete_context.call_count == len(stackname_list)
@@ -1,8 +1,10 @@
 import logging
+import os
+from unittest import mock
 
 import pytest
 
-from buildercore import cfngen, cloudformation, context_handler, core, utils
+from buildercore import cfngen, cloudformation, context_handler, core, project, utils
 
 from . import base
 
@@ -330,3 +332,90 @@ def test_instance_alias():
     ]
     for given, expected in cases:
         assert cfngen.instance_alias(given) == expected
+
+def test_render_combination_list(test_projects):
+    combination_list = cfngen.render_combination_list(['dummy2'])
+    alt_config_list = list(project.project_data('dummy2')['aws-alt'])
+    assert 'alt-config1' in alt_config_list
+    expected = [('dummy2', None)] + [('dummy2', alt_config) for alt_config in alt_config_list]
+    assert combination_list == expected
+
+def test_render_all(test_projects, tempdir):
+    result_list = cfngen.render_all(tempdir, ['dummy2', 'project-with-fastly-minimal'], max_workers=2)
+    expected = [core.mk_stackname(pname, alt_config or 'dummy') for pname, alt_config in
+                cfngen.render_combination_list(['dummy2', 'project-with-fastly-minimal'])]
+    assert [result['stackname'] for result in result_list] == expected
+    assert not [result for result in result_list if result['error']]
+    for result in result_list:
+        assert os.path.exists(result['cloudformation'])
+    assert result_list[0]['terraform'] is None
+    assert os.path.exists(result_list[-1]['terraform'])
+
+def test_render_all__serial(test_projects, tempdir):
+    expected = cfngen.render_all(tempdir, ['dummy2'], max_workers=2)
+    result_list = cfngen.render_all(tempdir, ['dummy2'], max_workers=1)
+    assert [result['stackname'] for result in result_list] == [result['stackname'] for result in expected]
+
+def test_render_all__failures(test_projects, tempdir):
+    "a failure to render one combination doesn't prevent the others from rendering."
+    def render_template(context):
+        if context['alt-config']:
+            msg = "bad alt-config"
+            raise ValueError(msg)
+        return "{}"
+    with mock.patch('buildercore.cloudformation.render_template', side_effect=render_template):
+        result_list = cfngen.render_all(tempdir, ['dummy2'], max_workers=2)
+    assert result_list[0]['error'] is None
+    assert 'ValueError: bad alt-config' in result_list[1]['error']
+
+def test_regenerate_stack__unchanged(test_projects):
+    "templates are not regenerated when the context's fingerprint matches."
+    stackname = 'dummy2--test'
+    context = cfngen.build_context('dummy2', stackname=stackname, **{'alt-config': 'alt-config1'})
+    context = cfngen.fingerprint_context(context)
+    with mock.patch('buildercore.context_handler.load_context', return_value=context), \
+         mock.patch('buildercore.cfngen.download_cloudformation_template'), \
+         mock.patch('buildercore.cfngen.template_delta') as template_delta:
+        new_context, delta, current_context = cfngen.regenerate_stack(stackname)
+        assert new_context == current_context == context
+        assert delta is None
+        assert not template_delta.called
+
+        # forced regeneration
+        new_context, delta, current_context = cfngen.regenerate_stack(stackname, force=True)
+        assert template_delta.called
+        assert context_handler.FINGERPRINT_KEY not in new_context
+        assert new_context['alt-config'] == 'alt-config1'
+
+def test_resource_diff():
+    old = {'Type': 'AWS::EC2::Instance', 'Properties': {'InstanceType': 't3.small', 'ImageId': 'ami-1'}}
+    new = {'Type': 'AWS::EC2::Instance', 'Properties': {'InstanceType': 't3.large', 'ImageId': 'ami-1', 'Tags': []}}
+    assert cfngen.resource_diff(old, new) == ['Properties.InstanceType', 'Properties.Tags']
+    assert cfngen.resource_diff(old, old) == []
+    assert cfngen.resource_diff({'Value': 'foo'}, {'Value': 'bar', 'Description': 'baz'}) == ['Description', 'Value']
+
+def test_cloudformation_delta():
+    "EC2 instances are updated without their immutable properties and the changes to each updated resource are listed."
+    old_template = {
+        'Resources': {
+            'EC2Instance1': {'Type': 'AWS::EC2::Instance', 'Properties': {'InstanceType': 't3.small', 'ImageId': 'ami-1', 'Tags': [], 'UserData': 'foo'}},
+            'StackSecurityGroup': {'Type': 'AWS::EC2::SecurityGroup', 'Properties': {'GroupDescription': 'foo'}},
+            'FooQueue': {'Type': 'AWS::SQS::Queue'},
+            'NotRemovable': {'Type': 'AWS::SQS::Queue'},
+        },
+        'Outputs': {'InstanceId1': {'Value': {'Ref': 'EC2Instance1'}}},
+    }
+    template = {
+        'Resources': {
+            'EC2Instance1': {'Type': 'AWS::EC2::Instance', 'Properties': {'InstanceType': 't3.large', 'ImageId': 'ami-2', 'Tags': [], 'UserData': 'bar'}},
+            'StackSecurityGroup': {'Type': 'AWS::EC2::SecurityGroup', 'Properties': {'GroupDescription': 'foo'}},
+            'BarQueue': {'Type': 'AWS::SQS::Queue'},
+        },
+        'Outputs': {'InstanceId1': {'Value': {'Ref': 'EC2Instance1'}}},
+    }
+    delta = cfngen.cloudformation_delta(old_template, template)
+    assert list(delta.plus['Resources']) == ['BarQueue']
+    assert list(delta.edit['Resources']) == ['EC2Instance1']
+    assert delta.edit['Resources']['EC2Instance1']['Properties']['ImageId'] == 'ami-1'
+    assert list(delta.minus['Resources']) == ['FooQueue']
+    assert delta.diff == {'Resources': {'EC2Instance1': ['Properties.InstanceType']}, 'Outputs': {}}
@@ -43,12 +43,38 @@ class StackInformation(base.BaseCase):
             ],
         }
         describe_stack.return_value = description
+        self.addCleanup(cloudformation.invalidate_outputs)
 
         self.assertEqual(
             cloudformation.read_output('dummy1--test', 'ElasticLoadBalancer'),
             'dummy1--t-ElasticL-19CB72BN8E36S'
         )
 
+    @patch('buildercore.cloudformation.core.describe_stack')
+    def test_outputs_cached(self, describe_stack):
+        "outputs are fetched once until invalidated, unless the stack is changing"
+        description = MagicMock()
+        description.meta.data = {
+            'StackStatus': 'UPDATE_IN_PROGRESS',
+            'Outputs': [{'OutputKey': 'ElasticLoadBalancer', 'OutputValue': 'dummy1--t-ElasticL-19CB72BN8E36S'}],
+        }
+        describe_stack.return_value = description
+        self.addCleanup(cloudformation.invalidate_outputs)
+
+        expected = {'ElasticLoadBalancer': 'dummy1--t-ElasticL-19CB72BN8E36S'}
+        self.assertEqual(expected, cloudformation.outputs_map('dummy1--test'))
+        self.assertEqual(expected, cloudformation.outputs_map('dummy1--test'))
+        self.assertEqual(2, describe_stack.call_count)
+
+        description.meta.data['StackStatus'] = 'UPDATE_COMPLETE'
+        cloudformation.outputs_map('dummy1--test')
+        self.assertEqual('dummy1--t-ElasticL-19CB72BN8E36S', cloudformation.read_output('dummy1--test', 'ElasticLoadBalancer'))
+        self.assertEqual(3, describe_stack.call_count)
+
+        cloudformation.invalidate_outputs('dummy1--test')
+        cloudformation.outputs_map('dummy1--test')
+        self.assertEqual(4, describe_stack.call_count)
+
 class StackUpdate(base.BaseCase):
     def test_no_updates(self):
         cloudformation.update_template('dummy1--test', cloudformation.CloudFormationDelta())
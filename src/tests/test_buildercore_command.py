@@ -0,0 +1,90 @@
+from unittest.mock import MagicMock, patch
+
+import pssh.clients.native
+import pytest
+import threadbare
+
+from buildercore import command, config
+
+
+def _connect(self, host, **kwargs):
+    "stands in for connecting and authenticating with `host`."
+    self.host = host
+    self.sock = MagicMock(closed=False)
+    self.session = MagicMock()
+
+@pytest.fixture(name='ssh_pool')
+def fixture_ssh_pool():
+    "an empty connection pool where connections are never actually made."
+    with patch.object(pssh.clients.native.SSHClient, '__init__', _connect), \
+         patch.object(pssh.clients.native.SSHClient, '_disconnect', autospec=True) as disconnect, \
+         patch.dict(command._SSH_POOL, clear=True):
+        yield disconnect
+
+def _closed(disconnect, client):
+    "returns `True` if `client` was disconnected. clients from other tests may be disconnected as they are garbage collected."
+    return any(call.args[0] is client for call in disconnect.call_args_list)
+
+def _ssh_client(host='1.2.3.4'):
+    "returns the ssh client threadbare would use for a remote operation within a `settings` context."
+    command.use_ssh_pool()
+    return threadbare.operations._ssh_client(host_string=host, user='elife', key_filename='/tmp/key', port=22)
+
+def test_ssh_pool(ssh_pool):
+    "connections are re-used across `settings` contexts"
+    with command.settings():
+        client = _ssh_client()
+        # threadbare's own client class is used, the pool is a hook in `command` and threadbare isn't patched.
+        assert type(client) is threadbare.operations.SSHClient
+        assert _ssh_client() is client
+        other_client = _ssh_client('5.6.7.8')
+        assert other_client is not client
+    with command.settings():
+        assert _ssh_client() is client
+        assert _ssh_client('5.6.7.8') is other_client
+    assert not _closed(ssh_pool, client)
+    assert not _closed(ssh_pool, other_client)
+
+def test_ssh_pool__in_use(ssh_pool):
+    "connections in use are not shared"
+    with command.settings():
+        client = _ssh_client()
+        with command.settings(ssh_client={}):
+            assert _ssh_client() is not client
+
+def test_ssh_pool__unhealthy(ssh_pool):
+    "closed or unresponsive connections are discarded"
+    with command.settings():
+        client = _ssh_client()
+        other_client = _ssh_client('5.6.7.8')
+    client.sock.closed = True
+    other_client.session.keepalive_send.side_effect = Exception("connection reset")
+    with command.settings():
+        assert _ssh_client() is not client
+        assert _ssh_client('5.6.7.8') is not other_client
+    assert _closed(ssh_pool, client)
+    assert _closed(ssh_pool, other_client)
+
+def test_ssh_pool__idle(ssh_pool):
+    "connections idle for too long are closed"
+    with command.settings():
+        client = _ssh_client()
+    with patch.object(config, 'SSH_POOL_IDLE_TIMEOUT', -1):
+        command.evict_idle_ssh_clients()
+    assert _closed(ssh_pool, client)
+    with command.settings():
+        assert _ssh_client() is not client
+
+def test_ssh_pool__forked(ssh_pool):
+    "connections are never shared with or closed by a forked process"
+    with command.settings():
+        client = _ssh_client()
+    with patch('os.getpid', return_value=-1):
+        with command.settings():
+            child_client = _ssh_client()
+            assert child_client is not client
+        command.close_ssh_pool()
+    assert _closed(ssh_pool, child_client)
+    assert not _closed(ssh_pool, client)
+    with command.settings():
+        assert _ssh_client() is client
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+from os.path import dirname, exists, join
+
+SRC_DIR = dirname(dirname(__file__))
+
+def test_import_has_no_side_effects(datadir):
+    "importing `buildercore.config` doesn't create any directories, the log file is created when it's first written to"
+    script = """
+import logging, os
+from buildercore import config
+print(sorted(os.listdir('.')))
+logging.getLogger('test').info('hello')
+"""
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=datadir, env=env, stderr=subprocess.DEVNULL)
+    assert output.decode().strip() == "[]"
+    assert exists(join(datadir, 'logs', 'app.log'))
@@ -1,4 +1,10 @@
+import json
+import os
+import shutil
 from os import remove
+from unittest import mock
+
+import pytest
 
 from buildercore import cfngen, context_handler
 
@@ -23,3 +29,74 @@ class TestBuildercoreContext(base.BaseCase):
     def _read_file(self, path):
         with open(path) as f:
             return f.read()
+
+def test_fingerprint(test_projects):
+    "a fingerprint survives the context being stored and loaded again and changes when it's inputs change."
+    context = cfngen.build_context('dummy1', stackname='dummy1--prod')
+    pdata = cfngen.context_project_data('dummy1')
+    context = context_handler.fingerprinted(pdata, context)
+    assert context_handler.fingerprint_matches(pdata, context)
+
+    stored_context = json.loads(json.dumps(context))
+    assert context_handler.fingerprint_matches(pdata, stored_context)
+
+    assert not context_handler.fingerprint_matches(pdata.assoc('description', 'foo'), stored_context)
+    assert not context_handler.fingerprint_matches(pdata, dict(stored_context, revision='foo'))
+    with mock.patch('buildercore.context_handler.code_fingerprint', return_value='foo'):
+        assert not context_handler.fingerprint_matches(pdata, stored_context)
+
+def test_code_fingerprint__template_files(tmp_path):
+    "the code fingerprint changes when a file used to render templates but that isn't Python changes."
+    buildercore_path = os.path.dirname(context_handler.__file__)
+    shutil.copytree(buildercore_path, tmp_path / 'buildercore', ignore=shutil.ignore_patterns('__pycache__'))
+    path = str(tmp_path / 'buildercore')
+    original = context_handler._directory_fingerprint(path)
+    assert context_handler._directory_fingerprint(path) == original
+
+    with open(tmp_path / 'buildercore' / 'fastly' / 'vcl' / 'gzip-by-content-type-suffix.vcl', 'a') as fh:
+        fh.write("# foo\n")
+    assert context_handler._directory_fingerprint(path) != original
+
+def test_fingerprint__missing(test_projects):
+    context = cfngen.build_context('dummy1', stackname='dummy1--prod')
+    pdata = cfngen.context_project_data('dummy1')
+    assert not context_handler.fingerprint_matches(pdata, context)
+
+def test_load_context__cached(datadir):
+    "a context is only downloaded if it has changed on S3 and is only revalidated once per process"
+    stackname = 'dummy1--prod'
+    calls = []
+
+    def download_if_changed(key, output_path, etag=None):
+        calls.append(etag)
+        if etag == '"abc"':
+            return etag, False
+        with open(output_path, 'w') as fh:
+            fh.write(json.dumps({'foo': 'bar'}))
+        return '"abc"', True
+
+    with mock.patch('buildercore.config.CONTEXT_DIR', datadir), \
+         mock.patch('buildercore.s3.download_if_changed', side_effect=download_if_changed), \
+         mock.patch.dict(context_handler._CONTEXTS, clear=True):
+        context = context_handler.load_context(stackname)
+        assert context == {'foo': 'bar'}
+        context['foo'] = 'baz' # contexts are copies
+        assert context_handler.load_context(stackname) == {'foo': 'bar'}
+        assert calls == [None]
+
+        # a new process revalidates the local copy using it's ETag
+        context_handler._CONTEXTS.clear()
+        assert context_handler.load_context(stackname) == {'foo': 'bar'}
+        assert calls == [None, '"abc"']
+
+        # a missing local copy is downloaded again
+        context_handler.delete_context_locally(stackname)
+        assert context_handler.load_context(stackname) == {'foo': 'bar'}
+        assert calls == [None, '"abc"', None]
+
+def test_load_context__missing(datadir):
+    with mock.patch('buildercore.config.CONTEXT_DIR', datadir), \
+         mock.patch('buildercore.s3.download_if_changed', return_value=(None, False)), \
+         mock.patch.dict(context_handler._CONTEXTS, clear=True), \
+         pytest.raises(context_handler.MissingContextFileError):
+        context_handler.load_context('dummy1--prod')
@@ -1,4 +1,6 @@
 import json
+import time
+from datetime import datetime, timezone
 from functools import partial
 from os.path import join
 from unittest import skip
@@ -349,3 +351,216 @@ def test_stack_all_ec2_nodes__network_retry_logic(_):
             assert "foo" == "bar" # noqa: PLR0133
         assert last_exc.value == expected_exc
         assert retried == expected
+
+@mock_aws
+def test_ec2_inventory(test_projects):
+    "all ec2 instances in a region are fetched once and indexed by stackname."
+    core.invalidate_ec2_inventory()
+    foo_1 = base.run_ec2_instance('dummy1--foo', 1)
+    foo_2 = base.run_ec2_instance('dummy1--foo', 2)
+    bar_1 = base.run_ec2_instance('dummy1--bar', 1)
+    untagged = base.run_ec2_instance()
+
+    ec2_list, index = core.ec2_inventory('us-east-1')
+    assert sorted(ec2.id for ec2 in ec2_list) == sorted([foo_1, foo_2, bar_1, untagged])
+    assert sorted(index.keys()) == ['dummy1--bar', 'dummy1--foo']
+    assert sorted(ec2.id for ec2 in index['dummy1--foo']) == sorted([foo_1, foo_2])
+
+    # the inventory is re-used until it expires or is refreshed
+    baz_1 = base.run_ec2_instance('dummy1--baz', 1)
+    _, index = core.ec2_inventory('us-east-1')
+    assert 'dummy1--baz' not in index
+    _, index = core.ec2_inventory('us-east-1', refresh=True)
+    assert [ec2.id for ec2 in index['dummy1--baz']] == [baz_1]
+
+    with patch('buildercore.config.EC2_INVENTORY_TTL', 0):
+        _, index = core.ec2_inventory('us-east-1')
+        assert len(index) == 3 # noqa: PLR2004
+
+@mock_aws
+def test_find_ec2_instances__inventory(test_projects):
+    "a stack's ec2 instances are served from a region inventory until the inventory is invalidated."
+    core.invalidate_ec2_inventory()
+    foo_1 = base.run_ec2_instance('dummy1--foo', 1)
+    core.ec2_inventory('us-east-1')
+
+    foo_2 = base.run_ec2_instance('dummy1--foo', 2)
+    with patch('buildercore.core.boto_resource') as boto_resource:
+        assert [ec2.id for ec2 in core.find_ec2_instances('dummy1--foo')] == [foo_1]
+        assert not boto_resource.called
+
+    core.invalidate_ec2_inventory('dummy1--foo')
+    assert [ec2.id for ec2 in core.find_ec2_instances('dummy1--foo')] == [foo_1, foo_2]
+    assert [ec2.id for ec2 in core.find_ec2_instances('dummy1--foo', node_ids=[foo_2])] == [foo_2]
+
+    # without a region inventory, just the stack's instances are fetched and re-used.
+    core.invalidate_ec2_inventory()
+    assert core.find_ec2_instances('dummy1--bar', allow_empty=True) == []
+    base.run_ec2_instance('dummy1--bar', 1)
+    assert core.find_ec2_instances('dummy1--bar', allow_empty=True) == []
+    assert core._EC2_INVENTORY == {}
+
+def test_parse_rolling_concurrency():
+    cases = [
+        ('serial', None),
+        ('parallel', None),
+        (None, None),
+        ('rollingfoo', None),
+
+        ('rolling', ('25%', 0)),
+        ('rolling:', ('25%', 0)),
+        ('rolling:3', ('3', 0)),
+        ('rolling:10%', ('10%', 0)),
+        ('rolling:3:1', ('3', 1)),
+        ('rolling::2', ('25%', 2)),
+    ]
+    for given, expected in cases:
+        assert core.parse_rolling_concurrency(given) == expected, given
+
+def test_parse_rolling_concurrency__bad_cases():
+    cases = ['rolling:0', 'rolling:-1', 'rolling:foo', 'rolling:0%', 'rolling:101%', 'rolling:3:-1', 'rolling:3:foo', 'rolling:3:1:1']
+    for given in cases:
+        with pytest.raises(ValueError):
+            core.parse_rolling_concurrency(given)
+
+def test_rolling_window_size():
+    cases = [
+        ('1', 10, 1),
+        ('3', 10, 3),
+        ('25%', 10, 3),
+        ('25%', 2, 1),
+        ('10%', 1, 1),
+        ('100%', 10, 10),
+    ]
+    for window, num_nodes, expected in cases:
+        assert core.rolling_window_size(window, num_nodes) == expected
+
+def _rolling_params(num_nodes):
+    return {
+        'stackname': 'foo--bar',
+        'nodes': {'i-%s' % node: node for node in range(num_nodes, 0, -1)},
+        'public_ips': {'i-%s' % node: '10.0.0.%s' % node for node in range(num_nodes, 0, -1)},
+    }
+
+def test_rolling_work():
+    "nodes are worked on a window at a time, in node order"
+    batches = []
+
+    def execute(_, hosts, raise_unhandled_errors):
+        batches.append(hosts)
+        return dict.fromkeys(hosts, 'ok')
+
+    with patch('buildercore.core.command.execute', side_effect=execute):
+        results = core.rolling_work(Mock(), _rolling_params(5), '2')
+    assert batches == [['10.0.0.1', '10.0.0.2'], ['10.0.0.3', '10.0.0.4'], ['10.0.0.5']]
+    assert results == {'10.0.0.%s' % node: 'ok' for node in range(1, 6)}
+
+def test_rolling_work__fail_fast():
+    "work stops once more than the tolerated number of nodes have failed"
+    exc = ConnectionRefusedError("foo")
+    batches = []
+
+    def execute(_, hosts, raise_unhandled_errors):
+        batches.append(hosts)
+        return {host: exc if host in ['10.0.0.1', '10.0.0.3'] else 'ok' for host in hosts}
+
+    with patch('buildercore.core.command.execute', side_effect=execute), pytest.raises(ConnectionRefusedError):
+        core.rolling_work(Mock(), _rolling_params(5), '1', max_failures=1)
+    assert batches == [['10.0.0.1'], ['10.0.0.2'], ['10.0.0.3']]
+
+    # all nodes are worked on when failures are tolerated but the failure is still raised.
+    batches = []
+    with patch('buildercore.core.command.execute', side_effect=execute), pytest.raises(ConnectionRefusedError):
+        core.rolling_work(Mock(), _rolling_params(5), '1', max_failures=2)
+    assert len(batches) == 5 # noqa: PLR2004
+
+@pytest.fixture(name='cfn')
+def fixture_cfn(datadir):
+    """a stand-in CloudFormation client with stacks in `cfn.stacks` and an empty stack index, in memory and on disk.
+    deleted stacks are removed from `cfn.stacks` rather than given a 'DELETE_COMPLETE' status."""
+    conn = Mock(stacks={})
+
+    def list_stacks(**kwargs):
+        return [{'StackSummaries': [stack for stack in conn.stacks.values() if stack['StackStatus'] in kwargs['StackStatusFilter']]}]
+
+    def describe_stacks(**kwargs):
+        stackname = kwargs['StackName']
+        if stackname not in conn.stacks:
+            raise botocore.exceptions.ClientError({'Error': {'Message': 'Stack with id %s does not exist' % stackname}}, 'DescribeStacks')
+        return {'Stacks': [conn.stacks[stackname]]}
+
+    conn.get_paginator.return_value.paginate.side_effect = list_stacks
+    conn.describe_stacks.side_effect = describe_stacks
+    with patch('buildercore.config.STACK_INDEX_PATH', datadir), \
+         patch.dict(core._STACK_INDEX, clear=True), \
+         patch('buildercore.core.boto_client', return_value=conn):
+        yield conn
+
+def _add_stacks(cfn, stackname_list, status='CREATE_COMPLETE'):
+    for stackname in stackname_list:
+        cfn.stacks[stackname] = {'StackName': stackname, 'StackStatus': status, 'CreationTime': datetime(2026, 1, 1, tzinfo=timezone.utc)}
+
+def test_find_stacks(test_projects, cfn):
+    "stacks can be found by project, environment and status"
+    _add_stacks(cfn, ['dummy1--foo', 'dummy2--foo', 'not-a-builder-stack'])
+    _add_stacks(cfn, ['dummy1--bar'], status='UPDATE_IN_PROGRESS')
+
+    def names(stack_list):
+        return [stack['StackName'] for stack in stack_list]
+    assert names(core.find_stacks('us-east-1')) == ['dummy1--bar', 'dummy1--foo', 'dummy2--foo', 'not-a-builder-stack']
+    assert names(core.find_stacks('us-east-1', pname='dummy1')) == ['dummy1--bar', 'dummy1--foo']
+    assert names(core.find_stacks('us-east-1', env='foo')) == ['dummy1--foo', 'dummy2--foo']
+    assert names(core.find_stacks('us-east-1', status=['UPDATE_IN_PROGRESS'])) == ['dummy1--bar']
+    assert core.active_stack_names('us-east-1') == ['dummy1--foo', 'dummy2--foo']
+    assert cfn.get_paginator.call_count == 1
+
+def test_stack_index__ttl(test_projects, cfn):
+    "the stack index is re-used by other processes until it expires"
+    _add_stacks(cfn, ['dummy1--foo'])
+    core.stack_index('us-east-1')
+    core._STACK_INDEX.clear()
+    assert core.stack_index('us-east-1')['dummy1--foo']['CreationTime'] == '2026-01-01T00:00:00+00:00'
+    assert cfn.get_paginator.call_count == 1
+    with patch('buildercore.config.STACK_INDEX_TTL', -1):
+        core.stack_index('us-east-1')
+    assert cfn.get_paginator.call_count == 2 # noqa: PLR2004
+
+def test_invalidate_stack_index(test_projects, cfn):
+    "stacks changed by builder are described again without listing every stack"
+    _add_stacks(cfn, ['dummy1--foo', 'dummy2--foo'])
+    assert list(core.stack_index('us-east-1')) == ['dummy1--foo', 'dummy2--foo']
+    del cfn.stacks['dummy1--foo']
+    _add_stacks(cfn, ['dummy2--foo'], status='UPDATE_IN_PROGRESS')
+    assert list(core.stack_index('us-east-1')) == ['dummy1--foo', 'dummy2--foo']
+
+    core.invalidate_stack_index('dummy1--foo')
+    core.invalidate_stack_index('dummy2--foo')
+    core._STACK_INDEX.clear() # the invalidated index is read from disk
+    assert list(core.stack_index('us-east-1')) == ['dummy2--foo']
+    assert cfn.describe_stacks.call_count == 2 # noqa: PLR2004
+
+    # stacks that are still changing are described each time
+    _add_stacks(cfn, ['dummy2--foo'], status='UPDATE_COMPLETE')
+    assert core.stack_index('us-east-1')['dummy2--foo']['StackStatus'] == 'UPDATE_COMPLETE'
+    assert core.stack_index('us-east-1')['dummy2--foo']['StackStatus'] == 'UPDATE_COMPLETE'
+    assert cfn.describe_stacks.call_count == 3 # noqa: PLR2004
+    assert cfn.get_paginator.call_count == 1
+
+def test_invalidate_stack_index__concurrent(test_projects, cfn):
+    "stacks marked by other threads and other builder processes are not lost when the index is written"
+    _add_stacks(cfn, ['dummy1--foo', 'dummy2--foo'])
+    core.stack_index('us-east-1')
+
+    # another process marks a stack in it's own copy of the index and writes it to disk.
+    other_index = core._read_stack_index('us-east-1')
+    other_index['dirty']['dummy2--foo'] = time.time()
+    core._write_stack_index('us-east-1', other_index)
+
+    stackname_list = ['dummy1--foo'] + ['dummy1--bar%s' % i for i in range(10)]
+    utils.concurrently(core.invalidate_stack_index, stackname_list, max_workers=4)
+    assert sorted(core._read_stack_index('us-east-1')['dirty']) == sorted(stackname_list + ['dummy2--foo'])
+
+    _add_stacks(cfn, ['dummy1--foo'], status='UPDATE_COMPLETE')
+    assert core.stack_index('us-east-1')['dummy1--foo']['StackStatus'] == 'UPDATE_COMPLETE'
+    assert core._read_stack_index('us-east-1')['dirty'] == {}
+    assert cfn.get_paginator.call_count == 1
@@ -1,6 +1,7 @@
 from datetime import datetime
 from unittest.mock import MagicMock, patch
 
+import pytest
 from moto import mock_aws
 from pytz import utc
 
@@ -248,3 +249,57 @@ def test_get_dns_a_record():
     expected = (zone_id, expected_name, expected_record)
     result = lifecycle._get_dns_a_record(zone_name, name)
     assert result == expected
+
+@mock_aws
+@patch('buildercore.lifecycle.time.sleep')
+def test_wait_for_ec2_states(sleep, test_projects):
+    "the states of many stacks are polled together and polling returns once they are all in the expected state."
+    foo_1 = base.run_ec2_instance('dummy1--foo')
+    bar_1 = base.run_ec2_instance('dummy1--bar')
+    with patch('buildercore.lifecycle._ec2_instance_states', wraps=lifecycle._ec2_instance_states) as states:
+        lifecycle.wait_for_ec2_states('us-east-1', {'dummy1--foo': [foo_1], 'dummy1--bar': [bar_1], 'dummy1--baz': []}, 'running')
+        states.assert_called_once_with('us-east-1', sorted([foo_1, bar_1]))
+    assert not sleep.called
+
+@mock_aws
+@patch('buildercore.lifecycle.time.sleep')
+def test_wait_for_ec2_states__backoff(sleep, test_projects):
+    "the polling interval backs off while nothing changes and the wait times out."
+    foo_1 = base.run_ec2_instance('dummy1--foo')
+    with pytest.raises(lifecycle.EC2TimeoutError):
+        lifecycle.wait_for_ec2_states('us-east-1', {'dummy1--foo': [foo_1]}, 'stopped', timeout=60)
+    assert [c.args[0] for c in sleep.call_args_list] == [4, 8, 16, 30, 30]
+
+@mock_aws
+@patch('buildercore.lifecycle.time.sleep')
+def test_start_many(sleep, test_projects):
+    "the ec2 nodes of many stacks are started together."
+    core.invalidate_ec2_inventory()
+    instance_ids = [base.run_ec2_instance('dummy1--foo', 1), base.run_ec2_instance('dummy1--foo', 2), base.run_ec2_instance('dummy1--bar')]
+    conn = core.boto_client('ec2', 'us-east-1')
+    conn.stop_instances(InstanceIds=instance_ids)
+
+    lifecycle.start_many(['dummy1--foo', 'dummy1--bar'])
+    expected = dict.fromkeys(instance_ids, 'running')
+    assert lifecycle._ec2_instance_states('us-east-1', instance_ids) == expected
+
+@mock_aws
+@patch('buildercore.lifecycle.time.sleep')
+def test_start_many__unsupported_states(sleep, test_projects):
+    "a stack with nodes that can't be started is skipped and the others are still started."
+    core.invalidate_ec2_inventory()
+    foo_1 = base.run_ec2_instance('dummy1--foo')
+    baz_1 = base.run_ec2_instance('dummy1--baz')
+    conn = core.boto_client('ec2', 'us-east-1')
+    conn.stop_instances(InstanceIds=[foo_1, baz_1])
+
+    _ec2_nodes_states = lifecycle._ec2_nodes_states
+
+    def ec2_nodes_states(stackname):
+        if stackname == 'dummy1--baz':
+            return {baz_1: 'shutting-down'}
+        return _ec2_nodes_states(stackname)
+
+    with patch('buildercore.lifecycle._ec2_nodes_states', side_effect=ec2_nodes_states):
+        lifecycle.start_many(['dummy1--baz', 'dummy1--foo'])
+    assert lifecycle._ec2_instance_states('us-east-1', [foo_1, baz_1]) == {foo_1: 'running', baz_1: 'stopped'}
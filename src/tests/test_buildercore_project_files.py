@@ -1,6 +1,11 @@
+import os
 from collections import OrderedDict
 from os.path import join
+from unittest import mock
 
+import pytest
+
+from buildercore import config, project, utils
 from buildercore.project import files
 
 from . import base
@@ -37,3 +42,86 @@ class TestFiles(base.BaseCase):
             ),
             {'1804': {'ec2': {'ami': 'ami-22222222'}}},
         )
+
+
+def test_cache_key(datadir):
+    "the cache key changes when the contents of a project file change"
+    path = base.copy_fixture('projects/dummy-project.yaml', datadir)
+    key = files.cache_key([path])
+    assert key == files.cache_key([path])
+    with open(path, 'a') as fh:
+        fh.write("\n# a comment\n")
+    assert key != files.cache_key([path])
+
+def test_cache_key__sources(datadir):
+    "the cache key changes when the code that parses project files changes"
+    path = base.copy_fixture('projects/dummy-project.yaml', datadir)
+    with mock.patch('builtins.open', wraps=open) as open_mock:
+        files.cache_key([path])
+    read_list = [os.path.realpath(c.args[0]) for c in open_mock.call_args_list]
+    for module in [files, project, utils]:
+        assert os.path.realpath(module.__file__) in read_list
+
+def test_read_write_cache(datadir):
+    "project data written to the cache can be read back"
+    with mock.patch.object(config, 'PROJECT_CACHE_PATH', datadir):
+        assert files.read_cache('foo') is None
+        files.write_cache('foo', {'bar': {'baz': 1}})
+        assert files.read_cache('foo') == {'bar': {'baz': 1}}
+
+def test_read_cache__bad_data(datadir):
+    "an unreadable cache file is ignored"
+    with mock.patch.object(config, 'PROJECT_CACHE_PATH', datadir):
+        with open(join(datadir, 'foo.pickle'), 'w') as fh:
+            fh.write("not a pickle")
+        assert files.read_cache('foo') is None
+
+def test_write_cache__pruned(datadir):
+    "only the most recent `CACHE_SIZE` project maps are kept"
+    cache_size = 2
+    with mock.patch.object(config, 'PROJECT_CACHE_PATH', datadir), \
+         mock.patch.object(files, 'CACHE_SIZE', cache_size):
+        for key in ['foo', 'bar', 'baz']:
+            files.write_cache(key, {})
+        assert len(os.listdir(datadir)) == cache_size
+
+def test_project_map__cached(datadir):
+    "the expanded project map is read from the disk cache when available"
+    path = base.fixture_path('projects/dummy-project.yaml')
+    with mock.patch.object(config, 'PROJECT_CACHE_PATH', datadir):
+        project._project_map.cache_clear()
+        expected = project._project_map([path])
+        project._project_map.cache_clear()
+        with mock.patch('buildercore.project.files.projects_from_file') as mock_fn:
+            assert project._project_map([path]) == expected
+        assert not mock_fn.called
+    project._project_map.cache_clear()
+
+def test_project_map__lazy():
+    "projects are only expanded when accessed, and only once"
+    path = base.fixture_path('projects/dummy-project.yaml')
+    expected = files.project_data('dummy1', path)
+    pmap = files.projects_from_file(path)[path]
+    with mock.patch('buildercore.project.files.expand_project', wraps=files.expand_project) as mock_fn:
+        assert 'dummy1' in pmap
+        assert not mock_fn.called
+        assert pmap['dummy1'] == expected
+        assert pmap['dummy1'] == expected
+        mock_fn.assert_called_once()
+
+def test_project_map__frozen():
+    "project data returned from a `ProjectMap` is shared and can't be modified"
+    path = base.fixture_path('projects/dummy-project.yaml')
+    pmap = files.projects_from_file(path)[path]
+    assert pmap['dummy1'] is pmap['dummy1']
+    with pytest.raises(utils.FrozenError):
+        pmap['dummy1']['aws']['region'] = 'foo'
+
+def test_project_map__merge():
+    "projects in the second map replace projects in the first"
+    defaults = {'aws': {}, 'gcp': {}}
+    pmap1 = files.ProjectMap({'foo': (defaults, {'a': 1}), 'bar': (defaults, {'b': 1})})
+    pmap2 = files.ProjectMap({'bar': (defaults, {'b': 2})})
+    merged = pmap1.merge(pmap2)
+    assert list(merged.keys()) == ['foo', 'bar']
+    assert merged['bar'] == pmap2['bar']
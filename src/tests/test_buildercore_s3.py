@@ -1,7 +1,12 @@
 """Tests concerning S3 interaction."""
 import os
+from unittest.mock import patch
 
-from buildercore import s3, utils
+import boto3
+import pytest
+from moto import mock_aws
+
+from buildercore import config, s3, utils
 
 from . import base
 
@@ -65,3 +70,71 @@ class TestReadWrite(base.BaseCase):
         self.assertTrue(os.path.exists(expected_output))
         with open(expected_output) as fh:
             self.assertEqual(fh.read(), expected_contents)
+
+@mock_aws
+def test_download_if_changed(datadir):
+    "objects are only downloaded if their ETag has changed"
+    resource = boto3.resource('s3', region_name='us-east-1')
+    bucket = resource.create_bucket(Bucket='builder-bucket')
+    bucket.Object('foo.json').put(Body=b'{"foo": "bar"}')
+    output_path = os.path.join(datadir, 'foo.json')
+    with patch('buildercore.s3.builder_bucket', return_value=bucket):
+        etag, downloaded = s3.download_if_changed('foo.json', output_path)
+        assert downloaded
+        with open(output_path) as fh:
+            assert fh.read() == '{"foo": "bar"}'
+
+        assert s3.download_if_changed('foo.json', output_path, etag) == (etag, False)
+
+        bucket.Object('foo.json').put(Body=b'{"foo": "baz"}')
+        new_etag, downloaded = s3.download_if_changed('foo.json', output_path, etag)
+        assert downloaded and new_etag != etag
+
+        assert s3.download_if_changed('bar.json', output_path) == (None, False)
+
+@pytest.fixture(name='bucket')
+def fixture_bucket():
+    "an empty builder bucket in a local stand-in for S3."
+    with mock_aws():
+        bucket = boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='builder-bucket')
+        with patch('buildercore.s3.builder_bucket', return_value=bucket):
+            yield bucket
+
+@mock_aws
+def test_builder_bucket():
+    "the builder bucket is found without listing every bucket"
+    with patch.object(config, 'BUILDER_BUCKET', 'builder-bucket'), \
+         patch.object(config, 'BUILDER_REGION', 'us-east-1'):
+        try:
+            s3.builder_bucket.cache_clear()
+            with pytest.raises(AssertionError):
+                s3.builder_bucket()
+            boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='builder-bucket')
+            assert s3.builder_bucket().name == 'builder-bucket'
+        finally:
+            s3.builder_bucket.cache_clear()
+
+def test_write__conditional(bucket):
+    "keys are only overwritten when asked to, without checking if the key exists first"
+    s3.write('test/foo', 'asdf')
+    with pytest.raises(KeyError):
+        s3.write('test/foo', 'fdsa')
+    assert bucket.Object('test/foo').get()['Body'].read() == b'asdf'
+    s3.write('test/foo', 'fdsa', overwrite=True)
+    assert bucket.Object('test/foo').get()['Body'].read() == b'fdsa'
+
+def test_delete_contents(bucket):
+    "keys are deleted in batches"
+    for i in range(5):
+        s3.write('test/foo/%s' % i, 'asdf')
+    s3.write('test/bar', 'asdf')
+    with patch.object(s3, 'DELETE_BATCH_SIZE', 2):
+        s3.delete_contents('test/foo/')
+    assert s3.simple_listing('test/') == ['test/bar']
+
+def test_delete_objects__protected(bucket):
+    "keys with a protected prefix are never deleted"
+    s3.write('private/foo', 'asdf')
+    with pytest.raises(ValueError, match="protected prefix"):
+        s3.delete_objects(['test/bar', 'private/foo'])
+    assert s3.simple_listing('private/') == ['private/foo']
@@ -1,6 +1,9 @@
+import fcntl
 import json
 import os
 import re
+import threading
+import time
 from collections import OrderedDict
 from os.path import join
 from unittest import TestCase
@@ -211,10 +214,16 @@ class TestBuildercoreTerraform(base.BaseCase):
         self.environment = base.generate_environment_name()
         self.temp_dir, self.rm_temp_dir = utils.tempdir()
         self.reset_terraform_dir = base.set_config('TERRAFORM_DIR', self.temp_dir)
+        self.plugin_cache_dir = join(self.temp_dir, 'plugin-cache')
+        self.reset_plugin_cache_dir = base.set_config('TERRAFORM_PLUGIN_CACHE_PATH', self.plugin_cache_dir)
+        self.environ = patch.dict(os.environ, {'TF_PLUGIN_CACHE_DIR': ''})
+        self.environ.start()
 
     def tearDown(self):
         self.reset_author()
         self.reset_terraform_dir()
+        self.reset_plugin_cache_dir()
+        self.environ.stop()
         self.rm_temp_dir()
 
     # --- utils
@@ -308,6 +317,66 @@ class TestBuildercoreTerraform(base.BaseCase):
         }
         self.assertEqual(self._load_terraform_file(stackname, 'backend'), expected_backend)
 
+    @patch('buildercore.terraform.Terraform')
+    def test_init_reused(self, Terraform): # noqa: N803
+        "`terraform init` is only run again when the files it depends on change"
+        terraform_binary = MagicMock()
+        Terraform.return_value = terraform_binary
+        stackname = 'project-with-fastly-minimal--%s' % self.environment
+        context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
+        terraform.init(stackname, context)
+        # the plugin cache is only given to Terraform, the environment of the process is left alone.
+        self.assertEqual(Terraform.call_args.kwargs['environ'], {'TF_PLUGIN_CACHE_DIR': self.plugin_cache_dir})
+        self.assertEqual(os.environ['TF_PLUGIN_CACHE_DIR'], '')
+        self.assertTrue(os.path.isdir(self.plugin_cache_dir))
+
+        # `terraform init` would create this directory.
+        os.mkdir(join(self.temp_dir, stackname, '.terraform'))
+        terraform.init(stackname, context)
+        terraform.init(stackname, context)
+        terraform_binary.init.assert_called_once()
+
+        context['terraform']['version'] = '1.0.0'
+        terraform.init(stackname, context)
+        self.assertEqual(terraform_binary.init.call_count, 2)
+
+    def test_terraform_environ(self):
+        "Terraform commands are run with the given variables added to the environment"
+        terraform_binary = terraform.Terraform(terraform_bin_path='/bin/terraform', environ={'TF_PLUGIN_CACHE_DIR': '/tmp/cache'})
+        expected = ['env', 'TF_PLUGIN_CACHE_DIR=/tmp/cache', '/bin/terraform', 'init', '-input=false']
+        self.assertEqual(terraform_binary.generate_cmd_string('init', input=False), expected)
+
+    @patch('buildercore.terraform.Terraform')
+    def test_init_concurrently(self, Terraform): # noqa: N803
+        "`terraform init` is run for one stack at a time when stacks are initialised concurrently"
+        terraform_init = base.TerraformInit()
+        Terraform.return_value.init.side_effect = terraform_init
+        context_list = []
+        for name in ['foo', 'bar']:
+            stackname = 'project-with-fastly-minimal--%s-%s' % (self.environment, name)
+            context_list.append((stackname, cfngen.build_context('project-with-fastly-minimal', stackname=stackname)))
+        with base.fail_after(10):
+            utils.concurrently(lambda args: terraform.init(*args), context_list)
+        self.assertEqual(terraform_init.call_count, 2)
+        self.assertFalse(terraform_init.overlapped)
+
+    @patch('buildercore.terraform.PLUGIN_CACHE_LOCK_INTERVAL', 0.01)
+    @patch('buildercore.terraform.Terraform')
+    def test_init_waits_for_plugin_cache(self, Terraform): # noqa: N803
+        "`terraform init` waits for another process using the plugin cache to finish"
+        stackname = 'project-with-fastly-minimal--%s' % self.environment
+        context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
+        lock_file = join(utils.mkdir_p(self.plugin_cache_dir), terraform.PLUGIN_CACHE_LOCK_FILE)
+        with base.fail_after(10), open(lock_file, 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            thread = threading.Thread(target=terraform.init, args=(stackname, context))
+            thread.start()
+            time.sleep(0.1)
+            Terraform.return_value.init.assert_not_called()
+            fcntl.flock(fp, fcntl.LOCK_UN)
+            thread.join()
+        Terraform.return_value.init.assert_called_once()
+
     @patch('buildercore.terraform.Terraform')
     def test_fastly_provider_reads_api_key_from_vault(self, Terraform): # noqa: N803
         terraform_binary = MagicMock()
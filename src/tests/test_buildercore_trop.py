@@ -1297,6 +1297,9 @@ class TestOverriddenComponent(unittest.TestCase):
             },
             trop.overridden_component(context, 'ec2', 2, ['ext'])
         )
+        # the given context is not modified
+        self.assertEqual(100, context['ec2']['overrides'][2]['ext']['size'])
+        self.assertEqual(30, context['ec2']['ext']['size'])
 
     def test_rds_deletion_policy_snapshot(self):
         "default rds deletion policy is 'Snapshot'"
@@ -1443,3 +1446,34 @@ class TestIngress(base.BaseCase):
                 },
             ]
         )
+
+
+class TestRendererOrder(unittest.TestCase):
+    def _renderer(self, name, depends_on=None):
+        return trop.Renderer(name, name, None, depends_on or {})
+
+    def test_order_preserved(self):
+        renderer_list = [self._renderer('a'), self._renderer('b'), self._renderer('c')]
+        self.assertEqual(renderer_list, trop.renderer_order(renderer_list))
+
+    def test_dependencies_first(self):
+        a = self._renderer('a', {'c_result': 'c'})
+        b = self._renderer('b')
+        c = self._renderer('c', {'b_result': 'b'})
+        self.assertEqual([b, c, a], trop.renderer_order([a, b, c]))
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(AssertionError):
+            trop.renderer_order([self._renderer('a', {'b_result': 'b'})])
+
+    def test_circular_dependency(self):
+        a = self._renderer('a', {'b_result': 'b'})
+        b = self._renderer('b', {'a_result': 'a'})
+        with self.assertRaises(AssertionError):
+            trop.renderer_order([a, b])
+
+    def test_renderer_list(self):
+        "renderers that depend on the ec2 renderer are always called after it."
+        ordered = [renderer.name for renderer in trop.renderer_order(trop.RENDERER_LIST)]
+        self.assertEqual('ec2', ordered[0])
+        self.assertEqual(len(trop.RENDERER_LIST), len(ordered))
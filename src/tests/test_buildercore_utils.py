@@ -428,3 +428,45 @@ def test_lookup__bad_values():
     for context, path in cases:
         with pytest.raises(ValueError):
             utils.lookup(context, path, None)
+
+def test_freeze():
+    "frozen data is equal to the data given but can't be modified"
+    given = {'a': [1, {'b': 2}], 'c': OrderedDict([('d', 3)])}
+    frozen = utils.freeze(given)
+    assert frozen == given
+    assert isinstance(frozen['c'], OrderedDict)
+    modifications = [
+        lambda: frozen.update({'a': 1}),
+        lambda: frozen.pop('a'),
+        lambda: frozen['a'].append(3),
+        lambda: frozen['a'][1].setdefault('e', 4),
+        lambda: frozen['c'].__setitem__('d', 4),
+    ]
+    for modification in modifications:
+        with pytest.raises(utils.FrozenError):
+            modification()
+    assert frozen == given
+
+def test_freeze__not_copied():
+    "frozen data is shared rather than copied"
+    frozen = utils.freeze({'a': [1, 2, 3]})
+    assert utils.freeze(frozen) is frozen
+    assert utils.deepcopy(frozen) is frozen
+
+def test_freeze__assoc_dissoc():
+    "new versions of frozen data share unmodified values"
+    frozen = utils.freeze({'a': [1, 2, 3], 'b': {'c': 1}})
+    assert frozen.assoc('b', {'c': 2}) == {'a': [1, 2, 3], 'b': {'c': 2}}
+    assert frozen.assoc('b', {'c': 2})['a'] is frozen['a']
+    assert frozen.dissoc('b') == {'a': [1, 2, 3]}
+    assert frozen == {'a': [1, 2, 3], 'b': {'c': 1}}
+
+def test_thaw():
+    "thawed data can be modified without modifying the frozen data"
+    given = {'a': [1, {'b': 2}], 'c': OrderedDict([('d', 3)])}
+    frozen = utils.freeze(given)
+    thawed = utils.thaw(frozen)
+    assert thawed == given
+    assert type(thawed['c']) is OrderedDict
+    thawed['a'].append(3)
+    assert frozen == given
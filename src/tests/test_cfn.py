@@ -5,6 +5,7 @@ import pytest
 
 import utils
 from buildercore import cfngen, context_handler
+from cfn import destroy_many as destroy_many_task
 from cfn import generate_stack_from_input, owner_ssh, ssh
 
 from . import base
@@ -58,6 +59,29 @@ def test_launch_project_with_unique_altconfig(test_projects):
             generate_stack_from_input(pname, instance_id, alt_config)
         assert str(exc.value) == expected_msg
 
+@patch('utils.get_input', return_value='destroy 2 stacks')
+@patch('buildercore.bootstrap.destroy_many')
+@patch('buildercore.core.find_stacks')
+@patch('buildercore.core.find_region', return_value='us-east-1')
+def test_destroy_many_task(_, find_stacks, destroy_many, get_input, test_projects):
+    "stacks whose whole name matches the pattern are destroyed and a task failure is raised if any stack couldn't be"
+    find_stacks.return_value = [{'StackName': stackname} for stackname in ['dummy1--ci', 'dummy1--ci2', 'dummy1--prod', 'dummy2--end2end', 'foo']]
+    destroy_many.return_value = {'dummy1--ci': (60, None), 'dummy2--end2end': (120, RuntimeError("stack cannot be deleted"))}
+    with pytest.raises(utils.TaskExit, match="1 stacks failed"):
+        destroy_many_task(".+--(ci|end2end)", concurrency='2')
+    destroy_many.assert_called_once_with(['dummy1--ci', 'dummy2--end2end'], concurrency=2)
+
+@patch('buildercore.config.BUILDER_NON_INTERACTIVE', True)
+@patch('buildercore.bootstrap.destroy_many')
+@patch('buildercore.core.find_stacks')
+@patch('buildercore.core.find_region', return_value='us-east-1')
+def test_destroy_many_task__non_interactive(_, find_stacks, destroy_many, test_projects):
+    "stacks are never destroyed without the confirmation being typed in"
+    find_stacks.return_value = [{'StackName': 'dummy1--ci'}]
+    with pytest.raises(IOError, match="non-interactive mode"):
+        destroy_many_task(".+--ci")
+    destroy_many.assert_not_called()
+
 class TestCfn(base.BaseCase):
     def setUp(self):
         self.reset_stack_author = base.set_config('STACK_AUTHOR', 'my_user')
@@ -0,0 +1,59 @@
+import importlib
+import json
+import sys
+from io import StringIO
+from os.path import join
+from unittest.mock import patch
+
+import pytest
+
+import profiling
+
+
+def test_import_timer(datadir):
+    "the time taken to import a module, including and excluding the modules it imports, is recorded"
+    with open(join(datadir, 'profiling_fixture_a.py'), 'w') as fh:
+        fh.write("import profiling_fixture_b\n")
+    with open(join(datadir, 'profiling_fixture_b.py'), 'w') as fh:
+        fh.write("answer = 42\n")
+
+    timer = profiling.ImportTimer()
+    sys.meta_path.insert(0, timer)
+    sys.path.insert(0, datadir)
+    try:
+        importlib.import_module('profiling_fixture_a')
+    finally:
+        sys.meta_path.remove(timer)
+        sys.path.remove(datadir)
+        sys.modules.pop('profiling_fixture_a', None)
+        sys.modules.pop('profiling_fixture_b', None)
+
+    a_elapsed, a_self = profiling.IMPORTS['profiling_fixture_a']
+    b_elapsed, b_self = profiling.IMPORTS['profiling_fixture_b']
+    # `b` imports nothing so all of its time is its own, `a` includes the time taken to import `b`.
+    assert b_self == b_elapsed
+    assert a_elapsed == pytest.approx(b_elapsed + a_self)
+    assert a_self > 0
+    assert b_self > 0
+
+def test_finish(datadir):
+    "the report is printed and written as JSON when `BUILDER_PROFILE_STARTUP` is a path"
+    path = join(datadir, 'report.json')
+    stderr = StringIO()
+    with patch('profiling.ENABLED', True), patch('profiling.SETTING', path), patch('profiling.MARKS', []), patch('sys.stderr', stderr):
+        profiling.mark('task called')
+        profiling.mark('task called')
+        profiling.finish()
+    with open(path) as fh:
+        data = json.load(fh)
+    assert data['until-task-called'] is not None
+    assert data['config'] # `buildercore.config` has been imported
+    assert "until task called" in stderr.getvalue()
+
+def test_finish__disabled():
+    "nothing is reported when profiling isn't enabled"
+    stderr = StringIO()
+    with patch('profiling.ENABLED', False), patch('sys.stderr', stderr):
+        profiling.mark('task called')
+        profiling.finish()
+    assert stderr.getvalue() == ""
@@ -1,6 +1,8 @@
+import subprocess
 import sys
 from functools import partial
 from io import StringIO
+from os.path import dirname
 
 import taskrunner as tr
 
@@ -127,3 +129,24 @@ class TaskRunner(base.BaseCase):
             'task_args': ['hello, world'],
             'task_kwargs': {}}
         self.assertEqual(expected, result_map)
+
+    def test_task_descriptions(self):
+        "the descriptions of tasks read from their source are the same as those of the imported task functions"
+        task_list = tr.UNQUALIFIED_TASK_LIST + tr.TASK_LIST + tr.UNQUALIFIED_DEBUG_TASK_LIST + tr.DEBUG_TASK_LIST
+        for task in task_list:
+            if not isinstance(task, str):
+                continue
+            task_map = tr.mk_task_map(task)
+            expected = tr.mk_task_map(tr.task_fn(task))
+            for key in ['name', 'path', 'short_description', 'long_description']:
+                self.assertEqual(expected[key], task_map[key], "%s of %r differs" % (key, task))
+
+    def test_task_modules_are_imported_lazily(self):
+        "listing tasks and calling a builtin task doesn't import any task modules"
+        script = """
+import sys, taskrunner
+taskrunner.exec_task('ping', taskrunner.generate_task_list(show_debug_tasks=True))
+print(sorted({'cfn', 'lifecycle', 'report', 'decorators', 'buildercore.core'} & set(sys.modules)))
+"""
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=dirname(tr.__file__), stderr=subprocess.DEVNULL)
+        self.assertEqual("pong\n[]", output.decode().strip())
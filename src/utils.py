@@ -139,7 +139,11 @@ def walk_nested_struct(val, fn):
     return fn(val)
 
 def mkdirp(path):
-    return os.system("mkdir -p %s" % path) == 0
+    try:
+        os.makedirs(path, exist_ok=True)
+        return True
+    except OSError:
+        return False
 
 def pwd():
     return os.path.dirname(os.path.realpath(__file__))